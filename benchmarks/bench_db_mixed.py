@@ -0,0 +1,111 @@
+"""
+Trade latency under a mixed read/write load: trades running while admin reports and
+portfolio views read the same database.
+
+Compares the old setup (one connection in rollback-journal mode for everything) with a
+WAL writer plus a pool of read-only connections.
+
+Run from the repository root:
+    python -m benchmarks.bench_db_mixed
+"""
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from database.migrations import migrate
+from database.pool import ReaderPool, open_writer, read_connection
+from database.trading import buy_stock
+
+USERS = 2000
+HISTORY_ROWS = 200_000
+TRADES = 300
+REPORTS = 40
+PORTFOLIOS = 300
+READERS = 4
+
+# Roughly what an admin report over all trades costs
+REPORT_QUERY = 'SELECT user_id, stock, SUM(price * quantity), COUNT(*) FROM history GROUP BY user_id, stock'
+PORTFOLIO_QUERY = 'SELECT s.stock, s.quantity, u.cash FROM users u LEFT JOIN user_savings s ON u.id = s.user_id WHERE u.id = ?'
+
+
+async def populate(path: str) -> None:
+    rng = random.Random(1)
+    async with aiosqlite.connect(path) as db:
+        await migrate(db)
+        await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(i, f'user{i}') for i in range(USERS)])
+        await db.executemany('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                             [(rng.randrange(USERS), rng.choice(['AAPL', 'IBM', 'MSFT', 'TSLA']), rng.uniform(50, 500), rng.randint(1, 20))
+                              for _ in range(HISTORY_ROWS)])
+        await db.commit()
+
+
+async def run_load(db: aiosqlite.Connection, readers: ReaderPool | None) -> dict:
+    rng = random.Random(2)
+    latencies = []
+
+    async def trade(user_id: int):
+        await asyncio.sleep(rng.random() * 2)
+        started = time.perf_counter()
+        await buy_stock(db, user_id, 'AAPL', '1.00', 1)
+        latencies.append(time.perf_counter() - started)
+
+    async def report():
+        await asyncio.sleep(rng.random() * 2)
+        async with read_connection(readers, db) as reader, reader.execute(REPORT_QUERY) as query:
+            await query.fetchall()
+
+    async def portfolio(user_id: int):
+        await asyncio.sleep(rng.random() * 2)
+        async with read_connection(readers, db) as reader, reader.execute(PORTFOLIO_QUERY, (user_id,)) as query:
+            await query.fetchall()
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(trade(rng.randrange(USERS)) for _ in range(TRADES)),
+        *(report() for _ in range(REPORTS)),
+        *(portfolio(rng.randrange(USERS)) for _ in range(PORTFOLIOS)),
+    )
+    latencies.sort()
+    return {
+        'wall': time.perf_counter() - started,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95)],
+        'max': latencies[-1],
+    }
+
+
+async def single_connection(path: str) -> dict:
+    async with aiosqlite.connect(path) as db:
+        return await run_load(db, None)
+
+
+async def wal_with_readers(path: str) -> dict:
+    db = await open_writer(path)
+    readers = ReaderPool(path, READERS)
+    await readers.open()
+    try:
+        return await run_load(db, readers)
+    finally:
+        await readers.close()
+        await db.close()
+
+
+async def main() -> None:
+    print(f'{USERS} users, {HISTORY_ROWS:,} history rows; {TRADES} trades, {REPORTS} reports, {PORTFOLIOS} portfolio views\n')
+    print(f'{"setup":<30} {"wall s":>8} {"trade p50 ms":>13} {"p95 ms":>9} {"max ms":>9}')
+
+    for name, setup in (('one connection (before)', single_connection), (f'WAL + {READERS} readers', wal_with_readers)):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.db')
+            await populate(path)
+            result = await setup(path)
+        print(f'{name:<30} {result["wall"]:>8.2f} {result["p50"] * 1e3:>13.1f} {result["p95"] * 1e3:>9.1f} {result["max"] * 1e3:>9.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
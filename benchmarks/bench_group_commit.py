@@ -0,0 +1,72 @@
+"""
+Trade throughput and latency with one commit per trade versus group commit.
+
+Run from the repository root:
+    python -m benchmarks.bench_group_commit
+"""
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from database.migrations import migrate
+from database.pool import open_writer
+from database.trading import GroupCommitWriter, _buy, transaction
+
+USERS = 200
+TRADES = 1000
+ARRIVAL = 0.5  # seconds over which the trades arrive
+
+
+async def run(db, commit) -> tuple[float, list[float]]:
+    rng = random.Random(1)
+    latencies = []
+
+    async def trade(user_id: int):
+        await asyncio.sleep(rng.random() * ARRIVAL)
+        started = time.perf_counter()
+        await commit(lambda conn: _buy(conn, user_id, 'AAPL', '1.00', 1))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(trade(rng.randrange(USERS)) for _ in range(TRADES)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+async def one_per_trade(db):
+    async def commit(work):
+        async with transaction(db):
+            return await work(db)
+    return await run(db, commit), None
+
+
+async def group_commit(db):
+    writer = GroupCommitWriter(db)
+    return await run(db, writer.submit), writer.stats()
+
+
+async def main() -> None:
+    print(f'{TRADES} trades from {USERS} users arriving over {ARRIVAL}s\n')
+    print(f'{"synchronous":<12} {"commit":<16} {"trades/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"avg batch":>10} {"max batch":>10}')
+
+    for synchronous in ('FULL', 'NORMAL'):
+        for name, setup in (('per trade', one_per_trade), ('group', group_commit)):
+            with tempfile.TemporaryDirectory() as directory:
+                db = await open_writer(os.path.join(directory, 'bench.db'))
+                await db.execute(f'PRAGMA synchronous = {synchronous}')
+                await migrate(db)
+                await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(i, f'user{i}') for i in range(USERS)])
+                await db.commit()
+
+                (wall, latencies), stats = await setup(db)
+                await db.close()
+
+            batches = f'{stats["avg_batch"]:>10.1f} {stats["max_batch"]:>10}' if stats else f'{1:>10.1f} {1:>10}'
+            print(f'{synchronous:<12} {name:<16} {TRADES / wall:>9.0f} {statistics.median(latencies) * 1e3:>8.1f} '
+                  f'{latencies[int(len(latencies) * 0.95)] * 1e3:>8.1f} {batches}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
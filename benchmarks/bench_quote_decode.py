@@ -0,0 +1,78 @@
+"""
+Compares the cost of getting one close out of a TIME_SERIES_DAILY payload.
+
+Run from the repository root:
+    python -m benchmarks.bench_quote_decode
+"""
+import datetime
+import json
+import time
+
+from market.decode import DailySeriesReader, latest_close
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ITERATIONS = 2000
+
+
+def compact_payload(days: int = 100) -> bytes:
+    # Same shape and formatting as the real "compact" response: 100 trading days, indented
+    day = datetime.date(2025, 11, 6)
+    series = {}
+    while len(series) < days:
+        if day.weekday() < 5:
+            series[day.isoformat()] = {
+                '1. open': '306.7500',
+                '2. high': '315.4400',
+                '3. low': '301.0900',
+                '4. close': '312.4200',
+                '5. volume': '6818521',
+            }
+        day -= datetime.timedelta(days=1)
+
+    return json.dumps({
+        'Meta Data': {
+            '1. Information': 'Daily Prices (open, high, low, close) and Volumes',
+            '2. Symbol': 'IBM',
+            '3. Last Refreshed': '2025-11-06',
+            '4. Output Size': 'Compact',
+            '5. Time Zone': 'US/Eastern',
+        },
+        'Time Series (Daily)': series,
+    }, indent=4).encode()
+
+
+def full_parse(raw: bytes, loads) -> tuple[str, str]:
+    # The original path: decode everything, then search the newest day
+    time_series = loads(raw)['Time Series (Daily)']
+    as_of = max(time_series.keys())
+    return as_of, time_series[as_of]['4. close']
+
+
+def measure(name: str, parse, raw: bytes, parsed_bytes: int) -> None:
+    started = time.process_time()
+    for _ in range(ITERATIONS):
+        parse(raw)
+    cpu = (time.process_time() - started) / ITERATIONS
+    print(f'{name:<28} {parsed_bytes:>12,} {cpu * 1e6:>12.1f}')
+
+
+def main() -> None:
+    raw = compact_payload()
+
+    reader = DailySeriesReader(raw)
+    next(iter(reader))
+
+    print(f'payload: {len(raw):,} bytes, {ITERATIONS} iterations\n')
+    print(f'{"path":<28} {"bytes parsed":>12} {"CPU us/quote":>12}')
+    measure('json full parse (before)', lambda data: full_parse(data, json.loads), raw, len(raw))
+    if orjson:
+        measure('orjson full parse', lambda data: full_parse(data, orjson.loads), raw, len(raw))
+    measure('streaming latest_close', latest_close, raw, reader.position)
+
+
+if __name__ == '__main__':
+    main()
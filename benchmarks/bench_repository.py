@@ -0,0 +1,170 @@
+"""
+Read requests of the bot through three data layers on the same database:
+
+- raw aiosqlite: hand-written SQL on the reader pool (before);
+- SQLAlchemy's asyncio engine: the repository's statements executed through an AsyncEngine
+  with its own pool of aiosqlite connections;
+- the repository: the same statements compiled once and run on the reader pool.
+
+The raw path runs the repository's SQL text, so all three differ in the data layer only.
+The AsyncEngine row needs greenlet (pip install "sqlalchemy[asyncio]").
+
+Run from the repository root:
+    python -m benchmarks.bench_repository
+"""
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import repository
+from database.migrations import migrate
+from database.pool import ReaderPool
+from database.repository import Repository, compiled
+
+USERS = 5000
+HISTORY_PER_USER = 20
+REQUESTS = 4000
+CONCURRENCY = 64
+POOL_SIZE = 4
+
+RAW = {name: compiled(getattr(repository, name)) for name in ('CASH', 'HOLDINGS', 'PORTFOLIO', 'USERS_AFTER', 'RECENT_HISTORY', 'USER')}
+
+
+async def populate(path: str) -> None:
+    rng = random.Random(1)
+    async with aiosqlite.connect(path) as db:
+        await db.execute('PRAGMA journal_mode = WAL')
+        await migrate(db)
+        await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(i, f'user{i}') for i in range(USERS)])
+        await db.executemany('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                             [(i, rng.choice(['AAPL', 'IBM', 'MSFT']), rng.uniform(50, 500), rng.randint(1, 20))
+                              for i in range(USERS) for _ in range(HISTORY_PER_USER)])
+        await db.execute("""INSERT INTO user_savings (user_id, stock, quantity, cost_basis)
+                            SELECT user_id, stock, SUM(quantity), SUM(quantity * price) FROM history GROUP BY user_id, stock""")
+        await db.commit()
+
+
+def workload() -> list[tuple[str, int]]:
+    rng = random.Random(2)
+    kinds = ['cash', 'holdings', 'portfolio', 'users_page', 'report']
+    return [(rng.choice(kinds), rng.randrange(USERS)) for _ in range(REQUESTS)]
+
+
+async def raw_path(path: str, requests: list[tuple[str, int]]) -> tuple[float, list[float]]:
+    readers = ReaderPool(path, POOL_SIZE)
+    await readers.open()
+
+    async def query(reader, name, **params):
+        sql, names, defaults = RAW[name]
+        async with reader.execute(sql, [params.get(key, defaults[key]) for key in names]) as cursor:
+            return await cursor.fetchall()
+
+    async def request(kind, user_id):
+        async with readers.connection() as reader:
+            if kind == 'cash':
+                await query(reader, 'CASH', user_id=user_id)
+            elif kind == 'holdings':
+                await query(reader, 'HOLDINGS', user_id=user_id)
+            elif kind == 'portfolio':
+                await query(reader, 'PORTFOLIO', user_id=user_id)
+            elif kind == 'users_page':
+                await query(reader, 'USERS_AFTER', after=user_id, limit=21)
+            else:
+                await query(reader, 'USER', user_id=user_id)
+                await query(reader, 'HOLDINGS', user_id=user_id)
+                await query(reader, 'RECENT_HISTORY', user_id=user_id, limit=5)
+
+    try:
+        return await run(requests, request)
+    finally:
+        await readers.close()
+
+
+async def engine_path(path: str, requests: list[tuple[str, int]]) -> tuple[float, list[float]]:
+    engine = create_async_engine(f'sqlite+aiosqlite:///file:{path}?mode=ro&uri=true', pool_size=POOL_SIZE, max_overflow=0)
+
+    async def request(kind, user_id):
+        async with engine.connect() as conn:
+            if kind == 'cash':
+                await conn.execute(repository.CASH, {'user_id': user_id})
+            elif kind == 'holdings':
+                await conn.execute(repository.HOLDINGS, {'user_id': user_id})
+            elif kind == 'portfolio':
+                await conn.execute(repository.PORTFOLIO, {'user_id': user_id})
+            elif kind == 'users_page':
+                await conn.execute(repository.USERS_AFTER, {'after': user_id, 'limit': 21})
+            else:
+                await conn.execute(repository.USER, {'user_id': user_id})
+                await conn.execute(repository.HOLDINGS, {'user_id': user_id})
+                await conn.execute(repository.RECENT_HISTORY, {'user_id': user_id, 'limit': 5})
+
+    try:
+        # Open the pool's connections before timing, as ReaderPool.open does
+        await asyncio.gather(*(request('cash', 0) for _ in range(POOL_SIZE)))
+        return await run(requests, request)
+    finally:
+        await engine.dispose()
+
+
+async def repository_path(path: str, requests: list[tuple[str, int]]) -> tuple[float, list[float]]:
+    readers = ReaderPool(path, POOL_SIZE)
+    await readers.open()
+    repo = Repository(None, readers)
+
+    async def request(kind, user_id):
+        if kind == 'cash':
+            await repo.cash(user_id)
+        elif kind == 'holdings':
+            await repo.holdings(user_id)
+        elif kind == 'portfolio':
+            await repo.portfolio(user_id)
+        elif kind == 'users_page':
+            await repo.users_page(after=user_id)
+        else:
+            await repo.user_report(user_id=user_id)
+
+    try:
+        return await run(requests, request)
+    finally:
+        await readers.close()
+
+
+async def run(requests, request) -> tuple[float, list[float]]:
+    latencies = []
+    limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def timed(kind, user_id):
+        async with limit:
+            started = time.perf_counter()
+            await request(kind, user_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(kind, user_id) for kind, user_id in requests))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+async def main() -> None:
+    requests = workload()
+    print(f'{USERS} users, {USERS * HISTORY_PER_USER:,} history rows; {REQUESTS} requests, {CONCURRENCY} at a time, '
+          f'{POOL_SIZE} connections\n')
+    print(f'{"path":<28} {"requests/s":>11} {"p50 ms":>8} {"p95 ms":>8}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        await populate(path)
+        for name, setup in (('raw aiosqlite (before)', raw_path), ('SQLAlchemy AsyncEngine', engine_path),
+                            ('repository', repository_path)):
+            wall, latencies = await setup(path, requests)
+            print(f'{name:<28} {REQUESTS / wall:>11.0f} {statistics.median(latencies) * 1e3:>8.2f} '
+                  f'{latencies[int(len(latencies) * 0.95)] * 1e3:>8.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
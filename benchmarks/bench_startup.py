@@ -0,0 +1,75 @@
+"""
+Database part of the bot's startup: re-running every CREATE statement on each start (before)
+versus the migration runner on an up-to-date database, plus the cost of importing the models.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from database.migrations import MIGRATIONS, migrate
+
+STARTS = 50
+USERS = 5000
+HOLDINGS_PER_USER = 4
+
+
+async def populate(path: str) -> None:
+    async with aiosqlite.connect(path) as db:
+        await migrate(db)
+        await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(i, f'user{i}') for i in range(USERS)])
+        await db.executemany('INSERT INTO user_savings (user_id, stock, quantity, cost_basis) VALUES (?, ?, ?, ?)',
+                             [(i, f'S{j}', 1, 1.0) for i in range(USERS) for j in range(HOLDINGS_PER_USER)])
+        await db.commit()
+
+
+async def rerun_all(db: aiosqlite.Connection) -> None:
+    # What run.py did on every start: every CREATE ... IF NOT EXISTS, the column check and the
+    # scan for holdings without a cost basis
+    await db.execute('BEGIN')
+    for _, step in MIGRATIONS:
+        await step(db)
+    await db.commit()
+
+
+async def measure(path: str, startup) -> float:
+    started = time.perf_counter()
+    for _ in range(STARTS):
+        async with aiosqlite.connect(path) as db:
+            await startup(db)
+    return (time.perf_counter() - started) / STARTS
+
+
+def import_time(statement: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], check=True, capture_output=True)
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        await populate(path)
+
+        print(f'{USERS} users, {USERS * HOLDINGS_PER_USER} holdings, {STARTS} starts\n')
+        print(f'{"schema step":<40} {"ms/start":>9}')
+        print(f'{"re-run all DDL (before)":<40} {await measure(path, rerun_all) * 1e3:>9.2f}')
+        print(f'{"migrate, up to date":<40} {await measure(path, migrate) * 1e3:>9.2f}')
+
+        # The models used to create an engine on test.db and run create_all at import
+        models_before = ("import database.models as m; from sqlalchemy import create_engine; "
+                         f"m.Base.metadata.create_all(create_engine('sqlite:///{os.path.join(directory, 'test.db')}', echo=True))")
+        print(f'\n{"import database.models":<40} {"ms":>9}')
+        print(f'{"with engine + create_all (before)":<40} {import_time(models_before) * 1e3:>9.1f}')
+        print(f'{"side-effect free":<40} {import_time("import database.models") * 1e3:>9.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,207 @@
+"""
+Update throughput and latency with long polling versus a webhook, against a local fake Telegram.
+
+The fake Telegram queues updates arriving at a steady rate and hands them out through
+getUpdates, or POSTs them to the webhook with at most WEBHOOK_CONNECTIONS requests open,
+as Telegram does. It runs in its own process, so the bot's event loop only does the bot's
+work. The handler simulates WORK seconds of database and API time, then replies; latency
+runs from an update's arrival to the reply reaching the fake Telegram.
+
+Run from the repository root:
+    python -m benchmarks.bench_updates
+"""
+import asyncio
+import json
+import multiprocessing
+import socket
+import statistics
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import ClientSession, TCPConnector, web
+
+from bot.webhook import build_app
+
+TOKEN = '42:bench'
+SECRET = 'bench-secret'
+UPDATES = 2000
+RATES = (100, 200, 400)  # updates per second arriving at Telegram
+WORK = 0.02  # seconds each update takes to handle
+CONCURRENCY = 64  # updates handled at once, for both modes
+WEBHOOK_CONNECTIONS = 40  # Telegram's default max_connections
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id: int) -> dict:
+    user = {'id': 1 + update_id % 500, 'is_bot': False, 'first_name': 'user'}
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': str(update_id),
+        'chat': {'id': user['id'], 'type': 'private'}, 'from': user,
+    }}
+
+
+class FakeTelegram:
+    """
+    The Bot API methods the benchmark uses, plus the arrival of updates.
+
+    Runs in its own process, so its HTTP work does not compete with the bot's event loop.
+    """
+
+    def __init__(self, mode: str, rate: float, webhook_url: str):
+        self.mode = mode
+        self.rate = rate
+        self.webhook_url = webhook_url
+        self.pending: list[dict] = []
+        self.arrived = asyncio.Event()
+        self.created: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        method = request.match_info['method'].lower()
+        if method == 'getupdates':
+            result = await self.get_updates(int(data.get('offset', 0)), float(data.get('timeout', 0)))
+        elif method == 'sendmessage':
+            result = self.reply(int(data['chat_id']), data['text'])
+        elif method == 'getme':
+            result = {'id': 42, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(self, offset: int, timeout: float) -> list[dict]:
+        self.pending = [update for update in self.pending if update['update_id'] >= offset]
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:100]
+
+    def reply(self, chat_id: int, text: str) -> dict:
+        # Update 0 warms the bot up before the run
+        if int(text) in self.created:
+            self.latencies.append(time.monotonic() - self.created[int(text)])
+            if len(self.latencies) == UPDATES:
+                self.done.set()
+        return {'message_id': len(self.latencies), 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}}
+
+    async def arrive(self, deliver) -> None:
+        """Creates UPDATES updates at `rate` per second and passes each to `deliver`."""
+        started = time.monotonic()
+        for update_id in range(1, UPDATES + 1):
+            delay = started + update_id / self.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.created[update_id] = time.monotonic()
+            deliver(make_update(update_id))
+
+    async def run(self, port: int, pipe) -> None:
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        pipe.send('ready')
+        await asyncio.get_running_loop().run_in_executor(None, pipe.recv)
+
+        started = time.monotonic()
+        if self.mode == 'polling':
+            await self.arrive(self.queue)
+            await self.done.wait()
+        else:
+            async with ClientSession(connector=TCPConnector(limit=WEBHOOK_CONNECTIONS)) as self.client:
+                posts = []
+                await self.arrive(lambda update: posts.append(asyncio.create_task(self.post(update))))
+                await asyncio.gather(*posts)
+                await self.done.wait()
+        pipe.send((time.monotonic() - started, self.latencies))
+        await runner.cleanup()
+
+    def queue(self, update: dict) -> None:
+        self.pending.append(update)
+        self.arrived.set()
+
+    async def post(self, update: dict) -> None:
+        async with self.client.post(self.webhook_url, data=json.dumps(update),
+                                    headers={'Content-Type': 'application/json',
+                                             'X-Telegram-Bot-Api-Secret-Token': SECRET}) as response:
+            assert response.status == 200
+
+
+def telegram_process(mode: str, rate: float, port: int, webhook_url: str, pipe) -> None:
+    asyncio.run(FakeTelegram(mode, rate, webhook_url).run(port, pipe))
+
+
+def make_dispatcher() -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        await asyncio.sleep(WORK)
+        await message.answer(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def measure(mode: str, rate: float) -> tuple[float, list[float]]:
+    loop = asyncio.get_running_loop()
+    api_port, webhook_port = free_port(), free_port()
+    pipe, child = multiprocessing.Pipe()
+    telegram = multiprocessing.Process(target=telegram_process,
+                                       args=(mode, rate, api_port, f'http://127.0.0.1:{webhook_port}/webhook', child))
+    telegram.start()
+    await loop.run_in_executor(None, pipe.recv)
+
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{api_port}')))
+    dp = make_dispatcher()
+    # Builds the models' validators, which pydantic does on first use
+    await dp.feed_raw_update(bot, make_update(0))
+    if mode == 'polling':
+        bot_task = asyncio.create_task(dp.start_polling(bot, polling_timeout=5, handle_signals=False,
+                                                        tasks_concurrency_limit=CONCURRENCY))
+    else:
+        app, _ = build_app(dp, bot, '/webhook', SECRET, CONCURRENCY)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', webhook_port).start()
+
+    pipe.send('go')
+    wall, latencies = await loop.run_in_executor(None, pipe.recv)
+
+    if mode == 'polling':
+        await dp.stop_polling()
+        await bot_task
+    else:
+        # Also closes the bot session, through the handler's shutdown hook
+        await runner.cleanup()
+    telegram.join()
+    return wall, sorted(latencies)
+
+
+async def main() -> None:
+    print(f'{UPDATES} updates, {WORK * 1e3:.0f} ms of work each, {CONCURRENCY} handled at once\n')
+    print(f'{"arrivals/s":>10} {"mode":<10} {"updates/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for rate in RATES:
+        for mode in ('polling', 'webhook'):
+            wall, latencies = await measure(mode, rate)
+            print(f'{rate:>10} {mode:<10} {UPDATES / wall:>10.0f} {statistics.median(latencies) * 1e3:>8.1f} '
+                  f'{latencies[int(len(latencies) * 0.99)] * 1e3:>8.1f} {latencies[-1] * 1e3:>8.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
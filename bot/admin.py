@@ -2,21 +2,25 @@ import logging
 
 import aiosqlite
 
-from aiogram import Bot, F, Router
+from aiogram import F, Router
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from .handlers import delete_unwanted
-from config.config import ADMIN_IDS, IGNORE_SENDER
+from config.config import ADMIN_IDS, IGNORE_SENDER, REPORT_HISTORY_SIZE
 from .keyboards import Keyboards
-from config.callbacks import CHECK_USER_CB, SHOW_ALL_CB, BROADCAST_CB, DELETE_USER_CB
-from helpers import get_full_user_report, send_message
+from config.callbacks import CHECK_USER_CB, SHOW_ALL_CB, BROADCAST_CB, DELETE_USER_CB, USERS_NEXT_CB, USERS_PREV_CB, \
+    BROADCAST_PAUSE_CB, BROADCAST_RESUME_CB, BROADCAST_CANCEL_CB, BROADCAST_STATUS_CB
+from .broadcast import BroadcastJobs
+from database.repository import Repository
+from database.trading import delete_user
 from config.strings import DEFAULT_HELLO
 from config.strings_admin import SELECT_ACTION, NO_USERS, FOUND_USERS, PROMPT_TYPE_USER_ID, USER_LIST_ITEM, \
-    ERROR_USERS_FETCH, ERROR_USER_NOT_FOUND, PROMPT_TYPE_TEXT, RESULT_SEND, PROMPT_TYPE_USER_ID_DELETE, PROMPT_TYPE_YES, \
-    SUCCESS_DELETE, ERROR_DELETE_USER
+    ERROR_USERS_FETCH, ERROR_USER_NOT_FOUND, PROMPT_TYPE_TEXT, PROMPT_TYPE_USER_ID_DELETE, PROMPT_TYPE_YES, \
+    SUCCESS_DELETE, ERROR_DELETE_USER, BROADCAST_STARTED, BROADCAST_NOT_CHANGED
 
 admin_router = Router()
 
@@ -52,25 +56,51 @@ async def admin_init(message: Message):
     await message.answer(text=SELECT_ACTION, reply_markup=Keyboards.admin_keyboard())
 
 
-# Show all users callback
+async def users_page_message(repo: Repository, after: int | None = None, before: int | None = None):
+    users_list, has_prev, has_next = await repo.users_page(after=after, before=before)
+    if not users_list:
+        return NO_USERS, Keyboards.admin_keyboard()
+
+    total = await repo.count_users()
+
+    formatted_message = [FOUND_USERS.format(quantity=total) + '\n']
+
+    for user_id, cash, created, username in users_list:
+        formatted_message.append(USER_LIST_ITEM.format(user_id=user_id, username=username, cash=cash, created=created))
+        formatted_message.append(f'--------------')
+
+    keyboard = Keyboards.users_page_keyboard(users_list[0][0], users_list[-1][0], has_prev, has_next)
+    return '\n'.join(formatted_message), keyboard
+
+
+# Show all users callback, first page
 @admin_router.callback_query(F.data==SHOW_ALL_CB, F.from_user.id.in_(ADMIN_IDS))
-async def show_all_users(callback: CallbackQuery, db: aiosqlite.Connection):
+async def show_all_users(callback: CallbackQuery, repo: Repository):
     try:
-        async with db.execute('SELECT * FROM users') as query:
-            users_list = await query.fetchall()
+        text, keyboard = await users_page_message(repo)
 
-        if users_list is None:
-            await callback.message.answer(text=NO_USERS, reply_markup=Keyboards.admin_keyboard())
+        await callback.message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+    except Exception as e:
+        logging.error(f'Error in show_all_users: {e}')
+        await callback.message.answer(text=ERROR_USERS_FETCH, reply_markup=Keyboards.admin_keyboard())
+    finally:
+        await callback.answer()
 
-        formatted_message = [FOUND_USERS.format(quantity=len(users_list)) + '\n']
 
-        for user_id, cash, created, username in users_list:
-            formatted_message.append(USER_LIST_ITEM.format(user_id=user_id, username=username, cash=cash, created=created))
-            formatted_message.append(f'--------------')
+# Next and previous pages of the user list, shown in the same message
+@admin_router.callback_query(F.data.startswith(USERS_NEXT_CB) | F.data.startswith(USERS_PREV_CB), F.from_user.id.in_(ADMIN_IDS))
+async def show_users_page(callback: CallbackQuery, repo: Repository):
+    try:
+        if callback.data.startswith(USERS_NEXT_CB):
+            page = {'after': int(callback.data.removeprefix(USERS_NEXT_CB))}
+        else:
+            page = {'before': int(callback.data.removeprefix(USERS_PREV_CB))}
+
+        text, keyboard = await users_page_message(repo, **page)
 
-        await callback.message.answer('\n'.join(formatted_message), reply_markup=Keyboards.admin_keyboard(), parse_mode='HTML')
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
     except Exception as e:
-        logging.error(f'Error in show_all_users: {e}')
+        logging.error(f'Error in show_users_page: {e}')
         await callback.message.answer(text=ERROR_USERS_FETCH, reply_markup=Keyboards.admin_keyboard())
     finally:
         await callback.answer()
@@ -86,7 +116,7 @@ async def check_user_start(callback: CallbackQuery, state: FSMContext):
 
 # Return full user info
 @admin_router.message(AdminStates.waiting_user_id_check, F.from_user.id.in_(ADMIN_IDS))
-async def get_user_info(message: Message, state: FSMContext, db: aiosqlite.Connection):
+async def get_user_info(message: Message, state: FSMContext, repo: Repository):
     user_id = None
     username = None
 
@@ -98,7 +128,7 @@ async def get_user_info(message: Message, state: FSMContext, db: aiosqlite.Conne
         if username[0] == '@':
             username = username[1:]
     
-    report = await get_full_user_report(db=db, user_id=user_id, username=username)
+    report = await repo.user_report(user_id=user_id, username=username)
     
     if not report:
         await message.answer(text=ERROR_USER_NOT_FOUND.format(user_id=user_id if user_id else username),
@@ -120,14 +150,14 @@ async def get_user_info(message: Message, state: FSMContext, db: aiosqlite.Conne
         for stock, quantity in report['savings']:
             response.append(f'  • {stock}: {quantity} pcs')
             
-    response.append('\nUser\'s history(Last 5 transactions):')
+    response.append(f'\nUser\'s history(Last {REPORT_HISTORY_SIZE} transactions):')
     if not report['history']:
         response.append('User didn\'t make any transactions yet')
         await state.clear()
         await message.answer('\n'.join(response), reply_markup=Keyboards.admin_keyboard(), parse_mode='HTML')
         return
     else:
-        for transaction_id, stock, price, quantity, time in report['history'][-5:]:
+        for transaction_id, stock, price, quantity, time in report['history']:
             action = 'Bought' if quantity > 0 else 'Sold'
             response.append(f'  • Transaction id: {transaction_id}. {action} {stock}: {abs(quantity)} pcs. Price for 1: {price}. Time: {time}')
             
@@ -145,36 +175,56 @@ async def broadcast_start(callback: CallbackQuery, state: FSMContext):
 
 # Broadcast message handler
 @admin_router.message(AdminStates.waiting_text_broadcast, F.from_user.id.in_(ADMIN_IDS))
-async def broadcast_send(message: Message, db: aiosqlite.Connection, state: FSMContext, bot: Bot, ignore_sender = IGNORE_SENDER):
+async def broadcast_send(message: Message, state: FSMContext, broadcasts: BroadcastJobs, ignore_sender = IGNORE_SENDER):
+    await state.clear()
+
     try:
-        if ignore_sender:
-            async with db.execute('SELECT id FROM users WHERE id != ?', (message.from_user.id,)) as query:
-                user_ids = await query.fetchall()
-        else:
-            async with db.execute('SELECT id FROM users') as query:
-                user_ids = await query.fetchall()
+        job = await broadcasts.create(admin_id=message.from_user.id, text=message.text,
+                                      exclude_id=message.from_user.id if ignore_sender else None)
     except Exception as e:
         logging.error(f'Error in broadcast_send: {e}')
         await message.answer(text=ERROR_USERS_FETCH, reply_markup=Keyboards.admin_keyboard())
-    
-    if not user_ids:
-        await state.clear()
+        return
+
+    if job is None:
         await message.answer(text=NO_USERS, reply_markup=Keyboards.admin_keyboard())
         return
-    
-    count = 0
-    
-    for (user_id,) in user_ids:
-        if await send_message(bot=bot, user_id=user_id, text=message.text):
-            count += 1
-    
-    await state.clear()
 
-    await message.answer(text=RESULT_SEND.format(message_text=message.text, count=count),
-                         reply_markup=Keyboards.admin_keyboard(),
-                         parse_mode='HTML'
-    )
-    
+    # The job runs in the background and edits this message with its progress
+    status = await message.answer(text=BROADCAST_STARTED.format(job_id=job['id'], total=job['total']),
+                                  reply_markup=Keyboards.broadcast_keyboard(job['id'], job['state']))
+    await broadcasts.set_status_message(job, status.message_id)
+    broadcasts.start(job)
+
+
+# Broadcast job controls on the status message
+@admin_router.callback_query(F.data.startswith(BROADCAST_PAUSE_CB) | F.data.startswith(BROADCAST_RESUME_CB) |
+                             F.data.startswith(BROADCAST_CANCEL_CB) | F.data.startswith(BROADCAST_STATUS_CB),
+                             F.from_user.id.in_(ADMIN_IDS))
+async def broadcast_control(callback: CallbackQuery, broadcasts: BroadcastJobs):
+    job_id = int(callback.data.split(':')[1])
+
+    changed = True
+    if callback.data.startswith(BROADCAST_PAUSE_CB):
+        changed = await broadcasts.pause(job_id)
+    elif callback.data.startswith(BROADCAST_RESUME_CB):
+        changed = await broadcasts.resume(job_id)
+    elif callback.data.startswith(BROADCAST_CANCEL_CB):
+        changed = await broadcasts.cancel(job_id)
+
+    job = await broadcasts.job(job_id)
+    if job is None:
+        await callback.answer()
+        return
+
+    try:
+        await callback.message.edit_text(text=broadcasts.status_text(job),
+                                         reply_markup=Keyboards.broadcast_keyboard(job_id, job['state']))
+    except TelegramBadRequest:
+        # Status unchanged since the last edit
+        pass
+    await callback.answer(text=None if changed else BROADCAST_NOT_CHANGED.format(job_id=job_id))
+
 
 # Delete user callback
 @admin_router.callback_query(F.data==DELETE_USER_CB, F.from_user.id.in_(ADMIN_IDS))
@@ -186,10 +236,9 @@ async def delete_user_start(callback: CallbackQuery, state: FSMContext):
 
 # Delete user handler
 @admin_router.message(AdminStates.waiting_user_id_delete, F.from_user.id.in_(ADMIN_IDS))
-async def confirm_user_delete(message: Message, state: FSMContext, db: aiosqlite.Connection):
-    async with db.execute('SELECT id FROM users WHERE id = ?', (message.text,)) as query:
-        user_id = await query.fetchone()
-        
+async def confirm_user_delete(message: Message, state: FSMContext, repo: Repository):
+    user_id = await repo.user(int(message.text)) if message.text.isdigit() else None
+
     if not user_id:
         await state.clear()
         await message.answer(text=ERROR_USER_NOT_FOUND.format(user_id=message.text), reply_markup=Keyboards.admin_keyboard())
@@ -212,25 +261,15 @@ async def user_delete(message: Message, state: FSMContext, db: aiosqlite.Connect
     
     
     try:
-        await db.execute('BEGIN')
-
-        await db.execute('DELETE FROM user_savings WHERE user_id = ?', (data['id'],))
-        await db.execute('DELETE FROM history WHERE user_id = ?', (data['id'],))
-        await db.execute('DELETE FROM users WHERE id = ?', (data['id'],))
-
-        await db.commit()
-        
-        await message.answer(text=SUCCESS_DELETE.format(user_id=data['id']),
-                             reply_markup=Keyboards.admin_keyboard()
-        )
-
+        await delete_user(db, data['id'])
     except Exception as e:
         logging.error(f"Failed to delete user {data['id']}: {e}")
-        await db.rollback()
         await message.answer(text=ERROR_DELETE_USER.format(e=e),
                              reply_markup=Keyboards.admin_keyboard()
         )
-
+    else:
+        await message.answer(text=SUCCESS_DELETE.format(user_id=data['id']),
+                             reply_markup=Keyboards.admin_keyboard()
+        )
     finally:
         await state.clear()
-    
\ No newline at end of file
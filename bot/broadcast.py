@@ -0,0 +1,481 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+import aiosqlite
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from config.config import BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_PROGRESS_INTERVAL, BROADCAST_FLOOD_RETRIES, \
+    UNREACHABLE_REPROBE_DAYS
+from config.strings_admin import BROADCAST_PROGRESS, BROADCAST_STATE, RESULT_SEND
+from database.broadcasts import DONE, PAUSED, RUNNING, CANCELLED, create_job, get_job, jobs_in_state, pending_recipients, \
+    record_results, set_job_state, set_status_message
+from database.pool import ReaderPool, read_connection
+from helpers import is_unreachable, send_message
+from .keyboards import Keyboards
+from .outbound import outbound_priority
+from market.scheduler import Priority, RequestScheduler
+
+
+class FloodGate:
+    """
+    Shared pause for everything that sends as the bot.
+
+    Telegram's flood control applies to the whole bot, so when one send is told to retry
+    after some seconds, every sender waits that long instead of running into the limit again.
+
+    Parameters:
+        clock: Callable[[], float]
+            Time source, in seconds.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._until = 0.0
+
+        self.pauses = 0
+        self.paused_seconds = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Closes the gate for `seconds`, or leaves it closed longer if it already is."""
+        until = self._clock() + seconds
+        if until > self._until:
+            self.paused_seconds += until - max(self._until, self._clock())
+            self._until = until
+        self.pauses += 1
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self._until - self._clock())
+
+    async def wait(self) -> None:
+        """Returns once the gate is open. A pause set while waiting is waited out too."""
+        while (delay := self.remaining) > 0:
+            await asyncio.sleep(delay)
+
+    def reset(self) -> None:
+        self._until = 0.0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+
+
+def format_duration(seconds: float) -> str:
+    """Formats seconds for the admin, e.g. '1h 05m', '3m 20s' or '12s'."""
+    seconds = round(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f'{hours}h {minutes:02d}m'
+    if minutes:
+        return f'{minutes}m {seconds:02d}s'
+    return f'{seconds}s'
+
+
+# Outcomes of a send; unreachable users blocked the bot or are gone, and later broadcasts skip them
+SENT = 'sent'
+FAILED = 'failed'
+UNREACHABLE = 'unreachable'
+
+# Telegram lets a bot send about 30 messages per second in total, so broadcasts share one
+# bucket and one flood gate however many of them run. The bucket caps broadcasts below the
+# bot's global rate in OutboundScheduler, which leaves room for replies to users
+broadcast_scheduler = RequestScheduler(rate=BROADCAST_RATE, burst=1, max_wait=60)
+flood_gate = FloodGate()
+
+
+class Broadcast:
+    """
+    Sends one text to many chats with a bounded pool of workers.
+
+    Chat ids are read chunk by chunk into a short queue, so memory does not grow with the
+    number of users. Each worker takes a token from `scheduler` before every send, which
+    keeps the whole broadcast at the scheduler's rate, and waits at `gate` while Telegram's
+    flood control is in effect. A send answered with TelegramRetryAfter closes the gate for
+    all workers and is retried once it opens, up to `flood_retries` times.
+
+    While it runs, `on_progress` is called every `progress_interval` seconds with `stats()`.
+    `stop` ends the broadcast early without cutting off sends in flight.
+
+    Parameters:
+        bot: Bot
+            The bot to send as.
+        text: str
+            HTML text of the message.
+        total: int | None
+            Expected number of chats, used for the ETA.
+        on_progress: Callable[[dict], Awaitable[None]] | None
+            Progress reporter, e.g. editing a message to the admin.
+        workers: int
+            Sends in flight at once.
+        progress_interval: float
+            Seconds between progress reports.
+        flood_retries: int
+            Times one chat is retried after a flood wait before it counts as failed.
+        scheduler: RequestScheduler
+            Rate limit shared by all broadcasts.
+        gate: FloodGate
+            Flood wait shared by all broadcasts.
+        clock: Callable[[], float]
+            Time source for throughput and ETA.
+        on_result: Callable[[int, str], None] | None
+            Called with each chat id and the outcome of its send: SENT, FAILED or UNREACHABLE.
+    """
+
+    def __init__(self, bot: Bot, text: str, total: int | None = None,
+                 on_progress: Callable[[dict], Awaitable[None]] | None = None,
+                 workers: int = BROADCAST_WORKERS, progress_interval: float = BROADCAST_PROGRESS_INTERVAL,
+                 flood_retries: int = BROADCAST_FLOOD_RETRIES, scheduler: RequestScheduler = broadcast_scheduler,
+                 gate: FloodGate = flood_gate, clock: Callable[[], float] = time.monotonic,
+                 on_result: Callable[[int, str], None] | None = None):
+        self.bot = bot
+        self.text = text
+        self.total = total
+        self.on_progress = on_progress
+        self.on_result = on_result
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.flood_retries = flood_retries
+        self.scheduler = scheduler
+        self.gate = gate
+        self._clock = clock
+
+        self.found = 0
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.flood_waits = 0
+        self.stopping = False
+        self.error: Exception | None = None
+        self.started: float | None = None
+        self.finished: float | None = None
+
+    async def deliver(self, chat_id: int) -> str:
+        """Sends the text to one chat, waiting for a token and for the flood gate. Returns SENT, FAILED or UNREACHABLE."""
+        for _ in range(self.flood_retries + 1):
+            try:
+                await self.scheduler.acquire(Priority.BACKGROUND)
+                await self.gate.wait()
+                return SENT if await send_message(bot=self.bot, user_id=chat_id, text=self.text) else FAILED
+            except TelegramRetryAfter as e:
+                logging.warning(f'Broadcast: flood limit exceeded at [ID:{chat_id}], pausing all senders for {e.retry_after}s')
+                self.flood_waits += 1
+                self.gate.pause(e.retry_after)
+            except TelegramAPIError as e:
+                if is_unreachable(e):
+                    return UNREACHABLE
+                logging.error(f'Broadcast: could not send to [ID:{chat_id}]: {e}')
+                return FAILED
+            except Exception as e:
+                logging.error(f'Broadcast: could not send to [ID:{chat_id}]: {e}')
+                return FAILED
+
+        logging.error(f'Broadcast: gave up on [ID:{chat_id}] after {self.flood_retries} flood waits')
+        return FAILED
+
+    async def _feed(self, chat_ids: AsyncIterator[list[int]], queue: asyncio.Queue) -> None:
+        try:
+            async for chunk in chat_ids:
+                self.found += len(chunk)
+                for chat_id in chunk:
+                    if self.stopping:
+                        break
+                    await queue.put(chat_id)
+                if self.stopping:
+                    break
+        except Exception as e:
+            logging.error(f'Broadcast: could not read recipients: {e}')
+            self.error = e
+            self.stop()
+        # Wakes the workers waiting for a chat; those that stopped on their own leave theirs
+        for _ in range(self.workers):
+            await queue.put(None)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while not self.stopping and (chat_id := await queue.get()) is not None:
+            outcome = await self.deliver(chat_id)
+            if outcome == SENT:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.unreachable += outcome == UNREACHABLE
+            if self.on_result is not None:
+                self.on_result(chat_id, outcome)
+
+    async def _report(self, finished: asyncio.Event) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(finished.wait(), self.progress_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.on_progress(self.stats())
+            except Exception as e:
+                logging.warning(f'Broadcast: progress report failed: {e}')
+
+    def stop(self) -> None:
+        """Stops handing out chats. Sends in flight finish and `run` returns after them."""
+        self.stopping = True
+
+    async def run(self, chat_ids: AsyncIterator[list[int]]) -> dict:
+        """
+        Sends to every chat in `chat_ids`, or until `stop`, and returns the final `stats()`.
+
+        Parameters:
+        chat_ids (AsyncIterator[list[int]]): Chunks of chat ids, e.g. a job's pending recipients.
+
+        Raises:
+        Exception: Whatever reading `chat_ids` raised. Sends in flight finish first.
+        """
+        self.started = self._clock()
+        queue = asyncio.Queue(self.workers * 2)
+        # Sends of the workers queue behind replies to users in the outbound scheduler
+        with outbound_priority(Priority.BACKGROUND):
+            feeder = asyncio.create_task(self._feed(chat_ids, queue))
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+            finished = asyncio.Event()
+            reporter = asyncio.create_task(self._report(finished)) if self.on_progress is not None else None
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in (feeder, *workers):
+                task.cancel()
+            await asyncio.gather(feeder, *workers, return_exceptions=True)
+            # A report in progress may be storing results, so it is finished rather than cancelled
+            finished.set()
+            if reporter is not None:
+                await reporter
+            self.finished = self._clock()
+
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self) -> dict:
+        done = self.sent + self.failed
+        elapsed = ((self.finished or self._clock()) - self.started) if self.started is not None else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        total = max(self.total or 0, self.found)
+        eta = (total - done) / rate if rate and total > done else 0.0
+        return {
+            'total': total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'unreachable': self.unreachable,
+            'flood_waits': self.flood_waits,
+            'elapsed': round(elapsed, 1),
+            'rate': round(rate, 1),
+            'eta': round(eta, 1),
+        }
+
+
+class _Cursor:
+    """
+    Position up to which every recipient of a job is done.
+
+    Recipients are handed out in chunks of increasing ids but finish in any order, so the
+    cursor only moves past a chunk once all of its recipients are done.
+    """
+
+    def __init__(self, position: int):
+        self.position = position
+        self._chunks: collections.deque[tuple[int, set[int]]] = collections.deque()
+
+    def add(self, chat_ids: list[int]) -> None:
+        self._chunks.append((chat_ids[-1], set(chat_ids)))
+
+    def done(self, chat_id: int) -> None:
+        for _, pending in self._chunks:
+            if chat_id in pending:
+                pending.discard(chat_id)
+                break
+        while self._chunks and not self._chunks[0][1]:
+            self.position = self._chunks.popleft()[0]
+
+
+def job_status_text(job: dict, stats: dict | None = None) -> str:
+    """Text of a job's status message; with the live `stats` of a running job it includes throughput and ETA."""
+    if stats is not None and job['state'] == RUNNING:
+        return BROADCAST_PROGRESS.format(job_id=job['id'], sent=job['sent'], failed=job['failed'], total=job['total'],
+                                         rate=stats['rate'], eta=format_duration(stats['eta']))
+    return BROADCAST_STATE.format(job_id=job['id'], state=job['state'], sent=job['sent'], failed=job['failed'],
+                                  total=job['total'])
+
+
+class BroadcastJobs:
+    """
+    Runs broadcasts as background jobs kept in the `broadcast_jobs` table.
+
+    A job hands out users in id order, `chunk` at a time, to a `Broadcast`. Who got the
+    message is stored per recipient together with the job's cursor every progress interval
+    and when the job stops, so after a restart `resume_all` carries on after the cursor and
+    skips the recipients stored past it; at most one interval of sends is repeated after a
+    crash. Users who turn out to have blocked the bot are marked unreachable, and later
+    jobs skip them until they are due for a re-probe. Progress is shown by editing the admin's status message, which also carries the
+    pause, resume, cancel and status buttons.
+
+    Parameters:
+        db: aiosqlite.Connection
+            The writer connection.
+        bot: Bot
+            The bot to send as.
+        readers: ReaderPool | None
+            Pool the recipients are read from; the writer connection when None (e.g. in tests).
+        chunk: int
+            Recipients read from the database at a time.
+        reprobe_days: float
+            Days after which users found unreachable are included in broadcasts again.
+        options:
+            Passed on to `Broadcast`, e.g. `workers`, `scheduler` or `progress_interval`.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, bot: Bot, readers: ReaderPool | None = None, chunk: int = 200,
+                 reprobe_days: float = UNREACHABLE_REPROBE_DAYS, **options):
+        self.db = db
+        self.bot = bot
+        self.readers = readers
+        self.chunk = chunk
+        self.reprobe_days = reprobe_days
+        self.options = options
+        self.tasks: dict[int, asyncio.Task] = {}
+        self._broadcasts: dict[int, Broadcast] = {}
+
+    async def create(self, admin_id: int, text: str, exclude_id: int | None = None) -> dict | None:
+        """
+        Stores a new running job, or returns None if there is nobody to send to. `start` runs it.
+
+        Unreachable users are left out, except those marked more than `reprobe_days` ago: they
+        are tried again, since people unblock bots and Telegram may have missed telling us.
+        """
+        reprobe_before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=self.reprobe_days)
+        return await create_job(self.db, admin_id, text, exclude_id, reprobe_before)
+
+    def start(self, job: dict) -> asyncio.Task:
+        self.tasks[job['id']] = asyncio.create_task(self._run(job))
+        return self.tasks[job['id']]
+
+    async def set_status_message(self, job: dict, message_id: int) -> None:
+        job['status_message_id'] = message_id
+        await set_status_message(self.db, job['id'], message_id)
+
+    async def resume_all(self) -> int:
+        """Starts every job that was running when the bot stopped. Returns how many."""
+        jobs = await jobs_in_state(self.db, RUNNING)
+        for job in jobs:
+            if job['id'] not in self.tasks:
+                self.start(job)
+        return len(jobs)
+
+    async def pause(self, job_id: int) -> bool:
+        if not await set_job_state(self.db, job_id, PAUSED):
+            return False
+        await self._halt(job_id)
+        return True
+
+    async def resume(self, job_id: int) -> bool:
+        # Only a paused job moves, so a second resume (double tap, another admin) changes nothing
+        if not await set_job_state(self.db, job_id, RUNNING):
+            return False
+        task, broadcast = self.tasks.get(job_id), self._broadcasts.get(job_id)
+        if task is not None:
+            if broadcast is None or not broadcast.stopping:
+                return True
+            # Still winding down from the pause: wait for it, it stores its results on the way out
+            await asyncio.gather(task, return_exceptions=True)
+        self.start(await get_job(self.db, job_id))
+        return True
+
+    async def cancel(self, job_id: int) -> bool:
+        if not await set_job_state(self.db, job_id, CANCELLED):
+            return False
+        await self._halt(job_id)
+        return True
+
+    async def job(self, job_id: int) -> dict | None:
+        return await get_job(self.db, job_id)
+
+    def status_text(self, job: dict) -> str:
+        """Status of the job, with throughput and ETA while it runs in this process."""
+        broadcast = self._broadcasts.get(job['id'])
+        return job_status_text(job, broadcast.stats() if broadcast else None)
+
+    async def stop(self) -> None:
+        """Stops all jobs for shutdown. They stay running in the database, so `resume_all` picks them up."""
+        for job_id in list(self.tasks):
+            await self._halt(job_id)
+
+    async def _halt(self, job_id: int) -> None:
+        if (broadcast := self._broadcasts.get(job_id)) is not None:
+            broadcast.stop()
+        if (task := self.tasks.get(job_id)) is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self, job: dict) -> None:
+        cursor = _Cursor(job['cursor'])
+        results: list[tuple[int, str]] = []
+
+        def on_result(chat_id: int, outcome: str):
+            results.append((chat_id, outcome))
+            cursor.done(chat_id)
+
+        async def recipients():
+            after = job['cursor']
+            while True:
+                # The reader is given back before the chunk is sent to, so a long job holds no connection
+                async with read_connection(self.readers, self.db) as reader:
+                    ids = await pending_recipients(reader, job, after, self.chunk)
+                if not ids:
+                    return
+                after = ids[-1]
+                cursor.add(ids)
+                yield ids
+
+        async def flush():
+            batch, position = [(chat_id, outcome == SENT) for chat_id, outcome in results], cursor.position
+            unreachable = [chat_id for chat_id, outcome in results if outcome == UNREACHABLE]
+            results.clear()
+            await record_results(self.db, job['id'], batch, position, unreachable)
+            job['sent'] += sum(1 for _, delivered in batch if delivered)
+            job['failed'] += sum(1 for _, delivered in batch if not delivered)
+            job['cursor'] = position
+
+        async def report(stats: dict):
+            await flush()
+            await self._show(job, job_status_text(job, stats), Keyboards.broadcast_keyboard(job['id'], RUNNING))
+
+        broadcast = Broadcast(self.bot, job['text'], total=job['total'] - job['sent'] - job['failed'],
+                              on_progress=report, on_result=on_result, **self.options)
+        self._broadcasts[job['id']] = broadcast
+        try:
+            await broadcast.run(recipients())
+        except Exception as e:
+            logging.error(f'Broadcast job {job["id"]} stopped: {e}')
+        finally:
+            await flush()
+            del self._broadcasts[job['id']]
+            del self.tasks[job['id']]
+
+        if broadcast.stopping or not await set_job_state(self.db, job['id'], DONE):
+            return
+        job['state'] = DONE
+        logging.info(f'Broadcast job {job["id"]} done: {job["sent"]} sent, {job["failed"]} failed')
+        await self._show(job, job_status_text(job))
+        try:
+            await self.bot.send_message(job['admin_id'], RESULT_SEND.format(message_text=job['text'], count=job['sent']),
+                                        reply_markup=Keyboards.admin_keyboard(), parse_mode='HTML')
+        except TelegramAPIError as e:
+            logging.warning(f'Broadcast job {job["id"]}: could not report the result: {e}')
+
+    async def _show(self, job: dict, text: str, reply_markup=None) -> None:
+        if job['status_message_id'] is None:
+            return
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=job['admin_id'], message_id=job['status_message_id'],
+                                             reply_markup=reply_markup)
+        except TelegramAPIError as e:
+            logging.warning(f'Broadcast job {job["id"]}: could not update the status message: {e}')
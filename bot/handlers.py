@@ -5,12 +5,12 @@ import aiosqlite
 import aiohttp
 
 from aiogram import Bot, F, Router
-from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import KICKED, MEMBER, ChatMemberUpdatedFilter, CommandStart
+from aiogram.types import ChatMemberUpdated, Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from helpers import check_stock_price, edit_bot_message, fetch_stock_data, username_db_check
+from helpers import check_stock_price, edit_bot_message, fetch_stock_data, get_prices, history_store, symbol_universe, username_db_check
 
 from config.strings import (
     DEFAULT_HELLO,
@@ -18,6 +18,8 @@ from config.strings import (
     INVALID_SYMBOL,
     INVALID_AMOUNT,
     CURRENT_PRICE,
+    PRICE_CHANGE,
+    PRICE_AVERAGE,
     SEND_AMOUNT_BUY,
     SERVER_ERROR_PRICE,
     CONFIRM_BUY,
@@ -35,6 +37,9 @@ from config.strings import (
 )
 from config.callbacks import MY_STOCKS_CB, BUY_CB, SELL_CB, PRICE_CB, RETURN_CB
 from bot.keyboards import Keyboards
+from database.broadcasts import set_reachable
+from database.repository import Repository
+from database.trading import NotEnoughCash, NotEnoughShares, buy_stock, sell_stock, transaction
 
 # Initialize states
 class StockStates(StatesGroup):
@@ -54,13 +59,23 @@ default_keyboard = Keyboards()
 
 # Define first /start command handler
 @form_router.message(CommandStart())
-async def cmd_start(message: Message, db: aiosqlite.Connection):
+async def cmd_start(message: Message, db: aiosqlite.Connection, repo: Repository):
     # Check if a user exists in DB, if not, add them with a default balance of 10 000$
-    async with db.execute('SELECT * FROM users WHERE id = ?', (message.from_user.id,)) as query:
-        if not await query.fetchone():
-            await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (message.from_user.id, message.from_user.username if message.from_user.username else 'N/A',))
-            await db.commit()
+    if not await repo.user(message.from_user.id):
+        async with transaction(db):
+            await db.execute('INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)', (message.from_user.id, message.from_user.username if message.from_user.username else 'N/A',))
     await message.answer(DEFAULT_HELLO, reply_markup=Keyboards.default_keyboard(), parse_mode='HTML')
+
+
+# Telegram tells the bot when a user blocks or unblocks it, so broadcasts can skip blocked users
+@form_router.my_chat_member(F.chat.type == 'private', ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def user_blocked_bot(event: ChatMemberUpdated, db: aiosqlite.Connection):
+    await set_reachable(db, event.from_user.id, False)
+
+
+@form_router.my_chat_member(F.chat.type == 'private', ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def user_unblocked_bot(event: ChatMemberUpdated, db: aiosqlite.Connection):
+    await set_reachable(db, event.from_user.id, True)
     
     
 
@@ -104,7 +119,8 @@ async def check_price(message: Message, state: FSMContext, session: aiohttp.Clie
     
     data = await state.get_data()
     
-    price = await check_stock_price(message.text, session)
+    # Symbols known to be invalid are answered locally, without an API call
+    price = await check_stock_price(message.text, session) if symbol_universe.could_exist(message.text) else None
     # If price is None then symbol was invalid
     if price is None:
         text = [INVALID_SYMBOL, DEFAULT_HELLO]
@@ -117,7 +133,19 @@ async def check_price(message: Message, state: FSMContext, session: aiohttp.Clie
         )
         await state.clear()
         return
-    text = [CURRENT_PRICE.format(symbol=message.text.upper(), price=price), DEFAULT_HELLO]
+    text = [CURRENT_PRICE.format(symbol=message.text.upper(), price=price)]
+
+    # Stats come from the stored daily series, shown only once enough days are stored
+    stats = []
+    change = history_store.percent_change(message.text)
+    if change is not None:
+        stats.append(PRICE_CHANGE.format(change=change))
+    average = history_store.moving_average(message.text, 20)
+    if average is not None:
+        stats.append(PRICE_AVERAGE.format(window=20, average=average))
+    if stats:
+        text.append('\n'.join(stats))
+    text.append(DEFAULT_HELLO)
     await edit_bot_message(
         text='\n\n'.join(text),
         event=message,
@@ -130,11 +158,10 @@ async def check_price(message: Message, state: FSMContext, session: aiohttp.Clie
 
 # Define buy stocks handlers
 @form_router.callback_query(F.data==BUY_CB)
-async def start_buy_callback(callback: CallbackQuery, state: FSMContext, bot: Bot, db: aiosqlite.Connection):
-    async with db.execute('SELECT cash FROM users WHERE id = ?', (callback.from_user.id,)) as query:
-        balance = await query.fetchone()
+async def start_buy_callback(callback: CallbackQuery, state: FSMContext, bot: Bot, repo: Repository):
+    balance = await repo.cash(callback.from_user.id)
     await edit_bot_message(
-        text=SEND_SYMBOL_BUY.format(balance=balance[0] if balance else 0),
+        text=SEND_SYMBOL_BUY.format(balance=balance or 0),
         event=callback,
         message_id=callback.message.message_id,
         bot=bot,
@@ -153,7 +180,7 @@ async def buy_symbol(message: Message, state: FSMContext, session: aiohttp.Clien
     
     data = await state.get_data()
 
-    price = await check_stock_price(message.text, session)
+    price = await check_stock_price(message.text, session) if symbol_universe.could_exist(message.text) else None
     if price is None:
         await edit_bot_message(
             text='\n\n'.join([INVALID_SYMBOL, DEFAULT_HELLO]),
@@ -219,63 +246,33 @@ async def buy_amount(message: Message, state: FSMContext, db: aiosqlite.Connecti
         )
         await state.clear()
         return
-    total_price = amount * float(price)
 
-    # Check if user has enough balance
-    await db.execute('PRAGMA foreign_keys = ON')
+    # The balance check and the purchase run as one unit of work; messages are sent after it
     try:
-        await db.execute('BEGIN')
-        async with db.execute('SELECT cash FROM users WHERE id = ?', (message.from_user.id,)) as query:
-            balance = await query.fetchone()
-            if int(balance[0]) < total_price:
-                text = [NO_MONEY_BUY.format(amount=amount, symbol=data["symbol"], balance=balance[0]), DEFAULT_HELLO]
-                await edit_bot_message(
-                    text='\n\n'.join(text),
-                    event=message,
-                    message_id=data.get('bot_message_id'),
-                    bot=bot,
-                    reply_markup=Keyboards.default_keyboard()
-                )
-                return
-            # Complete the purchase: deduct money from balance and add stocks to user_savings table
-            else:
-                await db.execute('UPDATE users SET cash = cash - ? WHERE id = ?', (total_price, message.from_user.id))
-                await db.execute("""INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?) 
-                    ON CONFLICT(user_id, stock)
-                    DO UPDATE SET quantity = quantity + excluded.quantity""",
-                                 (message.from_user.id, data['symbol'], amount,))
-                await db.execute('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
-                                    (message.from_user.id, data['symbol'], price, amount,))
-                await db.commit()
-                
-                text = [BUY_SUCCESSFUL.format(amount=amount, symbol=data['symbol'], total_price=total_price), DEFAULT_HELLO]
-                await edit_bot_message(
-                    text='\n\n'.join(text),
-                    event=message,
-                    message_id=data.get('bot_message_id'),
-                    bot=bot,
-                    reply_markup=Keyboards.default_keyboard()
-                )
+        total_price = await buy_stock(db, message.from_user.id, data['symbol'], price, amount)
+        text = [BUY_SUCCESSFUL.format(amount=amount, symbol=data['symbol'], total_price=total_price), DEFAULT_HELLO]
+    except NotEnoughCash as e:
+        text = [NO_MONEY_BUY.format(amount=amount, symbol=data["symbol"], balance=e.balance), DEFAULT_HELLO]
     except Exception as e:
-        await db.rollback()
         logging.error(f'Transaction failed: {e}')
-        await edit_bot_message(
-            text='\n\n'.join([ANY_ERROR, DEFAULT_HELLO]),
-            event=message,
-            message_id=data.get('bot_message_id'),
-            bot=bot,
-            reply_markup=Keyboards.default_keyboard()
-        )
+        text = [ANY_ERROR, DEFAULT_HELLO]
     finally:
         await state.clear()
+
+    await edit_bot_message(
+        text='\n\n'.join(text),
+        event=message,
+        message_id=data.get('bot_message_id'),
+        bot=bot,
+        reply_markup=Keyboards.default_keyboard()
+    )
             
         
             
 @form_router.callback_query(F.data==SELL_CB)
-async def start_sell_callback(callback: CallbackQuery, state: FSMContext, bot: Bot, db: aiosqlite.Connection):
-    async with db.execute('SELECT stock, quantity FROM user_savings WHERE user_id = ?', (callback.from_user.id,)) as query:
-        savings = await query.fetchall()
-        
+async def start_sell_callback(callback: CallbackQuery, state: FSMContext, bot: Bot, repo: Repository):
+    savings = await repo.holdings(callback.from_user.id)
+
     if not savings:
         await edit_bot_message(
             text=NO_STOCKS,
@@ -309,26 +306,36 @@ async def start_sell_callback(callback: CallbackQuery, state: FSMContext, bot: B
     
     
 @form_router.message(StockStates.waiting_symbol_sell, F.text.regexp(r"^[A-Za-z]{1,5}$"))
-async def sell_symbol(message: Message, state: FSMContext, db: aiosqlite.Connection, session: aiohttp.ClientSession, bot: Bot):
+async def sell_symbol(message: Message, state: FSMContext, repo: Repository, session: aiohttp.ClientSession, bot: Bot):
     await delete_unwanted(message)
     
     data = await state.get_data()
+
+    if not symbol_universe.could_exist(message.text):
+        await edit_bot_message(
+            text='\n\n'.join([INVALID_SYMBOL, DEFAULT_HELLO]),
+            event=message,
+            message_id=data.get('bot_message_id'),
+            bot=bot,
+            reply_markup=Keyboards.default_keyboard()
+        )
+        await state.clear()
+        return
     
-    async with db.execute('SELECT stock FROM user_savings WHERE user_id = ? AND stock = ?', (message.from_user.id, message.text.upper())) as query:
-        stock = await query.fetchone()
-        if not stock:
-            text = [NO_STOCK_SELL.format(symbol=message.text.upper()), DEFAULT_HELLO]
-            await edit_bot_message(
-                text='\n\n'.join(text),
-                event=message,
-                message_id=data.get('bot_message_id'),
-                bot=bot,
-                reply_markup=Keyboards.default_keyboard()
-            )
-            await state.clear()
-            return
-
-    price = await check_stock_price(stock[0], session)
+    symbol = message.text.upper()
+    if not await repo.holding(message.from_user.id, symbol):
+        text = [NO_STOCK_SELL.format(symbol=symbol), DEFAULT_HELLO]
+        await edit_bot_message(
+            text='\n\n'.join(text),
+            event=message,
+            message_id=data.get('bot_message_id'),
+            bot=bot,
+            reply_markup=Keyboards.default_keyboard()
+        )
+        await state.clear()
+        return
+
+    price = await check_stock_price(symbol, session)
     if price is None:
         await edit_bot_message(
             text='\n\n'.join([SERVER_ERROR_PRICE, DEFAULT_HELLO]),
@@ -339,9 +346,9 @@ async def sell_symbol(message: Message, state: FSMContext, db: aiosqlite.Connect
         )
         await state.clear()
         return
-    await state.update_data(symbol=stock[0], price=price)
+    await state.update_data(symbol=symbol, price=price)
     await state.set_state(StockStates.waiting_amount_sell)
-    text = [CURRENT_PRICE.format(symbol=stock[0], price=price), SEND_AMOUNT_SELL.format(symbol=stock[0])]
+    text = [CURRENT_PRICE.format(symbol=symbol, price=price), SEND_AMOUNT_SELL.format(symbol=symbol)]
     await edit_bot_message(
         text=' '.join(text),
         event=message,
@@ -352,7 +359,7 @@ async def sell_symbol(message: Message, state: FSMContext, db: aiosqlite.Connect
 
 
 @form_router.message(StockStates.waiting_amount_sell, F.text.regexp(r"^\d+$"))
-async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connection, session: aiohttp.ClientSession, bot: Bot):
+async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connection, repo: Repository, session: aiohttp.ClientSession, bot: Bot):
     await delete_unwanted(message)
 
     data = await state.get_data()
@@ -370,10 +377,9 @@ async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connect
         return
 
 
-    async with db.execute('SELECT quantity FROM user_savings WHERE user_id = ? AND stock = ?', (message.from_user.id, data['symbol'])) as query:
-        available_amount = await query.fetchone()
-    if not available_amount or amount > available_amount[0]:
-        text = [NOT_ENOUGH_STOCKS.format(symbol=data['symbol'], asked_amount=amount, owned_amount=available_amount[0]), DEFAULT_HELLO]
+    available_amount = await repo.holding(message.from_user.id, data['symbol']) or 0
+    if amount > available_amount:
+        text = [NOT_ENOUGH_STOCKS.format(symbol=data['symbol'], asked_amount=amount, owned_amount=available_amount), DEFAULT_HELLO]
         await edit_bot_message(
             text='\n\n'.join(text),
             event=message,
@@ -408,19 +414,20 @@ async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connect
         await state.clear()
         return
     
-    total_price = amount * float(price)
-    
-    await db.execute('PRAGMA foreign_keys = ON')
-    
     try:
-        await db.execute('BEGIN')
-        await db.execute('UPDATE users SET cash = cash + ? WHERE id = ?', (total_price, message.from_user.id))
-        await db.execute('UPDATE user_savings SET quantity = quantity - ? WHERE user_id = ? AND stock = ?', (amount, message.from_user.id, data['symbol']))
-        await db.execute('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
-                            (message.from_user.id, data['symbol'], price, -amount,))
-        await db.commit()
+        await sell_stock(db, message.from_user.id, data['symbol'], price, amount)
+    except NotEnoughShares as e:
+        text = [NOT_ENOUGH_STOCKS.format(symbol=data['symbol'], asked_amount=amount, owned_amount=e.owned), DEFAULT_HELLO]
+        await edit_bot_message(
+            text='\n\n'.join(text),
+            event=message,
+            message_id=data.get('bot_message_id'),
+            bot=bot,
+            reply_markup=Keyboards.default_keyboard()
+        )
+        await state.clear()
+        return
     except Exception as e:
-        await db.rollback()
         await edit_bot_message(
             text='\n\n'.join([ANY_ERROR, DEFAULT_HELLO]),
             event=message,
@@ -429,6 +436,7 @@ async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connect
             reply_markup=Keyboards.default_keyboard()
         )
         logging.error(f'Error occurred while selling stock: {e}')
+        await state.clear()
         return
     
     text = [SELL_SUCCESSFUL.format(amount=amount, symbol=data['symbol'], price=price), DEFAULT_HELLO]
@@ -443,23 +451,26 @@ async def sell_amount(message: Message, state: FSMContext, db: aiosqlite.Connect
     
 
 @form_router.callback_query(F.data==MY_STOCKS_CB)
-async def check_savings(callback: CallbackQuery, db: aiosqlite.Connection, session: aiohttp.ClientSession):
-    # Query that joins two tables, first - users, for receiving balance of an account, second = user_savings to receive stocks owned
-    async with db.execute('SELECT s.stock, s.quantity, u.cash FROM users u LEFT JOIN user_savings s ON u.id = s.user_id WHERE u.id = ?;', (callback.from_user.id,)) as query:
-        savings = await query.fetchall()
+async def check_savings(callback: CallbackQuery, db: aiosqlite.Connection, repo: Repository, session: aiohttp.ClientSession):
+    # One query returns the balance and every holding with its cost basis
+    cash, holdings = await repo.portfolio(callback.from_user.id) or (0, [])
         
-    formatted_message = [f"<b>💵 Balance of your account: {"{:.2f}".format(savings[0][2])}$</b>\n\n"]
-    if not savings[0][0]:
+    formatted_message = [f"<b>💵 Balance of your account: {cash:.2f}$</b>\n\n"]
+    if not holdings:
         formatted_message.append("<b>💼 You don't have any stocks yet.</b>")
     else:
         formatted_message.append("<b>💼 Your stock portfolio:</b>\n")
         
-        tasks = []
-        
-        for stock, quantity, _ in savings:
-            tasks.append(fetch_stock_data(user_id=callback.from_user.id, stock=stock, quantity=quantity, session=session, db=db))
-            
         try:
+            # Fetch all prices in one batch, so only symbols missing from the cache hit the API
+            prices = await get_prices([stock for stock, _, _ in holdings], session)
+
+            tasks = []
+
+            for stock, quantity, cost_basis in holdings:
+                tasks.append(fetch_stock_data(user_id=callback.from_user.id, stock=stock, quantity=quantity, session=session, db=db,
+                                              prices=prices, cost_basis=cost_basis))
+
             stock_lines = await asyncio.gather(*tasks)
             formatted_message.extend(stock_lines)
         except Exception as e:
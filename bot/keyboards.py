@@ -1,4 +1,5 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from database.broadcasts import PAUSED, RUNNING
 from config.callbacks import (
     MY_STOCKS_CB,
     BUY_CB, SELL_CB,
@@ -8,6 +9,12 @@ from config.callbacks import (
     SHOW_ALL_CB,
     DELETE_USER_CB,
     BROADCAST_CB,
+    USERS_NEXT_CB,
+    USERS_PREV_CB,
+    BROADCAST_PAUSE_CB,
+    BROADCAST_RESUME_CB,
+    BROADCAST_CANCEL_CB,
+    BROADCAST_STATUS_CB,
 )
 
 class Keyboards:
@@ -48,4 +55,35 @@ class Keyboards:
                     InlineKeyboardButton(text='Delete user', callback_data=DELETE_USER_CB)
                 ],
             ]
-        )
\ No newline at end of file
+        )
+    @staticmethod
+    def users_page_keyboard(first_id: int, last_id: int, has_prev: bool, has_next: bool):
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(text='◀️ Prev', callback_data=f'{USERS_PREV_CB}{first_id}'))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text='Next ▶️', callback_data=f'{USERS_NEXT_CB}{last_id}'))
+
+        keyboard = Keyboards.admin_keyboard()
+        if navigation:
+            keyboard.inline_keyboard.insert(0, navigation)
+        return keyboard
+    @staticmethod
+    def broadcast_keyboard(job_id: int, state: str):
+        # Finished jobs have no controls left
+        if state == RUNNING:
+            toggle = InlineKeyboardButton(text='⏸ Pause', callback_data=f'{BROADCAST_PAUSE_CB}{job_id}')
+        elif state == PAUSED:
+            toggle = InlineKeyboardButton(text='▶️ Resume', callback_data=f'{BROADCAST_RESUME_CB}{job_id}')
+        else:
+            return None
+
+        return InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    toggle,
+                    InlineKeyboardButton(text='✖️ Cancel', callback_data=f'{BROADCAST_CANCEL_CB}{job_id}'),
+                    InlineKeyboardButton(text='🔄 Status', callback_data=f'{BROADCAST_STATUS_CB}{job_id}'),
+                ]
+            ]
+        )
@@ -0,0 +1,161 @@
+import collections
+import contextlib
+import contextvars
+import time
+from typing import Callable, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import CopyMessage, CopyMessages, DeleteWebhook, ForwardMessage, ForwardMessages, GetMe, GetUpdates, \
+    GetWebhookInfo, Response, SendAnimation, SendAudio, SendContact, SendDice, SendDocument, SendLocation, SendMediaGroup, \
+    SendMessage, SendPhoto, SendPoll, SendSticker, SendVenue, SendVideo, SendVideoNote, SendVoice, SetWebhook, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config.config import TELEGRAM_RATE, TELEGRAM_BURST, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE, \
+    TELEGRAM_QUEUE_TIMEOUT, TELEGRAM_BULK_TIMEOUT
+from market.scheduler import Priority, QueueTimeout, RequestScheduler
+
+# Priority of the Bot API calls made in the current task. Replies to users keep the default;
+# bulk senders such as broadcasts switch to BACKGROUND with `outbound_priority`
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar('outbound_priority', default=Priority.INTERACTIVE)
+
+# Calls that are not messages to anyone: long polling and setup must never queue behind traffic
+_UNLIMITED = (GetUpdates, GetMe, SetWebhook, DeleteWebhook, GetWebhookInfo)
+
+# Calls that post a new message to a chat, which is what Telegram's per-chat limit counts.
+# Edits, deletions and the like only take a global token
+_SENDS = (SendMessage, SendPhoto, SendDocument, SendAnimation, SendAudio, SendVideo, SendVideoNote, SendVoice,
+          SendSticker, SendMediaGroup, SendLocation, SendVenue, SendContact, SendPoll, SendDice,
+          CopyMessage, CopyMessages, ForwardMessage, ForwardMessages)
+
+
+@contextlib.contextmanager
+def outbound_priority(priority: Priority) -> Iterator[None]:
+    """Runs the enclosed Bot API calls, and those of tasks started inside, at `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Session middleware that paces every Bot API call of the bot.
+
+    Each message sent first takes a token from the bucket of its chat, then one from the
+    global bucket, so a burst to one chat cannot spend the whole bot's budget while it waits
+    for its own. Private chats get `chat_rate` messages per second with bursts of
+    `chat_burst`, groups and channels `group_rate`. Other calls (edits, deletions, callback
+    answers, ...) do not count toward Telegram's per-chat limit and only take a global token. Queued calls are served by priority, so replies to users go ahead of
+    broadcast sends.
+
+    Buckets of chats that have been quiet long enough to be full again are dropped once
+    there are more than `max_chats` of them.
+
+    Metrics are available via `stats()`: per-priority calls, average and peak time spent
+    queued in both buckets, and timeouts, plus the global scheduler's own stats.
+
+    Parameters:
+        rate: float
+            Calls per second for the whole bot.
+        burst: int
+            Calls allowed back to back before the global rate applies.
+        chat_rate: float
+            Calls per second to one private chat.
+        chat_burst: int
+            Calls allowed back to back to one chat.
+        group_rate: float
+            Calls per second to one group or channel.
+        timeout: float
+            Max seconds an interactive call waits before QueueTimeout is raised.
+        bulk_timeout: float
+            Max seconds a background call waits.
+        max_chats: int
+            Chat buckets kept before idle ones are dropped.
+        clock: Callable[[], float]
+            Time source, in seconds.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_RATE, burst: int = TELEGRAM_BURST, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST, group_rate: float = TELEGRAM_GROUP_RATE,
+                 timeout: float = TELEGRAM_QUEUE_TIMEOUT, bulk_timeout: float = TELEGRAM_BULK_TIMEOUT,
+                 max_chats: int = 10_000, clock: Callable[[], float] = time.monotonic):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.timeout = timeout
+        self.bulk_timeout = bulk_timeout
+        self.max_chats = max_chats
+        self._clock = clock
+
+        self.scheduler = RequestScheduler(rate=rate, burst=burst, max_wait=timeout, clock=clock)
+        self._chats: collections.OrderedDict[int | str, RequestScheduler] = collections.OrderedDict()
+
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.calls = {priority: 0 for priority in Priority}
+        self.timeouts = {priority: 0 for priority in Priority}
+        self.wait_total = {priority: 0.0 for priority in Priority}
+        self.wait_max = {priority: 0.0 for priority in Priority}
+
+    def _chat_bucket(self, chat_id: int | str) -> RequestScheduler:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group and channel ids are negative, channels may also be addressed by @username
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = RequestScheduler(rate=self.chat_rate if private else self.group_rate,
+                                      burst=self.chat_burst if private else 1, max_wait=self.timeout, clock=self._clock)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._drop_idle()
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _drop_idle(self) -> None:
+        # Least recently used first; a bucket that is full again behaves like a new one
+        for chat_id in list(self._chats):
+            if len(self._chats) <= self.max_chats // 2:
+                break
+            if self._chats[chat_id].idle:
+                del self._chats[chat_id]
+
+    async def acquire(self, chat_id: int | str | None, priority: Priority) -> None:
+        """Waits for a token of the chat (if any) and a global one."""
+        timeout = self.timeout if priority == Priority.INTERACTIVE else self.bulk_timeout
+        queued = self._clock()
+        try:
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire(priority, timeout)
+            await self.scheduler.acquire(priority, timeout)
+        except QueueTimeout:
+            self.timeouts[priority] += 1
+            raise
+
+        waited = self._clock() - queued
+        self.calls[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        if not isinstance(method, _UNLIMITED):
+            await self.acquire(method.chat_id if isinstance(method, _SENDS) else None, _priority.get())
+        return await make_request(bot, method)
+
+    def stats(self) -> dict:
+        return {
+            'chats': len(self._chats),
+            'by_priority': {
+                priority.name.lower(): {
+                    'calls': self.calls[priority],
+                    'timeouts': self.timeouts[priority],
+                    'avg_wait': self.wait_total[priority] / self.calls[priority] if self.calls[priority] else 0.0,
+                    'max_wait': self.wait_max[priority],
+                }
+                for priority in Priority
+            },
+            'global': self.scheduler.stats(),
+        }
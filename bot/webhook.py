@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """
+    aiogram's webhook request handler with at most `concurrency` updates handled at once.
+
+    Requests without Telegram's secret token are answered 401. An update is answered as soon
+    as it has a slot and then handled in the background. While every slot is busy the request
+    waits, which holds Telegram's connection and slows delivery down instead of piling up
+    tasks; Telegram itself keeps at most `max_connections` (see `run_webhook`) requests open.
+
+    Parameters:
+        dispatcher: Dispatcher
+            The dispatcher updates are fed to.
+        bot: Bot
+            The bot the updates are for.
+        concurrency: int
+            Updates handled at once.
+        secret_token: str
+            Value Telegram sends in X-Telegram-Bot-Api-Secret-Token, as given to setWebhook.
+        data:
+            Passed on to the handlers, like the keyword arguments of `Dispatcher`.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int, secret_token: str, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+
+        self.handled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            # The update never got to a handler (e.g. the body was not JSON)
+            self._release()
+            raise
+
+    async def _background_feed_update(self, bot: Bot, update: dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self.handled += 1
+            self._release()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'handled': self.handled,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+        }
+
+
+def build_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str, concurrency: int) -> tuple[web.Application, WebhookHandler]:
+    """Returns an aiohttp application that feeds updates POSTed to `path` to the dispatcher, and its handler."""
+    app = web.Application()
+    handler = WebhookHandler(dispatcher, bot, concurrency, secret_token)
+    handler.register(app, path=path)
+    # Startup and shutdown hooks of the dispatcher, as start_polling runs them
+    setup_application(app, dispatcher, bot=bot)
+    return app, handler
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, url: str, path: str, host: str, port: int, secret_token: str,
+                      concurrency: int, max_connections: int) -> None:
+    """
+    Serves updates over a webhook until cancelled, as an alternative to `Dispatcher.start_polling`.
+
+    Telegram is told to POST updates to `url` + `path`, with `secret_token` and at most
+    `max_connections` requests at once. The webhook stays registered on shutdown, so Telegram
+    keeps updates for the next start.
+
+    Parameters:
+    dispatcher (Dispatcher): The dispatcher with the routers.
+    bot (Bot): The bot.
+    url (str): Public HTTPS base URL of this server (e.g. behind a reverse proxy).
+    path (str): Path of the webhook endpoint.
+    host (str): Interface the server listens on.
+    port (int): Port the server listens on.
+    secret_token (str): Shared secret Telegram sends with every update.
+    concurrency (int): Updates handled at once.
+    max_connections (int): Requests Telegram keeps open at once, 1-100.
+    """
+    app, handler = build_app(dispatcher, bot, path, secret_token, concurrency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await bot.set_webhook(url.rstrip('/') + path, secret_token=secret_token, max_connections=max_connections,
+                              allowed_updates=dispatcher.resolve_used_update_types())
+        logging.info(f'Serving the webhook on {host}:{port}{path}, up to {concurrency} updates at once')
+        await asyncio.Event().wait()
+    finally:
+        logging.info(f'Webhook handler: {handler.stats()}')
+        await runner.cleanup()
@@ -10,4 +10,12 @@ RETURN_CB='return_main'
 CHECK_USER_CB='check_user_info'
 SHOW_ALL_CB='show_all_users'
 DELETE_USER_CB='delete_user'
-BROADCAST_CB='broadcast'
\ No newline at end of file
+BROADCAST_CB='broadcast'
+
+# Prefixes of admin callbacks that carry data after the prefix
+USERS_NEXT_CB='users_next:'  # followed by the last user id shown
+USERS_PREV_CB='users_prev:'  # followed by the first user id shown
+BROADCAST_PAUSE_CB='broadcast_pause:'  # followed by the broadcast job id
+BROADCAST_RESUME_CB='broadcast_resume:'  # followed by the broadcast job id
+BROADCAST_CANCEL_CB='broadcast_cancel:'  # followed by the broadcast job id
+BROADCAST_STATUS_CB='broadcast_status:'  # followed by the broadcast job id
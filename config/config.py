@@ -4,7 +4,66 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TOKEN = os.getenv("TOKEN") # Bot token from @BotFather
-ALPHA_API = os.getenv("ALPHA_API") # Alpha Vantage API key
+ALPHA_API_KEYS = [x.strip() for x in os.getenv("ALPHA_API", "").split(",") if x.strip()] # Alpha Vantage API keys, comma separated
+ALPHA_API = ALPHA_API_KEYS[0] if ALPHA_API_KEYS else None # First Alpha Vantage API key
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x] # List of admin IDs
 
+DB_PATH = os.getenv("DB_PATH", "database/bot_db.db") # SQLite database file
+DB_READERS = int(os.getenv("DB_READERS", 4)) # Read-only connections for reports and portfolio views
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 64 * 2 ** 20)) # Bytes of the database read through memory mapping, per connection
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", 16 * 2 ** 10)) # Page cache per connection, in KiB
+TRADE_COMMIT_WINDOW = float(os.getenv("TRADE_COMMIT_WINDOW", 0.002)) # Seconds trades are collected to be committed together
+TRADE_BATCH_SIZE = int(os.getenv("TRADE_BATCH_SIZE", 64)) # Max trades committed in one transaction
+HISTORY_KEEP_DAYS = float(os.getenv("HISTORY_KEEP_DAYS", 365)) # Trades older than this are moved to the archive, unless still needed for profits
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", 24 * 3600)) # Seconds between history compactions
+
+QUOTE_CACHE_TTL = int(os.getenv("QUOTE_CACHE_TTL", 300)) # Seconds a fetched price is reused before asking the API again
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", 1024)) # Max number of tickers kept in the quote cache
+
+ALPHA_CALLS_PER_MINUTE = float(os.getenv("ALPHA_CALLS_PER_MINUTE", 5)) # Alpha Vantage quota per key
+ALPHA_BURST = int(os.getenv("ALPHA_BURST", 2)) # Calls allowed back to back before the rate applies
+ALPHA_QUEUE_TIMEOUT = float(os.getenv("ALPHA_QUEUE_TIMEOUT", 15)) # Max seconds a price fetch waits for quota
+ALPHA_BATCH_CONCURRENCY = int(os.getenv("ALPHA_BATCH_CONCURRENCY", 4)) # Max parallel fetches for one portfolio view
+ALPHA_TIMEOUT = float(os.getenv("ALPHA_TIMEOUT", 10)) # Seconds before a single API call is abandoned
+ALPHA_MAX_RETRIES = int(os.getenv("ALPHA_MAX_RETRIES", 2)) # Retries of a timed out or failed call
+ALPHA_RETRY_RATIO = float(os.getenv("ALPHA_RETRY_RATIO", 0.2)) # Retries allowed per first attempt, across all calls
+ALPHA_BREAKER_THRESHOLD = int(os.getenv("ALPHA_BREAKER_THRESHOLD", 5)) # Consecutive failures that stop API calls
+ALPHA_BREAKER_RESET = float(os.getenv("ALPHA_BREAKER_RESET", 30)) # Seconds before a stopped API is probed again
+STALE_QUOTE_TTL = float(os.getenv("STALE_QUOTE_TTL", 30)) # Seconds an outdated price is served while the API is down
+
+PRICE_REFRESH_INTERVAL = float(os.getenv("PRICE_REFRESH_INTERVAL", 240)) # Seconds between background refreshes of held symbols
+PRICE_REFRESH_SHARE = float(os.getenv("PRICE_REFRESH_SHARE", 0.5)) # Share of the API quota background refreshes may use
+QUOTE_METRICS_INTERVAL = float(os.getenv("QUOTE_METRICS_INTERVAL", 300)) # Seconds between logs of the price path counters (cache, quota, keys, breaker)
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "database/history") # Daily bars of fetched symbols, one file per symbol
+
+SYMBOL_LIST_PATH = os.getenv("SYMBOL_LIST_PATH", "database/listing_status.csv") # Local copy of the listed symbols
+SYMBOL_LIST_REFRESH = float(os.getenv("SYMBOL_LIST_REFRESH", 24 * 3600)) # Seconds between listing downloads
+SYMBOL_REJECT_TTL = float(os.getenv("SYMBOL_REJECT_TTL", 3600)) # Seconds a symbol the API rejected is answered as invalid locally
+
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", 20)) # Users per admin list message; keep it under Telegram's 4096 characters
+REPORT_HISTORY_SIZE = int(os.getenv("REPORT_HISTORY_SIZE", 5)) # Latest trades shown in an admin user report
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25)) # Broadcast messages per second, under Telegram's ~30/s per bot
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 16)) # Broadcast sends in flight at once
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5)) # Seconds between progress updates to the admin
+BROADCAST_FLOOD_RETRIES = int(os.getenv("BROADCAST_FLOOD_RETRIES", 3)) # Flood waits one recipient is retried after before it counts as failed
+UNREACHABLE_REPROBE_DAYS = float(os.getenv("UNREACHABLE_REPROBE_DAYS", 30)) # Days before users who blocked the bot are included in broadcasts again
+
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", 30)) # Bot API calls per second for the whole bot
+TELEGRAM_BURST = int(os.getenv("TELEGRAM_BURST", 10)) # Bot API calls allowed back to back before the rate applies
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1)) # Bot API calls per second to one private chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 3)) # Calls allowed back to back to one private chat
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", 20 / 60)) # Bot API calls per second to one group or channel
+TELEGRAM_QUEUE_TIMEOUT = float(os.getenv("TELEGRAM_QUEUE_TIMEOUT", 30)) # Max seconds a reply to a user waits for its turn
+TELEGRAM_BULK_TIMEOUT = float(os.getenv("TELEGRAM_BULK_TIMEOUT", 600)) # Max seconds a broadcast send waits for its turn
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Public HTTPS base URL of the bot; updates come over a webhook when set, long polling otherwise
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook") # Path of the webhook endpoint
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0") # Interface the webhook server listens on
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080)) # Port the webhook server listens on
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Secret Telegram sends with every update; a random one is used per start if unset
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 64)) # Updates handled at once in webhook mode
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)) # Requests Telegram keeps open to the webhook, 1-100
+
 IGNORE_SENDER = False # Sends a message to admin that has initiated broadcasting if false, otherwise skips that admin
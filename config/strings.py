@@ -14,6 +14,8 @@ DEFAULT_HELLO=(
 SEND_SYMBOL_CHECK='⌨️ Please enter a stock symbol to check its price (e.g., AAPL).'
 INVALID_SYMBOL='❌ <b>Invalid Symbol.</b> Please check the ticker and try again.'
 CURRENT_PRICE='💹 <b>{symbol}</b>: <code>${price}</code>'
+PRICE_CHANGE='📊 1 day: <b>{change:+.2f}%</b>'
+PRICE_AVERAGE='📈 {window} day average: <code>${average:.2f}</code>'
 CURRENT_BALANCE='💰 Your balance is <b>${price:.2f}</b>'
 
 # === Buying ===
@@ -11,6 +11,10 @@ PROMPT_TYPE_YES = 'Confirm your action to delete user <code>{user_id}</code> wit
 
 # Results
 RESULT_SEND = 'Message:\n\n <code>{message_text}</code>\n\n was sent {count} users!'
+BROADCAST_STARTED = 'Broadcast #{job_id}: sending to {total} users in the background...'
+BROADCAST_PROGRESS = 'Broadcast #{job_id}: {sent} sent, {failed} failed of {total}\n{rate} msg/s, about {eta} left'
+BROADCAST_STATE = 'Broadcast #{job_id} is {state}: {sent} sent, {failed} failed of {total}'
+BROADCAST_NOT_CHANGED = 'Broadcast #{job_id} cannot be changed anymore'
 SUCCESS_DELETE = '✅ Successfully deleted all data for user {user_id}'
 
 # User listing messages
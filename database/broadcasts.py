@@ -0,0 +1,137 @@
+import datetime
+
+import aiosqlite
+
+from database.trading import transaction
+
+# States of a broadcast job
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+# States a job may be moved to from each state
+_TRANSITIONS = {
+    RUNNING: {PAUSED, CANCELLED, DONE},
+    PAUSED: {RUNNING, CANCELLED},
+    CANCELLED: set(),
+    DONE: set(),
+}
+
+_JOB_COLUMNS = ('id', 'admin_id', 'text', 'state', 'exclude_id', 'cursor', 'total', 'sent', 'failed',
+                'status_message_id', 'created', 'finished')
+
+# Reachable users after the cursor the job has not handled yet, in id order (users_reachable index)
+_PENDING = """SELECT id FROM users
+              WHERE id > ? AND id IS NOT ? AND unreachable_since IS NULL
+                AND NOT EXISTS (SELECT 1 FROM broadcast_recipients r WHERE r.job_id = ? AND r.user_id = users.id)
+              ORDER BY id
+              LIMIT ?"""
+
+
+async def create_job(db: aiosqlite.Connection, admin_id: int, text: str, exclude_id: int | None = None,
+                     reprobe_before: datetime.datetime | None = None) -> dict | None:
+    """
+    Creates a running broadcast job to every reachable user but `exclude_id`.
+
+    Users found unreachable before `reprobe_before` count as reachable again, so the job
+    tries them once more; a send that still fails marks them again with the current time.
+
+    Parameters:
+    db (aiosqlite.Connection): The writer connection.
+    admin_id (int): The admin who sent the broadcast; progress is reported to their chat.
+    text (str): HTML text of the message.
+    exclude_id (int | None): User id to leave out.
+    reprobe_before (datetime.datetime | None): Age (UTC) after which unreachable users are tried again.
+
+    Returns:
+    dict | None: The new job, or None if there is nobody to send to.
+    """
+    async with transaction(db):
+        if reprobe_before is not None:
+            await db.execute('UPDATE users SET unreachable_since = NULL WHERE unreachable_since < ?',
+                             (reprobe_before.strftime('%Y-%m-%d %H:%M:%S'),))
+        async with db.execute('SELECT COUNT(*) FROM users WHERE id IS NOT ? AND unreachable_since IS NULL', (exclude_id,)) as query:
+            total = (await query.fetchone())[0]
+        if not total:
+            return None
+        async with db.execute('INSERT INTO broadcast_jobs (admin_id, text, exclude_id, total) VALUES (?, ?, ?, ?)',
+                              (admin_id, text, exclude_id, total)) as query:
+            job_id = query.lastrowid
+
+    return await get_job(db, job_id)
+
+
+async def get_job(db: aiosqlite.Connection, job_id: int) -> dict | None:
+    async with db.execute(f'SELECT {", ".join(_JOB_COLUMNS)} FROM broadcast_jobs WHERE id = ?', (job_id,)) as query:
+        row = await query.fetchone()
+    return dict(zip(_JOB_COLUMNS, row)) if row else None
+
+
+async def jobs_in_state(db: aiosqlite.Connection, state: str) -> list[dict]:
+    async with db.execute(f'SELECT {", ".join(_JOB_COLUMNS)} FROM broadcast_jobs WHERE state = ? ORDER BY id', (state,)) as query:
+        return [dict(zip(_JOB_COLUMNS, row)) for row in await query.fetchall()]
+
+
+async def set_job_state(db: aiosqlite.Connection, job_id: int, state: str) -> bool:
+    """
+    Moves the job to `state` if its current state allows it.
+
+    Returns:
+    bool: Whether the state was changed.
+    """
+    allowed = [current for current, targets in _TRANSITIONS.items() if state in targets]
+    async with transaction(db):
+        async with db.execute(f"""UPDATE broadcast_jobs
+                                  SET state = ?, finished = CASE WHEN ? IN ('{CANCELLED}', '{DONE}') THEN datetime('now') END
+                                  WHERE id = ? AND state IN ({", ".join("?" * len(allowed))})""",
+                              (state, state, job_id, *allowed)) as query:
+            return query.rowcount == 1
+
+
+async def set_status_message(db: aiosqlite.Connection, job_id: int, message_id: int) -> None:
+    async with transaction(db):
+        await db.execute('UPDATE broadcast_jobs SET status_message_id = ? WHERE id = ?', (message_id, job_id))
+
+
+async def pending_recipients(db: aiosqlite.Connection, job: dict, after: int, limit: int) -> list[int]:
+    """Returns up to `limit` ids of users after `after` the job has not handled yet. `db` may be a reader."""
+    async with db.execute(_PENDING, (after, job['exclude_id'], job['id'], limit)) as query:
+        return [user_id for (user_id,) in await query.fetchall()]
+
+
+async def record_results(db: aiosqlite.Connection, job_id: int, results: list[tuple[int, bool]], cursor: int | None = None,
+                         unreachable: list[int] = ()) -> None:
+    """
+    Stores the outcome of sends to a job's recipients and moves its cursor, in one transaction.
+
+    Parameters:
+    db (aiosqlite.Connection): The writer connection.
+    job_id (int): The job.
+    results (list[tuple[int, bool]]): (user id, whether the message was delivered).
+    cursor (int | None): New cursor, every recipient up to it is done. None leaves it.
+    unreachable (list[int]): Users among the failed ones who blocked the bot or are gone; later broadcasts skip them.
+    """
+    sent = sum(1 for _, delivered in results if delivered)
+    async with transaction(db):
+        await db.executemany('INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id, sent) VALUES (?, ?, ?)',
+                             [(job_id, user_id, int(delivered)) for user_id, delivered in results])
+        await db.execute("""UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ?, cursor = MAX(cursor, COALESCE(?, cursor))
+                            WHERE id = ?""", (sent, len(results) - sent, cursor, job_id))
+        await _set_reachability(db, unreachable, False)
+
+
+async def set_reachable(db: aiosqlite.Connection, user_id: int, reachable: bool) -> None:
+    """Marks the user reachable or not, e.g. when they block or unblock the bot."""
+    async with transaction(db):
+        await _set_reachability(db, [user_id], reachable)
+
+
+async def _set_reachability(db: aiosqlite.Connection, user_ids: list[int], reachable: bool) -> None:
+    # A user keeps the time they were first found unreachable until they are reachable again
+    if reachable:
+        await db.executemany('UPDATE users SET unreachable_since = NULL WHERE id = ? AND unreachable_since IS NOT NULL',
+                             [(user_id,) for user_id in user_ids])
+    else:
+        await db.executemany("UPDATE users SET unreachable_since = datetime('now') WHERE id = ? AND unreachable_since IS NULL",
+                             [(user_id,) for user_id in user_ids])
@@ -0,0 +1,150 @@
+import asyncio
+import datetime
+import logging
+import time
+
+import aiosqlite
+
+from database.trading import backfill_cost_basis, transaction
+
+# Newest trade before the cutoff (history_time index); compaction never looks past it
+_LAST_OLD = 'SELECT MAX(id) FROM history WHERE time < ?'
+
+# Trade rows a history row may be moved with: not part of an open lot, and not of a holding
+# whose cost basis still has to be walked from history. Keyset on the id range, so rows that
+# are kept are read once per run, not once per batch
+_MOVABLE = """SELECT h.id FROM history h
+              WHERE h.id > ? AND h.id <= ? AND h.time < ?
+                AND NOT EXISTS (SELECT 1 FROM lots l WHERE l.id = h.id)
+                AND NOT EXISTS (SELECT 1 FROM user_savings s
+                                WHERE s.user_id = h.user_id AND s.stock = h.stock AND s.cost_basis IS NULL)
+              ORDER BY h.id
+              LIMIT ?"""
+
+
+async def compact_history(db: aiosqlite.Connection, cutoff: datetime.datetime, batch: int = 500) -> int:
+    """
+    Moves trades older than `cutoff` out of `history`.
+
+    Each moved row is copied to `history_archive` and folded into the per-user, per-symbol
+    totals of `history_summary`. Rows still needed for profit calculation stay: purchases
+    with shares still held (open lots) and every trade of a holding whose cost basis has not
+    been backfilled. Everything else, including closed-out positions, is moved, so `history`
+    only keeps recent trades and open purchases.
+
+    Rows are moved in transactions of `batch` rows, so trades only wait for one short batch.
+
+    Parameters:
+    db (aiosqlite.Connection): The writer connection.
+    cutoff (datetime.datetime): Trades before this time (UTC, like `history.time`) are moved.
+    batch (int): Rows moved per transaction, at most 999.
+
+    Returns:
+    int: Number of rows moved.
+    """
+    await backfill_cost_basis(db)
+
+    cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+    async with db.execute(_LAST_OLD, (cutoff,)) as query:
+        last = (await query.fetchone())[0]
+    if last is None:
+        return 0
+
+    moved = 0
+    after = -2 ** 63
+    while True:
+        async with transaction(db):
+            async with db.execute(_MOVABLE, (after, last, cutoff, batch)) as query:
+                ids = [row[0] for row in await query.fetchall()]
+            if not ids:
+                return moved
+            after = ids[-1]
+
+            selected = f'FROM history WHERE id IN ({", ".join("?" * len(ids))})'
+            await db.execute(f'INSERT INTO history_archive (id, user_id, stock, price, quantity, time) SELECT id, user_id, stock, price, quantity, time {selected}', ids)
+            await db.execute(f"""INSERT INTO history_summary (user_id, stock, bought_quantity, bought_value, sold_quantity, sold_value,
+                                                              trades, first_time, last_time)
+                                 SELECT user_id, stock,
+                                        SUM(MAX(quantity, 0)), SUM(MAX(quantity, 0) * price),
+                                        SUM(MAX(-quantity, 0)), SUM(MAX(-quantity, 0) * price),
+                                        COUNT(*), MIN(time), MAX(time)
+                                 {selected}
+                                 GROUP BY user_id, stock
+                                 ON CONFLICT(user_id, stock)
+                                 DO UPDATE SET bought_quantity = bought_quantity + excluded.bought_quantity,
+                                               bought_value = bought_value + excluded.bought_value,
+                                               sold_quantity = sold_quantity + excluded.sold_quantity,
+                                               sold_value = sold_value + excluded.sold_value,
+                                               trades = trades + excluded.trades,
+                                               first_time = MIN(first_time, excluded.first_time),
+                                               last_time = MAX(last_time, excluded.last_time)""", ids)
+            await db.execute(f'DELETE {selected}', ids)
+            moved += len(ids)
+
+        # Let waiting trades in between batches
+        await asyncio.sleep(0)
+
+
+class HistoryCompactor:
+    """
+    Background task that runs `compact_history` every `interval` seconds, moving trades
+    older than `keep_days` days out of the hot table.
+
+    Parameters:
+        db: aiosqlite.Connection
+            The writer connection.
+        keep_days: float
+            Age in days after which trades are moved.
+        interval: float
+            Seconds between runs.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, keep_days: float, interval: float):
+        self.db = db
+        self.keep_days = keep_days
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+        self.runs = 0
+        self.moved = 0
+        self.last_run_seconds = 0.0
+
+    async def compact_once(self) -> int:
+        started = time.monotonic()
+        cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=self.keep_days)
+        moved = await compact_history(self.db, cutoff)
+
+        self.runs += 1
+        self.moved += moved
+        self.last_run_seconds = time.monotonic() - started
+        return moved
+
+    async def run(self) -> None:
+        while True:
+            try:
+                moved = await self.compact_once()
+                logging.info(f'HistoryCompactor run {self.runs}: moved {moved} trades in {self.last_run_seconds:.1f}s')
+            except Exception as e:
+                logging.error(f'HistoryCompactor run failed: {e}')
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'runs': self.runs,
+            'moved': self.moved,
+            'last_run_seconds': round(self.last_run_seconds, 2),
+        }
@@ -0,0 +1,191 @@
+import logging
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+from database.trading import backfill_holding
+
+
+async def _initial_schema(db: aiosqlite.Connection) -> None:
+    # IF NOT EXISTS adopts databases created before migrations were tracked
+    await db.execute("""CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY NOT NULL,
+                                                       cash NUMERIC NOT NULL DEFAULT 10000.00,
+                                                       created DATE NOT NULL DEFAULT (date()),
+                                                       username TEXT null on conflict ignore)""")
+
+    await db.execute("""CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                         user_id INTEGER NOT NULL,
+                                                         stock TEXT NOT NULL,
+                                                         price NUMERIC NOT NULL,
+                                                         quantity INTEGER NOT NULL,
+                                                         time NUMERIC DEFAULT (datetime('now')),
+                                                         FOREIGN KEY (user_id) REFERENCES users(id))""")
+
+    await db.execute("""CREATE TABLE IF NOT EXISTS user_savings (user_id INTEGER NOT NULL,
+                                                              stock TEXT NOT NULL,
+                                                              quantity INTEGER NOT NULL,
+                                                              PRIMARY KEY (user_id, stock),
+                                                              FOREIGN KEY (user_id) REFERENCES users(id))""")
+
+    await db.execute("""CREATE TRIGGER IF NOT EXISTS delete_zero_quantity
+                        AFTER UPDATE ON user_savings
+                        FOR EACH ROW
+                        WHEN NEW.quantity = 0
+                        BEGIN
+                            DELETE FROM user_savings WHERE user_id = NEW.user_id AND stock = NEW.stock;
+                        END""")
+
+    await db.execute("""CREATE TABLE IF NOT EXISTS prices (symbol TEXT PRIMARY KEY NOT NULL,
+                                                        price TEXT NOT NULL,
+                                                        as_of DATE NOT NULL,
+                                                        fetched NUMERIC DEFAULT (datetime('now')))""")
+
+
+async def _hot_path_indexes(db: aiosqlite.Connection) -> None:
+    # Purchases of one stock by one user, newest first, without touching the table (calc_profit)
+    await db.execute("""CREATE INDEX IF NOT EXISTS history_user_stock_buys
+                        ON history (user_id, stock, id, quantity, price) WHERE quantity > 0""")
+    # A user's trades in time order (admin report, user deletion)
+    await db.execute('CREATE INDEX IF NOT EXISTS history_user_time ON history (user_id, time, stock, price, quantity)')
+    # Admin lookup by username
+    await db.execute('CREATE INDEX IF NOT EXISTS users_username ON users (username)')
+
+
+async def _cost_basis_lots(db: aiosqlite.Connection) -> None:
+    # What the held shares cost; filled in below for holdings that already exist
+    async with db.execute("SELECT 1 FROM pragma_table_info('user_savings') WHERE name = 'cost_basis'") as query:
+        if not await query.fetchone():
+            await db.execute('ALTER TABLE user_savings ADD COLUMN cost_basis NUMERIC')
+
+    # Purchases whose shares are still held, id is the purchase's history id
+    await db.execute("""CREATE TABLE IF NOT EXISTS lots (id INTEGER PRIMARY KEY NOT NULL,
+                                                      user_id INTEGER NOT NULL,
+                                                      stock TEXT NOT NULL,
+                                                      quantity INTEGER NOT NULL,
+                                                      price NUMERIC NOT NULL,
+                                                      FOREIGN KEY (user_id) REFERENCES users(id))""")
+    await db.execute('CREATE INDEX IF NOT EXISTS lots_user_stock ON lots (user_id, stock, id)')
+
+    async with db.execute('SELECT user_id, stock FROM user_savings WHERE cost_basis IS NULL') as query:
+        holdings = await query.fetchall()
+    for user_id, stock in holdings:
+        await backfill_holding(db, user_id, stock)
+
+
+async def _history_archive(db: aiosqlite.Connection) -> None:
+    # Trades moved out of history by database.compaction, unchanged
+    await db.execute("""CREATE TABLE IF NOT EXISTS history_archive (id INTEGER PRIMARY KEY NOT NULL,
+                                                                 user_id INTEGER NOT NULL,
+                                                                 stock TEXT NOT NULL,
+                                                                 price NUMERIC NOT NULL,
+                                                                 quantity INTEGER NOT NULL,
+                                                                 time NUMERIC)""")
+    await db.execute('CREATE INDEX IF NOT EXISTS history_archive_user_time ON history_archive (user_id, time)')
+
+    # Totals of the moved trades per user and symbol
+    await db.execute("""CREATE TABLE IF NOT EXISTS history_summary (user_id INTEGER NOT NULL,
+                                                                 stock TEXT NOT NULL,
+                                                                 bought_quantity INTEGER NOT NULL,
+                                                                 bought_value NUMERIC NOT NULL,
+                                                                 sold_quantity INTEGER NOT NULL,
+                                                                 sold_value NUMERIC NOT NULL,
+                                                                 trades INTEGER NOT NULL,
+                                                                 first_time NUMERIC,
+                                                                 last_time NUMERIC,
+                                                                 PRIMARY KEY (user_id, stock))""")
+
+
+async def _broadcast_jobs(db: aiosqlite.Connection) -> None:
+    # Broadcasts run as background jobs; `cursor` is the user id up to which every recipient is done
+    await db.execute("""CREATE TABLE IF NOT EXISTS broadcast_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                                admin_id INTEGER NOT NULL,
+                                                                text TEXT NOT NULL,
+                                                                state TEXT NOT NULL DEFAULT 'running',
+                                                                exclude_id INTEGER,
+                                                                cursor INTEGER NOT NULL DEFAULT -9223372036854775808,
+                                                                total INTEGER NOT NULL DEFAULT 0,
+                                                                sent INTEGER NOT NULL DEFAULT 0,
+                                                                failed INTEGER NOT NULL DEFAULT 0,
+                                                                status_message_id INTEGER,
+                                                                created NUMERIC DEFAULT (datetime('now')),
+                                                                finished NUMERIC)""")
+    await db.execute('CREATE INDEX IF NOT EXISTS broadcast_jobs_state ON broadcast_jobs (state)')
+
+    # Recipients handled by a job, also those past its cursor, so a resumed job skips them
+    await db.execute("""CREATE TABLE IF NOT EXISTS broadcast_recipients (job_id INTEGER NOT NULL,
+                                                                      user_id INTEGER NOT NULL,
+                                                                      sent INTEGER NOT NULL,
+                                                                      PRIMARY KEY (job_id, user_id)) WITHOUT ROWID""")
+    await db.execute('CREATE INDEX IF NOT EXISTS broadcast_recipients_user ON broadcast_recipients (user_id)')
+
+
+async def _user_reachability(db: aiosqlite.Connection) -> None:
+    # When a send found the user gone (blocked the bot, deleted the account); NULL while reachable
+    async with db.execute("SELECT 1 FROM pragma_table_info('users') WHERE name = 'unreachable_since'") as query:
+        if not await query.fetchone():
+            await db.execute('ALTER TABLE users ADD COLUMN unreachable_since NUMERIC')
+    # Broadcast recipients in id order, without the unreachable ones
+    await db.execute('CREATE INDEX IF NOT EXISTS users_reachable ON users (id) WHERE unreachable_since IS NULL')
+    # Unreachable users by age, for re-probing
+    await db.execute('CREATE INDEX IF NOT EXISTS users_unreachable ON users (unreachable_since) WHERE unreachable_since IS NOT NULL')
+
+
+async def _history_time_index(db: aiosqlite.Connection) -> None:
+    # Trades older than the compaction cutoff, without a pass over the recent ones
+    await db.execute('CREATE INDEX IF NOT EXISTS history_time ON history (time)')
+
+
+# Applied in order; a database at user_version N has the first N applied. Never edit or
+# reorder a released step, append a new one instead
+MIGRATIONS: list[tuple[str, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    ('initial schema', _initial_schema),
+    ('hot path indexes', _hot_path_indexes),
+    ('cost basis and open lots', _cost_basis_lots),
+    ('history archive and summary', _history_archive),
+    ('broadcast jobs', _broadcast_jobs),
+    ('user reachability', _user_reachability),
+    ('history time index', _history_time_index),
+]
+
+
+async def schema_version(db: aiosqlite.Connection) -> int:
+    async with db.execute('PRAGMA user_version') as query:
+        return (await query.fetchone())[0]
+
+
+async def migrate(db: aiosqlite.Connection, migrations: list[tuple[str, Callable]] = MIGRATIONS) -> int:
+    """
+    Brings the database schema up to date.
+
+    The schema version is kept in `PRAGMA user_version`. Only the steps above it run, each
+    in its own transaction together with the version bump, so a failed step leaves the
+    database at the previous version. On an up-to-date database this is a single pragma read.
+
+    Parameters:
+    db (aiosqlite.Connection): The writer connection.
+    migrations (list[tuple[str, Callable]]): Steps as (description, coroutine function).
+
+    Raises:
+    RuntimeError: If the database was migrated by a newer version of the bot.
+
+    Returns:
+    int: Number of steps applied.
+    """
+    version = await schema_version(db)
+    if version > len(migrations):
+        raise RuntimeError(f'Database schema version {version} is newer than this bot ({len(migrations)})')
+
+    # Runs before anything else uses the connection. Unlike `transaction` it leaves foreign
+    # keys alone: sqlite's table rebuild procedure needs them off
+    for number, (description, step) in enumerate(migrations[version:], start=version + 1):
+        await db.execute('BEGIN IMMEDIATE')
+        try:
+            await step(db)
+            await db.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+        logging.info(f'Applied migration {number}: {description}')
+
+    return len(migrations) - version
@@ -3,11 +3,9 @@ from decimal import Decimal
 
 from typing import List
 
-from sqlalchemy import func, ForeignKey, Numeric, BigInteger, create_engine
+from sqlalchemy import func, ForeignKey, Numeric, BigInteger
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped, relationship
 
-engine = create_engine('sqlite:///test.db', echo=True)
-
 class Base(DeclarativeBase):
     pass
 
@@ -18,8 +16,9 @@ class User(Base):
     cash: Mapped[Decimal] = mapped_column(Numeric(12, 2), default=10000.00)
     created: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
     username: Mapped[str] = mapped_column(nullable=True)
+    unreachable_since: Mapped[datetime.datetime] = mapped_column(nullable=True)
 
-    savings: Mapped[List['Savings']] = relationship(back_populates='user')
+    savings: Mapped[List['Stock']] = relationship(back_populates='user')
 
 
 
@@ -29,6 +28,7 @@ class Stock(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
     stock: Mapped[str] = mapped_column(primary_key=True)
     quantity: Mapped[int] = mapped_column(nullable=False)
+    cost_basis: Mapped[Decimal] = mapped_column(Numeric(14, 4), nullable=True)
 
     user: Mapped['User'] = relationship(back_populates='savings')
 
@@ -45,4 +45,32 @@ class Operation(Base):
     quantity: Mapped[int] = mapped_column(nullable=False)
     time: Mapped[datetime.datetime] = mapped_column(default=func.now())
 
-Base.metadata.create_all(engine)
\ No newline at end of file
+
+class ArchivedOperation(Base):
+    __tablename__ = 'history_archive'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(nullable=False)
+    stock: Mapped[str] = mapped_column(nullable=False)
+    price: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+    time: Mapped[datetime.datetime] = mapped_column(nullable=True)
+
+
+class Lot(Base):
+    __tablename__ = 'lots'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    stock: Mapped[str] = mapped_column(nullable=False)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+    price: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+
+
+class Price(Base):
+    __tablename__ = 'prices'
+
+    symbol: Mapped[str] = mapped_column(primary_key=True)
+    price: Mapped[str] = mapped_column(nullable=False)
+    as_of: Mapped[datetime.date] = mapped_column(nullable=False)
+    fetched: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import AsyncIterator
+
+import aiosqlite
+
+
+def connection_pragmas(mmap_size: int, cache_size: int) -> list[str]:
+    # Negative cache_size is in KiB rather than pages
+    return [
+        f'PRAGMA mmap_size = {int(mmap_size)}',
+        f'PRAGMA cache_size = {-int(cache_size)}',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA busy_timeout = 5000',
+    ]
+
+
+async def open_writer(path: str, mmap_size: int = 64 * 2 ** 20, cache_size: int = 16 * 2 ** 10) -> aiosqlite.Connection:
+    """
+    Opens the single writer connection of the bot database in WAL mode.
+
+    WAL lets the reader connections keep reading while a trade commits, and synchronous=NORMAL
+    only syncs at checkpoints, which in WAL mode still can't corrupt the database. A power cut
+    may lose the last transactions, not break the file.
+
+    Parameters:
+    path (str): Path of the database file.
+    mmap_size (int): Bytes of the file read through memory mapping.
+    cache_size (int): Page cache size in KiB.
+
+    Returns:
+    aiosqlite.Connection: The writer connection.
+    """
+    db = await aiosqlite.connect(path)
+    async with db.execute('PRAGMA journal_mode = WAL') as query:
+        mode = (await query.fetchone())[0]
+    if mode != 'wal':
+        logging.warning(f'Database {path} is not in WAL mode ({mode}), reads will wait for writes')
+
+    await db.execute('PRAGMA synchronous = NORMAL')
+    for pragma in connection_pragmas(mmap_size, cache_size):
+        await db.execute(pragma)
+    return db
+
+
+class ReaderPool:
+    """
+    Pool of read-only connections to the bot database.
+
+    Reports and portfolio views run here, so a long read no longer queues in front of the
+    trades on the writer connection. Each aiosqlite connection has its own thread, so up to
+    `size` reads run in parallel. With the database in WAL mode readers see the last committed
+    state and neither block nor are blocked by the writer.
+    """
+
+    def __init__(self, path: str, size: int = 4, mmap_size: int = 64 * 2 ** 20, cache_size: int = 16 * 2 ** 10):
+        self.path = path
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._connections: list[aiosqlite.Connection] = []
+
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            db = await aiosqlite.connect(f'file:{self.path}?mode=ro', uri=True)
+            for pragma in connection_pragmas(self.mmap_size, self.cache_size):
+                await db.execute(pragma)
+            await db.execute('PRAGMA query_only = ON')
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+
+    async def close(self) -> None:
+        for db in self._connections:
+            await db.close()
+        self._connections.clear()
+        self._idle = asyncio.Queue()
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Lends an idle reader connection for the block, waiting for one if all are busy."""
+        started = time.monotonic()
+        if self._idle.empty():
+            self.waited += 1
+        db = await self._idle.get()
+        self.acquired += 1
+        self.total_wait += time.monotonic() - started
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'idle': self._idle.qsize(),
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'avg_wait': round(self.total_wait / self.acquired, 4) if self.acquired else 0.0,
+        }
+
+
+@contextlib.asynccontextmanager
+async def read_connection(readers: ReaderPool | None, db: aiosqlite.Connection) -> AsyncIterator[aiosqlite.Connection]:
+    """Yields a reader from `readers`, or the shared connection `db` when there is no pool (e.g. in tests)."""
+    if readers is None:
+        yield db
+        return
+    async with readers.connection() as reader:
+        yield reader
@@ -0,0 +1,237 @@
+import contextlib
+import functools
+from typing import AsyncIterator
+
+import aiosqlite
+from sqlalchemy import CompoundSelect, Select, and_, bindparam, func, literal_column, select, true, union_all
+from sqlalchemy.dialects import sqlite
+
+from config.config import REPORT_HISTORY_SIZE, USERS_PAGE_SIZE
+from database.models import ArchivedOperation, Operation, Stock, User
+from database.pool import ReaderPool, read_connection
+
+users = User.__table__
+savings = Stock.__table__
+history = Operation.__table__
+archive = ArchivedOperation.__table__
+
+# Statements of the read side, built once from the models
+USER = select(users.c.id, users.c.cash, users.c.created, users.c.username).where(users.c.id == bindparam('user_id'))
+USER_BY_USERNAME = select(users.c.id, users.c.cash, users.c.created, users.c.username).where(users.c.username == bindparam('username'))
+CASH = select(users.c.cash).where(users.c.id == bindparam('user_id'))
+USER_COUNT = select(func.count()).select_from(users)
+USERS_AFTER = (select(users.c.id, users.c.cash, users.c.created, users.c.username)
+               .where(users.c.id > bindparam('after'))
+               .order_by(users.c.id)
+               .limit(bindparam('limit')))
+USERS_BEFORE = (select(users.c.id, users.c.cash, users.c.created, users.c.username)
+                .where(users.c.id < bindparam('before'))
+                .order_by(users.c.id.desc())
+                .limit(bindparam('limit')))
+HOLDINGS = select(savings.c.stock, savings.c.quantity).where(savings.c.user_id == bindparam('user_id'))
+HOLDING = select(savings.c.quantity).where(savings.c.user_id == bindparam('user_id'), savings.c.stock == bindparam('stock'))
+
+
+def _recent_history() -> CompoundSelect:
+    # Compaction moves old trades to the archive. Both tables are read newest first from their
+    # (user_id, time) indexes and merged, so only `limit` rows are looked at
+    return (union_all(*(select(table.c.id, table.c.stock, table.c.price, table.c.quantity, table.c.time)
+                        .where(table.c.user_id == bindparam('user_id'))
+                        for table in (history, archive)))
+            .order_by(literal_column('time').desc())
+            .limit(bindparam('limit')))
+
+
+RECENT_HISTORY = _recent_history()
+
+
+def _portfolio() -> Select:
+    held = (select(savings.c.stock, savings.c.quantity, savings.c.cost_basis)
+            .where(savings.c.user_id == bindparam('user_id'))
+            .cte('held'))
+    h = history.alias('h')
+    # Shares bought after each purchase, walking the purchases newest first like calc_profit
+    newer = func.sum(h.c.quantity).over(partition_by=h.c.stock, order_by=h.c.id.desc()) - h.c.quantity
+    buys = (select(h.c.stock, h.c.price, h.c.quantity, newer.label('newer'))
+            .join_from(h, held, and_(held.c.stock == h.c.stock, held.c.cost_basis.is_(None)))
+            # A literal 0, so sqlite can match the partial index on purchases
+            .where(h.c.user_id == bindparam('user_id'), h.c.quantity > literal_column('0'))
+            .cte('buys'))
+    taken = func.max(literal_column('0'), func.min(buys.c.quantity, held.c.quantity - buys.c.newer))
+    walked = (select(buys.c.stock, func.sum(taken * buys.c.price).label('cost'))
+              .join_from(buys, held, held.c.stock == buys.c.stock)
+              .group_by(buys.c.stock)
+              .cte('walked'))
+    u = users.alias('u')
+    return (select(u.c.cash, held.c.stock, held.c.quantity, func.coalesce(held.c.cost_basis, walked.c.cost, literal_column('0')))
+            .select_from(u.outerjoin(held, true()).outerjoin(walked, walked.c.stock == held.c.stock))
+            .where(u.c.id == bindparam('user_id'))
+            .order_by(held.c.stock))
+
+
+PORTFOLIO = _portfolio()
+
+
+@functools.cache
+def compiled(statement: Select) -> tuple[str, tuple[str, ...], dict]:
+    """
+    Compiles a statement for sqlite once.
+
+    Returns its SQL, the names of its parameters in order, and the values of the parameters
+    the statement sets itself (e.g. the OFFSET sqlite needs with a bound LIMIT).
+    """
+    result = statement.compile(dialect=sqlite.dialect())
+    return str(result), tuple(result.positiontup), result.params
+
+
+class Repository:
+    """
+    Read side of the bot database.
+
+    Queries are SQLAlchemy Core statements over the tables of `database.models`. Each is
+    compiled to sqlite SQL on first use and cached, then executed directly on an aiosqlite
+    reader, so a request costs the same as a hand-written query. Writes stay on the writer
+    connection in `database.trading`, where trades are group committed.
+
+    Parameters:
+        db: aiosqlite.Connection
+            The writer connection, used for reads when there is no reader pool (e.g. in tests).
+        readers: ReaderPool | None
+            Read-only connections the queries run on.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, readers: ReaderPool | None = None):
+        self.db = db
+        self.readers = readers
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Lends a reader for several queries in a row."""
+        async with read_connection(self.readers, self.db) as reader:
+            yield reader
+
+    @staticmethod
+    async def _query(conn: aiosqlite.Connection, statement: Select, **params) -> list[tuple]:
+        sql, names, defaults = compiled(statement)
+        async with conn.execute(sql, [params[name] if name in params else defaults[name] for name in names]) as query:
+            return await query.fetchall()
+
+    async def _all(self, statement: Select, **params) -> list[tuple]:
+        async with self.connection() as conn:
+            return await self._query(conn, statement, **params)
+
+    async def _first(self, statement: Select, **params) -> tuple | None:
+        rows = await self._all(statement, **params)
+        return rows[0] if rows else None
+
+    async def user(self, user_id: int) -> tuple | None:
+        """Returns (id, cash, created, username) of the user, or None."""
+        return await self._first(USER, user_id=user_id)
+
+    async def cash(self, user_id: int) -> float | None:
+        row = await self._first(CASH, user_id=user_id)
+        return row[0] if row else None
+
+    async def holdings(self, user_id: int) -> list[tuple[str, int]]:
+        """Returns (stock, quantity) of every stock the user holds."""
+        return await self._all(HOLDINGS, user_id=user_id)
+
+    async def holding(self, user_id: int, stock: str) -> int | None:
+        """Returns how many shares of `stock` the user holds, or None if none."""
+        row = await self._first(HOLDING, user_id=user_id, stock=stock)
+        return row[0] if row else None
+
+    async def count_users(self) -> int:
+        return (await self._first(USER_COUNT))[0]
+
+    async def portfolio(self, user_id: int) -> tuple[float, list[tuple[str, int, float]]] | None:
+        """
+        Retrieves the user's balance and every holding with its cost basis in a single query.
+
+        Holdings with a stored cost basis use it as is. For holdings that have not been backfilled
+        yet, the cost basis is computed in the same query the way `calc_profit` does it: window
+        functions walk the user's purchases of each stock newest first and take shares until the
+        held quantity is covered.
+
+        Parameters:
+        user_id (int): The ID of the user.
+
+        Returns:
+        tuple[float, list[tuple[str, int, float]]] | None: The balance and a list of (stock, quantity,
+            cost basis) sorted by stock, or None if the user does not exist.
+        """
+        rows = await self._all(PORTFOLIO, user_id=user_id)
+        if not rows:
+            return None
+        return rows[0][0], [(stock, quantity, cost) for _, stock, quantity, cost in rows if stock is not None]
+
+    async def users_page(self, after: int | None = None, before: int | None = None,
+                         limit: int = USERS_PAGE_SIZE) -> tuple[list[tuple], bool, bool]:
+        """
+        Retrieves one page of users in id order, starting after or ending before a known id.
+
+        Pages are found through the primary key rather than an OFFSET, so every page costs the
+        same and only `limit` rows are read, however many users there are.
+
+        Parameters:
+        after (int | None): Last user id of the previous page; the page starts after it.
+        before (int | None): First user id of the next page; the page ends before it. Ignored if `after` is given.
+        limit (int): Users per page.
+
+        Returns:
+        tuple[list[tuple], bool, bool]: Rows of (id, cash, created, username), and whether there
+        are users before and after the page.
+        """
+        if before is not None and after is None:
+            rows = await self._all(USERS_BEFORE, before=before, limit=limit + 1)
+            return rows[:limit][::-1], len(rows) > limit, True
+
+        rows = await self._all(USERS_AFTER, after=after if after is not None else -2 ** 63, limit=limit + 1)
+        return rows[:limit], after is not None, len(rows) > limit
+
+    async def user_report(self, user_id: int | None = None, username: str | None = None,
+                          history_limit: int = REPORT_HISTORY_SIZE) -> dict | None:
+        """
+        Retrieves a comprehensive user report containing user information, portfolio, and transaction history
+        based on either user ID or username. All queries run on one reader.
+
+        Parameters:
+        user_id (int | None): The unique identifier of the user. Optional; either user_id or username is required.
+        username (str | None): The username of the user. Optional; either username or user_id is required.
+        history_limit (int): Number of latest transactions to include.
+
+        Returns:
+        dict | None: A dictionary containing the following structure:
+            user_info: Dictionary with details about the user, including:
+                - id: The user ID.
+                - cash: The user's cash balance represented as a string formatted with commas and two decimal places.
+                - created: Timestamp of when the user was created.
+            savings: List of tuples where each tuple represents stock savings with stock name and quantity.
+            history: List of tuples representing the latest `history_limit` transactions, oldest first, with
+                     transaction id, stock name, price, quantity, and timestamp.
+            Returns None if no user is found or if both user_id and username are not provided.
+        """
+        if not (user_id or username):
+            return None
+
+        async with self.connection() as conn:
+            if user_id:
+                main_info = await self._query(conn, USER, user_id=user_id)
+            else:
+                main_info = await self._query(conn, USER_BY_USERNAME, username=username)
+            if not main_info:
+                return None
+            main_info = main_info[0]
+
+            savings_rows = await self._query(conn, HOLDINGS, user_id=main_info[0])
+            history_rows = await self._query(conn, RECENT_HISTORY, user_id=main_info[0], limit=history_limit)
+
+        return {
+            'user_info': {
+                'id': main_info[0],
+                'cash': f"{main_info[1]:,.2f}",
+                'created': main_info[2]
+            },
+            'savings': savings_rows,
+            'history': history_rows[::-1]
+        }
@@ -0,0 +1,426 @@
+import asyncio
+import collections
+import contextlib
+import time
+import weakref
+from collections import Counter
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import aiosqlite
+
+from config.config import TRADE_COMMIT_WINDOW, TRADE_BATCH_SIZE
+
+T = TypeVar('T')
+
+
+class NotEnoughCash(Exception):
+    """Raised by `buy_stock` when the balance does not cover the purchase. `balance` is the current balance."""
+
+    def __init__(self, balance: float):
+        super().__init__(balance)
+        self.balance = balance
+
+
+class NotEnoughShares(Exception):
+    """Raised by `sell_stock` when the user owns fewer shares than asked. `owned` is the current quantity."""
+
+    def __init__(self, owned: int):
+        super().__init__(owned)
+        self.owned = owned
+
+
+class TransactionStats:
+    """Counters of `transaction`: how many ran, failed, and how long they waited for and held the connection."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.committed = 0
+        self.rolled_back = 0
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self.total_held = 0.0
+        self._waiting = 0
+
+    def stats(self) -> dict:
+        finished = self.committed + self.rolled_back
+        return {
+            'committed': self.committed,
+            'rolled_back': self.rolled_back,
+            'max_waiting': self.max_waiting,
+            'avg_wait': round(self.total_wait / finished, 4) if finished else 0.0,
+            'avg_held': round(self.total_held / finished, 4) if finished else 0.0,
+        }
+
+
+# One lock per connection: sqlite has a single transaction per connection, so units of
+# work on a shared connection have to take turns
+_locks: weakref.WeakKeyDictionary[aiosqlite.Connection, asyncio.Lock] = weakref.WeakKeyDictionary()
+transaction_stats = TransactionStats()
+
+
+@contextlib.asynccontextmanager
+async def transaction(db: aiosqlite.Connection) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Runs the enclosed statements as one isolated unit of work on `db`.
+
+    Units of work on the same connection are serialized, so statements of two users' trades
+    can no longer end up in one transaction, or be committed or rolled back by the other.
+    The block commits when it exits normally and rolls back when it raises. Every write on a
+    shared connection has to go through here; keep the block to database statements only
+    (no API or Telegram calls), since everyone else's writes wait for it.
+
+    Parameters:
+    db (aiosqlite.Connection): The connection to run the transaction on.
+
+    Returns:
+    AsyncIterator[aiosqlite.Connection]: The same connection, inside the transaction.
+    """
+    lock = _locks.setdefault(db, asyncio.Lock())
+
+    queued = time.monotonic()
+    transaction_stats._waiting += 1
+    transaction_stats.max_waiting = max(transaction_stats.max_waiting, transaction_stats._waiting)
+    try:
+        await lock.acquire()
+    finally:
+        transaction_stats._waiting -= 1
+
+    started = time.monotonic()
+    transaction_stats.total_wait += started - queued
+    try:
+        await db.execute('PRAGMA foreign_keys = ON')
+        await db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            transaction_stats.rolled_back += 1
+            raise
+        await db.commit()
+        transaction_stats.committed += 1
+    finally:
+        transaction_stats.total_held += time.monotonic() - started
+        lock.release()
+
+
+class GroupCommitWriter:
+    """
+    Commits concurrent trades together.
+
+    Trades submitted while a batch is being written, or within `window` seconds of the
+    first one, are written in one transaction, so a burst of trades pays for one commit
+    instead of one each. Every trade runs in its own savepoint: a trade that raises is
+    rolled back alone and its caller gets the exception, while the rest of the batch
+    commits. A caller's result is only returned after the commit.
+
+    The worker task starts on the first submitted trade and exits when nothing is left,
+    so an idle bot has no task running.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, window: float = 0.002, max_batch: int = 64):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: collections.deque[tuple[Callable, asyncio.Future, float]] = collections.deque()
+        self._task: asyncio.Task | None = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.batches = 0
+        self.trades = 0
+        self.failed = 0
+        self.batch_sizes: Counter[int] = Counter()
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    async def submit(self, work: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+        """Runs `work(db)` in the next batch and returns its result once the batch is committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((work, future, time.monotonic()))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                if len(self._pending) < self.max_batch and self.window > 0:
+                    await asyncio.sleep(self.window)
+                batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch))]
+                await self._write(batch)
+        finally:
+            self._task = None
+            # Trades are only left over if the worker was cancelled
+            while self._pending:
+                _, future, _ = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError('Trade writer stopped'))
+
+    async def _write(self, batch: list[tuple[Callable, asyncio.Future, float]]) -> None:
+        db = self.db
+        outcomes = []
+        # Queue times of the trades whose savepoint actually ran, for the stats
+        ran = []
+        try:
+            async with transaction(db):
+                for work, future, queued in batch:
+                    if future.done():
+                        # The caller gave up waiting, e.g. its handler was cancelled
+                        continue
+                    ran.append(queued)
+                    await db.execute('SAVEPOINT trade')
+                    try:
+                        result = await work(db)
+                    except Exception as e:
+                        await db.execute('ROLLBACK TO trade')
+                        await db.execute('RELEASE trade')
+                        outcomes.append((future, None, e))
+                    else:
+                        await db.execute('RELEASE trade')
+                        outcomes.append((future, result, None))
+        except BaseException as e:
+            # The commit itself failed, so nothing of the batch was written
+            error = e if isinstance(e, Exception) else RuntimeError('Trade batch was interrupted')
+            outcomes = [(future, None, error) for _, future, _ in batch]
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self._settle(ran, outcomes)
+
+    def _settle(self, ran: list[float], outcomes: list[tuple[asyncio.Future, object, Exception | None]]) -> None:
+        now = time.monotonic()
+        if ran:
+            self.batches += 1
+            self.batch_sizes[len(ran)] += 1
+        for queued in ran:
+            self.total_latency += now - queued
+            self.max_latency = max(self.max_latency, now - queued)
+        self.trades += len(ran)
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'trades': self.trades,
+            'failed': self.failed,
+            'avg_batch': round(self.trades / self.batches, 2) if self.batches else 0.0,
+            'max_batch': max(self.batch_sizes, default=0),
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'avg_latency': round(self.total_latency / self.trades, 4) if self.trades else 0.0,
+            'max_latency': round(self.max_latency, 4),
+        }
+
+
+_writers: weakref.WeakKeyDictionary[aiosqlite.Connection, GroupCommitWriter] = weakref.WeakKeyDictionary()
+
+
+def trade_writer(db: aiosqlite.Connection) -> GroupCommitWriter:
+    """Returns the group commit writer of `db`, created on first use."""
+    writer = _writers.get(db)
+    if writer is None:
+        writer = _writers[db] = GroupCommitWriter(db, TRADE_COMMIT_WINDOW, TRADE_BATCH_SIZE)
+    return writer
+
+
+async def _buy(db: aiosqlite.Connection, user_id: int, symbol: str, price, amount: int) -> float:
+    total_price = amount * float(price)
+
+    async with db.execute('SELECT cash FROM users WHERE id = ?', (user_id,)) as query:
+        balance = await query.fetchone()
+    if int(balance[0]) < total_price:
+        raise NotEnoughCash(balance[0])
+
+    await db.execute('UPDATE users SET cash = cash - ? WHERE id = ?', (total_price, user_id))
+    # A holding that was not backfilled yet keeps a NULL cost basis until it is
+    await db.execute("""INSERT INTO user_savings (user_id, stock, quantity, cost_basis) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, stock)
+        DO UPDATE SET quantity = quantity + excluded.quantity,
+                      cost_basis = cost_basis + excluded.cost_basis""",
+                     (user_id, symbol, amount, amount * float(price),))
+    cursor = await db.execute('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                              (user_id, symbol, price, amount,))
+    await db.execute('INSERT INTO lots (id, user_id, stock, quantity, price) VALUES (?, ?, ?, ?, ?)',
+                     (cursor.lastrowid, user_id, symbol, amount, price))
+
+    return total_price
+
+
+async def buy_stock(db: aiosqlite.Connection, user_id: int, symbol: str, price, amount: int) -> float:
+    """
+    Buys `amount` shares of `symbol` at `price` for the user as one atomic unit of work.
+
+    The purchase is also recorded as an open lot and added to the holding's cost basis.
+    It is committed together with other trades arriving at the same time, in its own
+    savepoint (see `GroupCommitWriter`), and returns once it is committed.
+
+    Parameters:
+    db (aiosqlite.Connection): The shared database connection.
+    user_id (int): Buyer's Telegram ID.
+    symbol (str): Ticker symbol, upper case.
+    price (str | float): Price of one share.
+    amount (int): Number of shares, positive.
+
+    Raises:
+    NotEnoughCash: If the balance does not cover the purchase. Nothing is written.
+
+    Returns:
+    float: Total price paid.
+    """
+    return await trade_writer(db).submit(lambda conn: _buy(conn, user_id, symbol, price, amount))
+
+
+async def _consume_lots(db: aiosqlite.Connection, user_id: int, symbol: str, amount: int) -> float:
+    # Sold shares come out of the oldest lots first, so the shares still held are always the
+    # newest purchases, the same ones calc_profit walks back to. Returns their cost
+    consumed = []
+    async with db.execute('SELECT id, quantity, price FROM lots WHERE user_id = ? AND stock = ? ORDER BY id',
+                          (user_id, symbol)) as query:
+        remaining = amount
+        while remaining:
+            lot = await query.fetchone()
+            if lot is None:
+                raise RuntimeError(f'Open lots of {symbol} for user {user_id} cover fewer than {amount} shares')
+            take = min(lot[1], remaining)
+            consumed.append((lot[0], lot[1] - take, take * float(lot[2])))
+            remaining -= take
+
+    for lot_id, left, _ in consumed:
+        if left:
+            await db.execute('UPDATE lots SET quantity = ? WHERE id = ?', (left, lot_id))
+        else:
+            await db.execute('DELETE FROM lots WHERE id = ?', (lot_id,))
+    return sum(cost for _, _, cost in consumed)
+
+
+async def _sell(db: aiosqlite.Connection, user_id: int, symbol: str, price, amount: int) -> float:
+    total_price = amount * float(price)
+
+    async with db.execute('SELECT quantity, cost_basis FROM user_savings WHERE user_id = ? AND stock = ?', (user_id, symbol)) as query:
+        owned = await query.fetchone()
+    if not owned or owned[0] < amount:
+        raise NotEnoughShares(owned[0] if owned else 0)
+
+    if owned[0] == amount:
+        # The holding is closed and its row removed by the delete_zero_quantity trigger
+        await db.execute('DELETE FROM lots WHERE user_id = ? AND stock = ?', (user_id, symbol))
+        sold_cost = 0.0
+    elif owned[1] is not None:
+        sold_cost = await _consume_lots(db, user_id, symbol, amount)
+    else:
+        # Not backfilled yet: the lots are rebuilt from history by backfill_cost_basis
+        sold_cost = 0.0
+
+    await db.execute('UPDATE users SET cash = cash + ? WHERE id = ?', (total_price, user_id))
+    await db.execute('UPDATE user_savings SET quantity = quantity - ?, cost_basis = cost_basis - ? WHERE user_id = ? AND stock = ?',
+                     (amount, sold_cost, user_id, symbol))
+    await db.execute('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                     (user_id, symbol, price, -amount,))
+
+    return total_price
+
+
+async def sell_stock(db: aiosqlite.Connection, user_id: int, symbol: str, price, amount: int) -> float:
+    """
+    Sells `amount` shares of `symbol` at `price` for the user as one atomic unit of work.
+
+    The owned quantity is checked again inside the transaction, so two concurrent sells
+    can't sell the same shares twice. The shares are taken out of the oldest open lots and
+    their cost is subtracted from the holding's cost basis. Committed like `buy_stock`.
+
+    Parameters:
+    db (aiosqlite.Connection): The shared database connection.
+    user_id (int): Seller's Telegram ID.
+    symbol (str): Ticker symbol, upper case.
+    price (str | float): Price of one share.
+    amount (int): Number of shares, positive.
+
+    Raises:
+    NotEnoughShares: If the user owns fewer than `amount` shares. Nothing is written.
+
+    Returns:
+    float: Total price received.
+    """
+    return await trade_writer(db).submit(lambda conn: _sell(conn, user_id, symbol, price, amount))
+
+
+async def delete_user(db: aiosqlite.Connection, user_id: int) -> None:
+    """Deletes the user together with their savings, lots, history (archived included) and broadcast receipts, in one transaction."""
+    async with transaction(db):
+        await db.execute('DELETE FROM lots WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM user_savings WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM history WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM history_archive WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM history_summary WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM broadcast_recipients WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+
+
+async def backfill_holding(db: aiosqlite.Connection, user_id: int, stock: str) -> bool:
+    """
+    Builds the open lots and cost basis of one holding that has none yet. Runs inside the caller's transaction.
+
+    The held quantity is matched against the user's purchases newest first, the same way
+    `calc_profit` does, so the stored cost basis equals what it used to compute.
+
+    Returns:
+    bool: False if the holding does not exist or already has a cost basis.
+    """
+    async with db.execute('SELECT quantity FROM user_savings WHERE user_id = ? AND stock = ? AND cost_basis IS NULL',
+                          (user_id, stock)) as query:
+        holding = await query.fetchone()
+    if not holding:
+        return False
+
+    lots = []
+    remaining = holding[0]
+    async with db.execute("""SELECT id, quantity, price FROM history
+                             WHERE user_id = ? AND stock = ? AND quantity > 0
+                             ORDER BY id DESC""", (user_id, stock)) as query:
+        async for lot_id, quantity, price in query:
+            take = min(quantity, remaining)
+            lots.append((lot_id, user_id, stock, take, price))
+            remaining -= take
+            if remaining == 0:
+                break
+
+    await db.execute('DELETE FROM lots WHERE user_id = ? AND stock = ?', (user_id, stock))
+    await db.executemany('INSERT INTO lots (id, user_id, stock, quantity, price) VALUES (?, ?, ?, ?, ?)', lots)
+    await db.execute('UPDATE user_savings SET cost_basis = ? WHERE user_id = ? AND stock = ?',
+                     (sum(quantity * float(price) for _, _, _, quantity, price in lots), user_id, stock))
+    return True
+
+
+async def backfill_cost_basis(db: aiosqlite.Connection) -> int:
+    """
+    Builds the open lots and cost basis of every holding that has none yet (cost_basis IS NULL).
+
+    Each holding is converted in its own short transaction, so the bot can keep trading
+    meanwhile; running it again only converts holdings that are still missing. The schema
+    migration that adds the column runs this once; it is only needed again for holdings
+    written without a cost basis, e.g. imported by hand.
+
+    Parameters:
+    db (aiosqlite.Connection): The shared database connection.
+
+    Returns:
+    int: Number of holdings converted.
+    """
+    async with db.execute('SELECT user_id, stock FROM user_savings WHERE cost_basis IS NULL') as query:
+        holdings = await query.fetchall()
+
+    converted = 0
+    for user_id, stock in holdings:
+        # The holding is read again inside the transaction, a trade may have changed it meanwhile
+        async with transaction(db):
+            converted += await backfill_holding(db, user_id, stock)
+    return converted
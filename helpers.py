@@ -1,7 +1,34 @@
 import asyncio
+import datetime
 import logging
 
-from config.config import ALPHA_API
+from config.config import (
+    ALPHA_API,
+    ALPHA_API_KEYS,
+    ALPHA_CALLS_PER_MINUTE,
+    ALPHA_BURST,
+    ALPHA_QUEUE_TIMEOUT,
+    ALPHA_BATCH_CONCURRENCY,
+    ALPHA_TIMEOUT,
+    ALPHA_MAX_RETRIES,
+    ALPHA_RETRY_RATIO,
+    ALPHA_BREAKER_THRESHOLD,
+    ALPHA_BREAKER_RESET,
+    STALE_QUOTE_TTL,
+    HISTORY_DIR,
+    SYMBOL_REJECT_TTL,
+    QUOTE_CACHE_TTL,
+    QUOTE_CACHE_SIZE,
+)
+from market.breaker import CLOSED, CircuitBreaker, ProviderError, RetryBudget, backoff_delay
+from market.cache import QuoteCache
+from database.trading import transaction
+from market.decode import SERIES_KEY, DailySeriesReader, latest_close, loads
+from market.history import Bar, HistoryStore
+from market.keys import KeyPool, RateLimited, bench_window, rate_limit_note
+from market.scheduler import Priority, QueueTimeout, RequestScheduler
+from market.store import PriceStore, Quote
+from market.universe import SymbolUniverse
 
 from aiogram import Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
@@ -15,21 +42,98 @@ from aiogram.exceptions import (
 import aiohttp
 import aiosqlite
 
+def _quote_ttl(quote: Quote) -> float:
+    # Stale fallbacks are only kept until the provider may be back
+    if quote.stale:
+        return STALE_QUOTE_TTL
+    # Never keep a close in memory past the session that supersedes it. A close that is
+    # already past its expiry (provider lag) still gets the default TTL to avoid refetch loops
+    left = quote.seconds_left()
+    return min(QUOTE_CACHE_TTL, left) if left > 0 else QUOTE_CACHE_TTL
+
+# Shared quote cache, so concurrent users looking at the same ticker cost one API call
+quote_cache = QuoteCache(ttl=QUOTE_CACHE_TTL, maxsize=QUOTE_CACHE_SIZE, ttl_for=_quote_ttl)
+# Last closes persisted in the bot database, opened in run.py
+price_store = PriceStore()
+# Daily bars of every fetched symbol, for charts and stats without extra API calls
+history_store = HistoryStore(HISTORY_DIR)
+# Alpha Vantage keys, rotated by least recent use. Without configured keys requests go out
+# with ALPHA_API as before and fail the same way
+alpha_keys = KeyPool(ALPHA_API_KEYS or [ALPHA_API])
+# Listed symbols and recently rejected ones, so typos are answered without an API call
+symbol_universe = SymbolUniverse(reject_ttl=SYMBOL_REJECT_TTL)
+# Every Alpha Vantage call waits here for a token, interactive quotes first. Each key adds its own quota
+alpha_scheduler = RequestScheduler(rate=ALPHA_CALLS_PER_MINUTE * len(alpha_keys) / 60,
+                                   burst=ALPHA_BURST, max_wait=ALPHA_QUEUE_TIMEOUT)
+# Stops calling Alpha Vantage while it keeps failing, stale prices are served meanwhile
+alpha_breaker = CircuitBreaker('alpha_vantage', failure_threshold=ALPHA_BREAKER_THRESHOLD, reset_timeout=ALPHA_BREAKER_RESET)
+# Retries of failed calls may add at most ALPHA_RETRY_RATIO of extra traffic
+alpha_retries = RetryBudget(ratio=ALPHA_RETRY_RATIO)
+
+
+def quote_metrics() -> dict:
+    """Returns the counters of every component on the price path, for logging and alerting."""
+    return {
+        'cache': quote_cache.stats(),
+        'scheduler': alpha_scheduler.stats(),
+        'keys': alpha_keys.stats(),
+        'breaker': alpha_breaker.stats(),
+        'retries': alpha_retries.stats(),
+        'rejected_symbols': symbol_universe.rejections,
+    }
+
+
+async def log_quote_metrics(interval: float) -> None:
+    """
+    Logs `quote_metrics()` every `interval` seconds until cancelled.
+
+    While the provider looks degraded (circuit breaker not closed, or every API key rate
+    limited) the line is logged as a warning, so alerts can be set on it.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        degraded = alpha_breaker.state != CLOSED or not alpha_keys.available
+        logging.log(logging.WARNING if degraded else logging.INFO,
+                    f'Price provider {"degraded" if degraded else "healthy"}: {quote_metrics()}')
+
+
+async def warm_quote_cache() -> int:
+    """
+    Loads every stored close that is still current into `quote_cache`.
+
+    Called once at startup after `price_store` has been opened, so a restart does not
+    have to ask the API again for prices it already knows.
+
+    Returns:
+        int: Number of quotes loaded.
+    """
+    quotes = await price_store.load()
+    for quote in quotes:
+        quote_cache.set(quote.symbol, quote, ttl=_quote_ttl(quote))
+    return len(quotes)
+
+
 # Function to check stock price using Alpha Vantage API
-async def check_stock_price(symbol: str, session: aiohttp.ClientSession) -> str | None:
+async def check_stock_price(symbol: str, session: aiohttp.ClientSession, priority: Priority = Priority.INTERACTIVE) -> str | None:
     """
     Fetches the latest closing stock price for a given stock symbol using the Alpha Vantage API.
 
-    This function retrieves daily time series stock data for the given symbol and extracts
-    the most recent "4. close" price. It uses asynchronous requests to fetch data from the
-    API and ensures proper handling of errors. If the API request fails or the required data
-    is unavailable, the function returns None.
+    Prices are served from the shared `quote_cache` while fresh, then from `price_store`
+    until the next trading session closes. Only then is the API asked, and only once, even
+    if several coroutines ask for the same symbol at the same time. API calls are queued in
+    `alpha_scheduler` to stay within the provider's quota. Timed out calls and server errors
+    are retried within `alpha_retries`; while `alpha_breaker` is open or retries are exhausted,
+    the last known price is served even if it is outdated. If there is no such price, the
+    request waits too long in the queue or the required data is unavailable, the function
+    returns None.
 
     Parameters:
         symbol: str
             The stock ticker symbol to fetch data for.
         session: aiohttp.ClientSession
             An open aiohttp ClientSession to perform the HTTP request.
+        priority: Priority, optional
+            Queue class for the API call. Defaults to INTERACTIVE.
 
     Returns:
         str or None
@@ -38,25 +142,237 @@ async def check_stock_price(symbol: str, session: aiohttp.ClientSession) -> str
     """
     # Convert symbol to uppercase to match API requirements
     ticker = symbol.upper()
+    quote = await quote_cache.get_or_fetch(ticker, lambda: _load_quote(ticker, session, priority))
+    return quote.price if quote else None
+
+
+async def get_prices(symbols: list[str], session: aiohttp.ClientSession, priority: Priority = Priority.PORTFOLIO) -> dict[str, str | None]:
+    """
+    Returns the latest closing prices for several symbols at once.
+
+    Symbols are upper-cased and deduplicated. Prices already in `quote_cache` are used as is;
+    only the missing symbols are fetched, at most ALPHA_BATCH_CONCURRENCY at a time, so a large
+    portfolio does not flood the API with parallel requests. Alpha Vantage has no bulk
+    daily-close endpoint on the free tier, so each missing symbol is still its own call.
+
+    Parameters:
+        symbols: list[str]
+            Ticker symbols, duplicates allowed.
+        session: aiohttp.ClientSession
+            An open aiohttp ClientSession to perform the HTTP requests.
+        priority: Priority, optional
+            Queue class for the API calls. Defaults to PORTFOLIO.
+
+    Returns:
+        dict[str, str | None]
+            Upper-case symbol mapped to its price as a string, or None if it could not be fetched.
+    """
+    tickers = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    prices = {}
+    missing = []
+
+    for ticker in tickers:
+        quote = quote_cache.get(ticker)
+        if quote:
+            prices[ticker] = quote.price
+        else:
+            missing.append(ticker)
+
+    semaphore = asyncio.Semaphore(ALPHA_BATCH_CONCURRENCY)
+
+    async def fetch(ticker: str) -> None:
+        async with semaphore:
+            prices[ticker] = await check_stock_price(ticker, session, priority=priority)
+
+    await asyncio.gather(*(fetch(ticker) for ticker in missing))
+    return {ticker: prices[ticker] for ticker in tickers}
+
+
+async def refresh_stock_price(symbol: str, session: aiohttp.ClientSession) -> bool:
+    """
+    Reloads the price of `symbol` into `quote_cache` ahead of user requests.
+
+    A close that `price_store` still considers current is reloaded from disk; otherwise the
+    price is fetched from the API at background priority. The fetch does not take the cache's
+    single-flight slot and the cached entry stays until a fresh quote replaces it, so users
+    keep getting the old price meanwhile and never wait behind the background request.
+
+    Returns:
+        bool: True if the API was called.
+    """
+    ticker = symbol.upper()
+    quote = await price_store.get(ticker)
+    if quote:
+        quote_cache.set(ticker, quote, ttl=_quote_ttl(quote))
+        return False
+
+    quote = await _load_quote(ticker, session, Priority.BACKGROUND)
+    # A stale fallback is no better than what the cache holds
+    if quote and not quote.stale:
+        quote_cache.set(ticker, quote, ttl=_quote_ttl(quote))
+    return True
+
+
+async def _load_quote(ticker: str, session: aiohttp.ClientSession, priority: Priority) -> Quote | None:
+    quote = await price_store.get(ticker)
+    if quote:
+        return quote
+
+    alpha_retries.deposit()
+    attempt = 0
+    rotations = 0
+
+    while True:
+        if not alpha_breaker.allow():
+            return await _stale_quote(ticker)
+
+        try:
+            await alpha_scheduler.acquire(priority)
+        except QueueTimeout as e:
+            logging.warning(f'check_stock_price {ticker} gave up waiting for API quota: {e}')
+            return None
+
+        if not alpha_keys.available:
+            logging.warning(f'check_stock_price {ticker}: every API key is rate limited')
+            return await _stale_quote(ticker)
+
+        key = alpha_keys.acquire()
+        try:
+            quote = await _fetch_quote(ticker, session, key)
+        except RateLimited as e:
+            # A key that turns out to be over quota is benched and the next one is tried
+            logging.warning(f'check_stock_price {ticker}: {e}')
+            rotations += 1
+            if rotations >= len(alpha_keys):
+                return await _stale_quote(ticker)
+            continue
+        except ProviderError as e:
+            alpha_breaker.record_failure()
+            if attempt >= ALPHA_MAX_RETRIES or not alpha_retries.withdraw():
+                logging.warning(f'check_stock_price {ticker} failed: {e}')
+                return await _stale_quote(ticker)
+            attempt += 1
+            logging.info(f'check_stock_price {ticker} retry {attempt} after: {e}')
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+
+        alpha_breaker.record_success()
+        if quote:
+            await price_store.put(quote)
+        return quote
+
+
+async def _stale_quote(ticker: str) -> Quote | None:
+    # Last known close from memory or disk, however old, for when the provider is down
+    quote = quote_cache.get_stale(ticker) or await price_store.get(ticker, allow_stale=True)
+    return quote._replace(stale=True) if quote else None
+
+
+async def _fetch_quote(ticker: str, session: aiohttp.ClientSession, key: str) -> Quote | None:
     # Standard URL for Alpha Vantage API to get daily time series data
-    url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={ticker}&apikey={ALPHA_API}'
+    url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={ticker}&apikey={key}'
+
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=ALPHA_TIMEOUT)) as response:
+            if response.status >= 500:
+                raise ProviderError(f'status code {response.status}')
+            if response.status != 200:
+                logging.warning(f'check_stock_price status code: {response.status}')
+                return None
+            raw = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise ProviderError(repr(e)) from e
+
+    # Only errors and rate-limit notes come without a series. They are small, parse them whole
+    if SERIES_KEY.encode() not in raw:
+        try:
+            data = loads(raw)
+        except ValueError as e:
+            logging.warning(f'check_stock_price price get error: {e}')
+            return None
 
-    async with session.get(url) as response:
-        if response.status != 200:
-            logging.warning(f'check_stock_price status code: {response.status}')
+        note = rate_limit_note(data)
+        if note:
+            alpha_keys.bench(key, bench_window(note))
+            raise RateLimited(f'key ...{str(key)[-4:]} benched: {note}')
+
+        if 'Error Message' in data:
+            # Alpha Vantage answers unknown symbols with an error message instead of data
+            symbol_universe.reject(ticker)
+            logging.info(f'check_stock_price {ticker} rejected by API: {data["Error Message"]}')
             return None
-        data = await response.json()
+
+        logging.warning(f'check_stock_price unexpected payload for {ticker}: {raw[:200]!r}')
+        return None
     
     try:
-        # Extract the closing price from the most recent trading day
-        time_series = data["Time Series (Daily)"]
-        close_price = time_series[max(time_series.keys())]["4. close"]
-        return close_price
+        # Decode only the most recent trading day instead of the whole series
+        as_of, close_price = latest_close(raw)
+        quote = Quote(ticker, close_price, datetime.date.fromisoformat(as_of))
 
     except Exception as e:
         logging.warning(f'check_stock_price price get error: {e}')
         return None
+
+    _record_history(ticker, raw)
+    return quote
+
+
+def _record_history(ticker: str, raw: bytes) -> None:
+    # Keep the days the payload has beyond what is already stored, decoding nothing older
+    try:
+        last = history_store.last_date(ticker)
+        bars = []
+        for date, fields in DailySeriesReader(raw):
+            day = datetime.date.fromisoformat(date)
+            if last and day <= last:
+                break
+            bars.append(Bar(day, float(fields['1. open']), float(fields['2. high']), float(fields['3. low']),
+                            float(fields['4. close']), int(fields['5. volume'])))
+        history_store.append(ticker, bars)
+    except Exception as e:
+        logging.warning(f'Failed to record history for {ticker}: {e}')
     
+async def fetch_listing_csv(session: aiohttp.ClientSession) -> str | None:
+    """
+    Downloads the Alpha Vantage LISTING_STATUS CSV of active symbols for `symbol_universe`.
+
+    The call goes through the same scheduler and key pool as quotes, at background priority.
+
+    Returns:
+        str or None: The CSV text, or None if the API did not return a listing.
+    """
+    try:
+        # Waiting long is fine, nobody is blocked on the listing
+        await alpha_scheduler.acquire(Priority.BACKGROUND, timeout=600)
+    except QueueTimeout as e:
+        logging.warning(f'fetch_listing_csv gave up waiting for API quota: {e}')
+        return None
+
+    if not alpha_keys.available:
+        logging.warning('fetch_listing_csv: every API key is rate limited')
+        return None
+
+    key = alpha_keys.acquire()
+    url = f'https://www.alphavantage.co/query?function=LISTING_STATUS&apikey={key}'
+
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=ALPHA_TIMEOUT * 6)) as response:
+            if response.status != 200:
+                logging.warning(f'fetch_listing_csv status code: {response.status}')
+                return None
+            text = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f'fetch_listing_csv failed: {e!r}')
+        return None
+
+    # Errors and rate-limit notes come back as JSON instead of CSV
+    if not text.startswith('symbol,'):
+        logging.warning(f'fetch_listing_csv unexpected response: {text[:200]}')
+        return None
+    return text
+
+
 async def edit_bot_message(text:str, event: Message | CallbackQuery, message_id: int | None = None, bot: Bot | None = None, reply_markup: InlineKeyboardMarkup | None = None) -> None:
     """
     Edits a bot message for a given event or falls back to answering the event if editing fails.
@@ -142,6 +458,12 @@ async def calc_profit(user_id: int, quantity_yet: int, stock: str, db: aiosqlite
     Returns:
     float: The total remaining profit for the user and the specified stock.
     """
+    # Holdings keep their cost basis up to date with every trade; the history walk below is
+    # only needed for a holding that has not been backfilled yet
+    async with db.execute('SELECT quantity, cost_basis FROM user_savings WHERE user_id = ? AND stock = ?', (user_id, stock)) as query:
+        holding = await query.fetchone()
+    if holding and holding[0] == quantity_yet and holding[1] is not None:
+        return float(holding[1])
 
     async with db.execute("""SELECT quantity, price FROM history
                              WHERE user_id = ?
@@ -162,7 +484,8 @@ async def calc_profit(user_id: int, quantity_yet: int, stock: str, db: aiosqlite
     
     return money_spent
 
-async def fetch_stock_data(user_id: int, stock: str, quantity: int, session: aiohttp.ClientSession, db: aiosqlite.Connection) -> str:
+async def fetch_stock_data(user_id: int, stock: str, quantity: int, session: aiohttp.ClientSession, db: aiosqlite.Connection, prices: dict[str, str | None] | None = None,
+                           cost_basis: float | None = None) -> str:
     """
     Fetches stock data, calculates the total value, and computes the profit or loss for a given stock.
 
@@ -176,6 +499,10 @@ async def fetch_stock_data(user_id: int, stock: str, quantity: int, session: aio
         quantity (int): Quantity of the stock owned by the user.
         session (aiohttp.ClientSession): An aiohttp session instance for making API calls.
         db (aiosqlite.Connection): The SQLite database connection for querying user's profit data.
+        prices (dict[str, str | None] | None): Prices already fetched with `get_prices`. If omitted,
+            the price is fetched for this stock alone.
+        cost_basis (float | None): What the held shares cost, as returned by `get_portfolio`. If omitted,
+            it is looked up with `calc_profit`.
 
     Returns:
         str: A formatted string representing the stock details (quantity, total value, and profit/loss).
@@ -184,14 +511,20 @@ async def fetch_stock_data(user_id: int, stock: str, quantity: int, session: aio
         Exception: Raised when an error occurs during stock price retrieval, profit calculation, or other operations.
     """
     try:
-        price_str = await check_stock_price(stock, session)
+        if prices is None:
+            price_str = await check_stock_price(stock, session, priority=Priority.PORTFOLIO)
+        else:
+            price_str = prices.get(stock)
         price = float(price_str) if price_str else 0.0
         
         if price == 0:
             logging.warning(f"Got zero price for {stock}, skipping calculation.")
             return f"  • <b>{stock}:</b> {quantity}pcs. (Error: <code>Price is $0.00</code>)"
         
-        money_spent = await calc_profit(user_id=user_id, quantity_yet=quantity, stock=stock, db=db)
+        if cost_basis is None:
+            money_spent = await calc_profit(user_id=user_id, quantity_yet=quantity, stock=stock, db=db)
+        else:
+            money_spent = cost_basis
         
         total = price * quantity
         pure_profit = total - money_spent
@@ -202,63 +535,16 @@ async def fetch_stock_data(user_id: int, stock: str, quantity: int, session: aio
         logging.error(f"Failed to fetch data for {stock}: {e}")
         return f"  • <b>{stock}:</b> {quantity}pcs. (Unable to calculate profit)"
     
-async def get_full_user_report(db: aiosqlite.Connection, user_id: int | None = None, username: str | None = None) -> dict | None:
+def is_unreachable(error: TelegramAPIError) -> bool:
     """
-    Retrieves a comprehensive user report containing user information, portfolio, and transaction history
-    from the database based on either user ID or username.
-
-    Parameters:
-    db (aiosqlite.Connection): An asynchronous SQLite database connection object used for database access.
-    user_id (int | None): The unique identifier of the user. Optional; either user_id or username is required.
-    username (str | None): The username of the user. Optional; either username or user_id is required.
-
-    Returns:
-    dict | None: A dictionary containing the following structure:
-        user_info: Dictionary with details about the user, including:
-            - id: The user ID.
-            - cash: The user's cash balance represented as a string formatted with commas and two decimal places.
-            - created: Timestamp of when the user was created.
-        savings: List of tuples where each tuple represents stock savings with stock name and quantity.
-        history: List of tuples representing the transaction history with stock name, price, quantity, and timestamp.
-        Returns None if no user is found or if both user_id and username are not provided.
+    Tells whether a send failed because the user is gone for good: they blocked the bot, deleted
+    their account or never had a chat with it. Other bad requests (e.g. broken HTML) are not.
     """
-    if not (user_id or username):
-        return None
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and 'chat not found' in error.message.lower()
+
 
-    if user_id:
-        async with db.execute('SELECT id, cash, created FROM users WHERE id = ?', (user_id,)) as query:
-            main_info = await query.fetchone()
-    else:
-        async with db.execute('SELECT id, cash, created FROM users WHERE username = ?', (username,)) as query:
-            main_info = await query.fetchone()
-        
-    if not main_info:
-        return None
-    
-    async def get_portfolio():
-        async with db.execute('SELECT stock, quantity FROM user_savings WHERE user_id = ?', (main_info[0],)) as query:
-            return await query.fetchall()
-        
-    async def get_history():
-        async with db.execute('SELECT id, stock, price, quantity, time FROM history WHERE user_id = ? ORDER BY time ASC', (main_info[0],)) as query:
-            return await query.fetchall()
-    
-    savings, history = await asyncio.gather(get_portfolio(), get_history())
-    
-    
-    report = {
-        'user_info': {
-            'id': main_info[0],
-            'cash': f"{main_info[1]:,.2f}",
-            'created': main_info[2]
-        },
-       'savings': savings,
-       'history': history
-    }
-    
-    return report
-    
-    
 async def send_message(bot: Bot, user_id: int, text: str, disable_notification: bool = False) -> bool:
     """
     Safe messages sender for broadcasting (aiogram 3.x version)
@@ -268,21 +554,25 @@ async def send_message(bot: Bot, user_id: int, text: str, disable_notification:
     :param text: The message text to send.
     :param disable_notification: Send silently.
     :return: True if sent, False if failed.
+    :raises TelegramRetryAfter: Flood limit exceeded. Left to the caller, which knows how many
+        other sends have to wait too (see bot.broadcast).
+    :raises TelegramForbiddenError | TelegramBadRequest: The user is unreachable (see `is_unreachable`).
+        Left to the caller, which records it so later broadcasts skip the user.
     """
     try:
         await bot.send_message(user_id, text, disable_notification=disable_notification, parse_mode="HTML")
-        
-    except TelegramRetryAfter as e:
-        # Flood limit exceeded. Sleep for the specified time and retry.
-        logging.error(f"Target [ID:{user_id}]: Flood limit exceeded. Sleep {e.timeout} seconds.")
-        await asyncio.sleep(e.timeout)
-        return await send_message(bot, user_id, text, disable_notification)  # Recursive call
+
+    except TelegramRetryAfter:
+        raise
 
     except (TelegramForbiddenError, TelegramBadRequest) as e:
-        # Catches BotBlocked, UserDeactivated, and ChatNotFound.
-        # These users are unreachable, so we log and move on.
-        logging.error(f"Target [ID:{user_id}]: Unreachable. {e.message}")
-        
+        if is_unreachable(e):
+            # BotBlocked, UserDeactivated, and ChatNotFound
+            logging.info(f"Target [ID:{user_id}]: Unreachable. {e.message}")
+            raise
+        logging.error(f"Target [ID:{user_id}]: Bad request. {e.message}")
+
+
     except TelegramAPIError as e:
         # Catch any other unexpected Telegram error
         logging.exception(f"Target [ID:{user_id}]: Failed with unhandled TelegramAPIError: {e}")
@@ -333,5 +623,5 @@ async def username_db_check(event: Message | CallbackQuery, db: aiosqlite.Connec
         return
 
     if username_db[0] != username:
-       await db.execute('UPDATE users SET username = ? WHERE id = ?', (username, user_id,))
-       await db.commit()
\ No newline at end of file
+        async with transaction(db):
+            await db.execute('UPDATE users SET username = ? WHERE id = ?', (username, user_id,))
\ No newline at end of file
@@ -0,0 +1,135 @@
+import logging
+import random
+import time
+from collections import Counter
+from typing import Callable
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderError(Exception):
+    """Raised when the price provider timed out, was unreachable or answered with a server error."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for an unreliable upstream.
+
+    After `failure_threshold` consecutive failures the breaker opens and `allow` returns
+    False, so callers fail fast instead of piling up on a provider that hangs. After
+    `reset_timeout` seconds one probe request is let through (half-open): a success closes
+    the breaker, a failure opens it again. A probe that never reports back is replaced by
+    a new one after another `reset_timeout`.
+
+    Every state change is logged and counted in `transitions`, e.g. transitions['closed->open'].
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started: float | None = None
+        self.transitions: Counter[str] = Counter()
+        self.rejected = 0
+
+    def _move(self, state: str) -> None:
+        if state == self.state:
+            return
+        self.transitions[f'{self.state}->{state}'] += 1
+        logging.warning(f'Circuit breaker {self.name}: {self.state} -> {state}')
+        self.state = state
+
+    def allow(self) -> bool:
+        """Returns True if a request may be sent now."""
+        now = self._clock()
+
+        if self.state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self._move(HALF_OPEN)
+            self._probe_started = None
+
+        if self.state == HALF_OPEN:
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self._probe_started = now
+
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probe_started = None
+        self._move(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+            self._probe_started = None
+            self._move(OPEN)
+
+    def reset(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_started = None
+        self.transitions.clear()
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'transitions': dict(self.transitions),
+        }
+
+
+class RetryBudget:
+    """
+    Caps retries to a share of the traffic.
+
+    Every first attempt deposits `ratio` tokens, every retry withdraws one. The balance starts
+    at and never exceeds `reserve`, so a burst of failures can retry a little but a provider
+    that keeps failing is not hit with more than (1 + ratio) times the normal traffic.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = reserve
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self) -> None:
+        self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            self.denied += 1
+            return False
+        self.balance -= 1
+        self.retries += 1
+        return True
+
+    def reset(self) -> None:
+        self.balance = self.reserve
+        self.retries = 0
+        self.denied = 0
+
+    def stats(self) -> dict:
+        return {'balance': round(self.balance, 2), 'retries': self.retries, 'denied': self.denied}
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter for retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Abandoned(Exception):
+    """Set on an in-flight load whose caller was cancelled; waiters load the key themselves."""
+
+
+class QuoteCache:
+    """
+    In-process TTL cache for stock quotes with LRU eviction and single-flight loading.
+
+    Entries expire `ttl` seconds after they were stored. When the cache holds more than
+    `maxsize` entries, the least recently used one is evicted. Concurrent misses for the
+    same key share one in-flight load instead of each starting their own request.
+
+    Failed loads (loader returned None or raised) are never cached. If `ttl_for` is given,
+    it is called with each loaded value and its result is used as that entry's TTL.
+
+    Attributes:
+        hits: int
+            Lookups answered from a fresh cache entry.
+        misses: int
+            Lookups that started a new load.
+        coalesced: int
+            Lookups that joined a load already in flight for the same key.
+    """
+
+    def __init__(self, ttl: float = 300, maxsize: int = 1024,
+                 ttl_for: Callable[[Any], float] | None = None, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.ttl_for = ttl_for
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Returns a fresh cached value for `key` or None. Counts as a hit only when found."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires <= self._clock():
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable) -> Any | None:
+        """Returns the value stored for `key` even if it has expired, for serving stale data. Not counted."""
+        entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Stores `value` under `key` for `ttl` seconds (the cache default if omitted)."""
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def ttl_left(self, key: Hashable) -> float:
+        """Returns the seconds until the entry for `key` expires, 0 if absent. Does not count as a lookup."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return max(0.0, entry[0] - self._clock())
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = self.coalesced = 0
+
+    async def get_or_fetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any | None:
+        """
+        Returns the cached value for `key`, loading it with `loader` on a miss.
+
+        If another coroutine is already loading the same key, this call waits for that
+        load instead of calling `loader` again. If that coroutine is cancelled, its waiters
+        are not: one of them starts the load again and the others wait for it.
+
+        Parameters:
+            key: Hashable
+                Cache key, e.g. an upper-case ticker.
+            loader: Callable[[], Awaitable[Any]]
+                Coroutine factory that fetches the value. Returning None means "no value"
+                and is passed through to every waiter without being cached.
+
+        Returns:
+            The cached or freshly loaded value, or None if the load failed.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _Abandoned:
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; the waiters treat it as a miss and load again
+            future.set_exception(_Abandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.set(key, value, ttl=self.ttl_for(value) if self.ttl_for else None)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,107 @@
+import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# NYSE trading calendar: regular sessions, full-day holidays and 13:00 early closes.
+# Daily closes published by Alpha Vantage only change after a session ends, so a close
+# stays current until the next session is over.
+
+NEW_YORK = ZoneInfo('America/New_York')
+
+REGULAR_CLOSE = datetime.time(16, 0)
+EARLY_CLOSE = datetime.time(13, 0)
+
+# Time the data provider needs after the bell before the new close shows up
+PUBLISH_DELAY = datetime.timedelta(minutes=20)
+
+
+def _easter(year: int) -> datetime.date:
+    # Anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> datetime.date:
+    first = datetime.date(year, month, 1)
+    offset = (weekday - first.weekday()) % 7
+    return first + datetime.timedelta(days=offset + 7 * (n - 1))
+
+
+def _last_weekday(year: int, month: int, weekday: int) -> datetime.date:
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last = next_month - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day: datetime.date) -> datetime.date:
+    # Saturday holidays move to Friday, Sunday holidays to Monday
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=16)
+def holidays(year: int) -> frozenset[datetime.date]:
+    """Returns the full-day NYSE holidays observed in `year`."""
+    days = set()
+
+    # New Year's Day falling on Saturday is not observed on the previous Friday
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.add(_observed(new_year))
+
+    days.add(_nth_weekday(year, 1, 0, 3))                  # Martin Luther King Jr. Day
+    days.add(_nth_weekday(year, 2, 0, 3))                  # Washington's Birthday
+    days.add(_easter(year) - datetime.timedelta(days=2))   # Good Friday
+    days.add(_last_weekday(year, 5, 0))                    # Memorial Day
+    if year >= 2022:
+        days.add(_observed(datetime.date(year, 6, 19)))    # Juneteenth
+    days.add(_observed(datetime.date(year, 7, 4)))         # Independence Day
+    days.add(_nth_weekday(year, 9, 0, 1))                  # Labor Day
+    days.add(_nth_weekday(year, 11, 3, 4))                 # Thanksgiving
+    days.add(_observed(datetime.date(year, 12, 25)))       # Christmas
+
+    return frozenset(days)
+
+
+def is_trading_day(day: datetime.date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def next_trading_day(day: datetime.date) -> datetime.date:
+    """Returns the first trading day strictly after `day`."""
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+
+def session_close(day: datetime.date) -> datetime.datetime:
+    """Returns the aware closing time of the session on trading day `day`."""
+    early = (
+        (day.month == 7 and day.day == 3)
+        or (day.month == 12 and day.day == 24)
+        or day == _nth_weekday(day.year, 11, 3, 4) + datetime.timedelta(days=1)
+    )
+    return datetime.datetime.combine(day, EARLY_CLOSE if early else REGULAR_CLOSE, tzinfo=NEW_YORK)
+
+
+def quote_expiry(as_of: datetime.date) -> datetime.datetime:
+    """
+    Returns the moment a daily close dated `as_of` is superseded.
+
+    That is the close of the next trading session after `as_of`, plus the time the
+    provider needs to publish it.
+    """
+    return session_close(next_trading_day(as_of)) + PUBLISH_DELAY
@@ -0,0 +1,96 @@
+import json
+import re
+from typing import Iterator
+
+# orjson is optional. It is used for payloads that have to be parsed in full
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    loads = json.loads
+    JSON_BACKEND = 'json'
+
+SERIES_KEY = '"Time Series (Daily)"'
+META_KEY = '"Meta Data"'
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def _skip(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    pos = _skip(text, pos)
+    if text[pos:pos + 1] != char:
+        raise ValueError(f'Expected {char!r} at {pos}')
+    return _skip(text, pos + 1)
+
+
+class DailySeriesReader:
+    """
+    Lazy reader for Alpha Vantage TIME_SERIES_DAILY payloads.
+
+    Iterating yields `(date, fields)` pairs in payload order (newest first) and decodes only
+    the entries that are actually consumed. The small "Meta Data" object is decoded before
+    the first entry. `position` is the number of characters decoded so far.
+    """
+
+    def __init__(self, raw: bytes | str):
+        self.text = raw.decode('utf-8') if isinstance(raw, (bytes, bytearray)) else raw
+        self.meta: dict | None = None
+        self.position = 0
+
+    def __iter__(self) -> Iterator[tuple[str, dict]]:
+        text = self.text
+
+        meta_at = text.find(META_KEY)
+        series_at = text.find(SERIES_KEY)
+        if series_at < 0:
+            return
+
+        if 0 <= meta_at < series_at:
+            self.meta, self.position = _decoder.raw_decode(text, _expect(text, meta_at + len(META_KEY), ':'))
+
+        pos = _expect(text, series_at + len(SERIES_KEY), ':')
+        pos = _expect(text, pos, '{')
+
+        while True:
+            if text[pos:pos + 1] == '}':
+                self.position = pos + 1
+                return
+
+            date, pos = _decoder.raw_decode(text, pos)
+            pos = _expect(text, pos, ':')
+            fields, pos = _decoder.raw_decode(text, pos)
+            self.position = pos
+            yield date, fields
+
+            pos = _skip(text, pos)
+            if text[pos:pos + 1] == ',':
+                pos = _skip(text, pos + 1)
+
+
+def latest_close(raw: bytes | str) -> tuple[str, str] | None:
+    """
+    Returns `(date, close)` of the newest entry of a TIME_SERIES_DAILY payload, or None if the
+    payload holds no series.
+
+    Only the metadata and the first entry are decoded. The first entry is trusted to be the
+    newest when it matches the "3. Last Refreshed" date; otherwise the payload is parsed in
+    full and the newest date is searched, as before.
+    """
+    reader = DailySeriesReader(raw)
+    for as_of, fields in reader:
+        last_refreshed = (reader.meta or {}).get('3. Last Refreshed', '')
+        if last_refreshed[:10] == as_of:
+            return as_of, fields['4. close']
+        break
+
+    time_series = loads(raw).get('Time Series (Daily)')
+    if not time_series:
+        return None
+    as_of = max(time_series.keys())
+    return as_of, time_series[as_of]['4. close']
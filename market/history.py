@@ -0,0 +1,159 @@
+import bisect
+import datetime
+import logging
+import os
+import struct
+from array import array
+from typing import NamedTuple
+
+# File layout: header (magic, row count), then each column as one contiguous block
+_MAGIC = b'BAR1'
+_HEADER = struct.Struct('<4sI')
+_COLUMNS = (('dates', 'i'), ('open', 'd'), ('high', 'd'), ('low', 'd'), ('close', 'd'), ('volume', 'q'))
+
+
+class Bar(NamedTuple):
+    date: datetime.date
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
+
+
+class SeriesTable:
+    """Daily bars of one symbol, one array per column, sorted by date (stored as ordinals)."""
+
+    def __init__(self):
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def bar(self, i: int) -> Bar:
+        return Bar(datetime.date.fromordinal(self.dates[i]), self.open[i], self.high[i], self.low[i], self.close[i], self.volume[i])
+
+    def append(self, bar: Bar) -> None:
+        self.dates.append(bar.date.toordinal())
+        self.open.append(bar.open)
+        self.high.append(bar.high)
+        self.low.append(bar.low)
+        self.close.append(bar.close)
+        self.volume.append(bar.volume)
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(_MAGIC, len(self)) + b''.join(getattr(self, name).tobytes() for name, _ in _COLUMNS)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SeriesTable':
+        magic, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError('Not a bar file')
+
+        table = cls()
+        offset = _HEADER.size
+        for name, typecode in _COLUMNS:
+            column = getattr(table, name)
+            size = count * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+        return table
+
+
+class HistoryStore:
+    """
+    Columnar store of daily bars per symbol, persisted as one small file per symbol.
+
+    Tables are loaded lazily on first use and kept in memory. Range queries binary-search
+    the date column, so charts, moving averages and percent changes are answered without
+    an API call. Bars are only ever appended, since daily closes don't change once published.
+    Files use the machine's native byte order; they are a local cache, not an exchange format.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tables: dict[str, SeriesTable] = {}
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.directory, f'{symbol}.bars')
+
+    def table(self, symbol: str) -> SeriesTable:
+        symbol = symbol.upper()
+        table = self._tables.get(symbol)
+        if table is not None:
+            return table
+
+        table = SeriesTable()
+        path = self._path(symbol)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as bars:
+                    table = SeriesTable.from_bytes(bars.read())
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f'HistoryStore could not read {path}, starting over: {e}')
+                table = SeriesTable()
+
+        self._tables[symbol] = table
+        return table
+
+    def last_date(self, symbol: str) -> datetime.date | None:
+        table = self.table(symbol)
+        return datetime.date.fromordinal(table.dates[-1]) if len(table) else None
+
+    def append(self, symbol: str, bars: list[Bar]) -> int:
+        """
+        Adds the bars newer than the last stored one and saves the table.
+
+        Returns:
+            int: Number of bars added.
+        """
+        table = self.table(symbol)
+        last = table.dates[-1] if len(table) else 0
+
+        added = 0
+        for bar in sorted(bars):
+            if bar.date.toordinal() > last:
+                table.append(bar)
+                last = bar.date.toordinal()
+                added += 1
+
+        if added:
+            self._save(symbol.upper(), table)
+        return added
+
+    def _save(self, symbol: str, table: SeriesTable) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(symbol)
+        try:
+            with open(path + '.tmp', 'wb') as bars:
+                bars.write(table.to_bytes())
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f'HistoryStore could not save {path}: {e}')
+
+    def range(self, symbol: str, start: datetime.date | None = None, end: datetime.date | None = None) -> list[Bar]:
+        """Returns the bars from `start` to `end`, both inclusive and both optional, oldest first."""
+        table = self.table(symbol)
+        lo = bisect.bisect_left(table.dates, start.toordinal()) if start else 0
+        hi = bisect.bisect_right(table.dates, end.toordinal()) if end else len(table)
+        return [table.bar(i) for i in range(lo, hi)]
+
+    def closes(self, symbol: str, count: int) -> list[float]:
+        """Returns the last `count` closes, oldest first."""
+        return self.table(symbol).close[-count:].tolist() if count > 0 else []
+
+    def moving_average(self, symbol: str, window: int) -> float | None:
+        """Returns the average of the last `window` closes, or None if there are fewer."""
+        closes = self.closes(symbol, window)
+        return sum(closes) / window if len(closes) == window else None
+
+    def percent_change(self, symbol: str, days: int = 1) -> float | None:
+        """Returns the change of the last close against the close `days` sessions earlier, in percent."""
+        closes = self.closes(symbol, days + 1)
+        if len(closes) < days + 1 or not closes[0]:
+            return None
+        return (closes[-1] / closes[0] - 1) * 100
+
+    def clear(self) -> None:
+        self._tables.clear()
@@ -0,0 +1,92 @@
+import datetime
+import time
+from typing import Callable
+
+
+class RateLimited(Exception):
+    """Raised when the provider answered with a rate-limit note for the key that was used."""
+
+
+def rate_limit_note(data: dict) -> str | None:
+    """
+    Returns the provider's rate-limit message from an Alpha Vantage payload, if any.
+
+    Alpha Vantage answers over-quota calls with HTTP 200 and a "Note" or "Information"
+    field instead of data.
+    """
+    for field in ('Note', 'Information'):
+        note = data.get(field)
+        if isinstance(note, str) and any(marker in note.lower() for marker in ('rate limit', 'call frequency', 'requests per day')):
+            return note
+    return None
+
+
+def bench_window(note: str) -> float:
+    """Returns how long a key that hit the limit described by `note` should rest, in seconds."""
+    # The per-minute note also mentions the daily quota, so it must not count as a daily limit
+    note = note.lower()
+    if 'per day' in note and 'per minute' not in note:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), tzinfo=datetime.timezone.utc)
+        return (midnight - now).total_seconds()
+    return 60.0
+
+
+class KeyPool:
+    """
+    Pool of Alpha Vantage API keys.
+
+    `acquire` hands out the available key that was used least recently, which spreads
+    calls evenly across the pool. A key that hit its quota is benched until its window
+    resets and is skipped until then.
+
+    Per-key counters are available via `stats()`, with keys masked to their last 4 chars.
+    """
+
+    def __init__(self, keys: list[str], clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._keys = list(dict.fromkeys(keys))
+        self._last_used = {key: float('-inf') for key in self._keys}
+        self._benched_until = {key: float('-inf') for key in self._keys}
+        self._requests = {key: 0 for key in self._keys}
+        self._rate_limited = {key: 0 for key in self._keys}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def available(self) -> int:
+        now = self._clock()
+        return sum(1 for key in self._keys if self._benched_until[key] <= now)
+
+    def acquire(self) -> str | None:
+        """Returns the least recently used key that is not benched, or None if all are."""
+        now = self._clock()
+        candidates = [key for key in self._keys if self._benched_until[key] <= now]
+        if not candidates:
+            return None
+
+        key = min(candidates, key=self._last_used.__getitem__)
+        self._last_used[key] = now
+        self._requests[key] += 1
+        return key
+
+    def bench(self, key: str, seconds: float) -> None:
+        self._benched_until[key] = self._clock() + seconds
+        self._rate_limited[key] += 1
+
+    def reset(self) -> None:
+        for key in self._keys:
+            self._last_used[key] = self._benched_until[key] = float('-inf')
+            self._requests[key] = self._rate_limited[key] = 0
+
+    def stats(self) -> dict[str, dict]:
+        now = self._clock()
+        return {
+            f'...{str(key)[-4:]}': {
+                'requests': self._requests[key],
+                'rate_limited': self._rate_limited[key],
+                'benched_for': max(0.0, round(self._benched_until[key] - now, 1)),
+            }
+            for key in self._keys
+        }
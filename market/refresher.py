@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+from database.pool import ReaderPool, read_connection
+
+
+class PriceRefresher:
+    """
+    Background task that keeps the prices of held symbols warm.
+
+    Every `interval` seconds it ranks the symbols in `user_savings` by number of holders
+    and refreshes each one that is not warm, most held first. A refresh that had to go to
+    the API is followed by a `spacing` pause, so background work only takes a share of the
+    API quota and interactive requests still find free slots. The first pass runs right
+    after `start`, which warms the cache before users open their portfolios.
+
+    Parameters:
+        db: aiosqlite.Connection
+            Writer connection, used to read the held symbols when there is no reader pool.
+        refresh: Callable[[str], Awaitable[bool]]
+            Refreshes one symbol and returns True if that cost an API call.
+        is_warm: Callable[[str], bool]
+            Tells whether a symbol is still fresh enough to skip this pass.
+        interval: float
+            Seconds between passes.
+        spacing: float
+            Seconds to wait after each refresh that went to the API.
+        readers: ReaderPool | None
+            Pool the held symbols are read through, so a pass never waits on the writer.
+    """
+
+    def __init__(self, db: aiosqlite.Connection, refresh: Callable[[str], Awaitable[bool]],
+                 is_warm: Callable[[str], bool], interval: float, spacing: float, readers: ReaderPool | None = None):
+        self.db = db
+        self.readers = readers
+        self.refresh = refresh
+        self.is_warm = is_warm
+        self.interval = interval
+        self.spacing = spacing
+        self._task: asyncio.Task | None = None
+
+        self.passes = 0
+        self.refreshed = 0
+        self.api_calls = 0
+        self.last_pass_seconds = 0.0
+
+    async def held_symbols(self) -> list[str]:
+        """Returns held symbols, most holders first."""
+        async with read_connection(self.readers, self.db) as reader, \
+                reader.execute("""SELECT stock, COUNT(*) AS holders FROM user_savings
+                                  GROUP BY stock
+                                  ORDER BY holders DESC, stock""") as query:
+            return [stock for stock, _ in await query.fetchall()]
+
+    async def refresh_once(self) -> int:
+        """Runs one pass and returns the number of symbols refreshed."""
+        started = time.monotonic()
+        refreshed = 0
+
+        for symbol in await self.held_symbols():
+            if self.is_warm(symbol):
+                continue
+
+            try:
+                used_api = await self.refresh(symbol)
+            except Exception as e:
+                logging.warning(f'PriceRefresher failed to refresh {symbol}: {e}')
+                continue
+
+            refreshed += 1
+            if used_api:
+                self.api_calls += 1
+                await asyncio.sleep(self.spacing)
+
+        self.passes += 1
+        self.refreshed += refreshed
+        self.last_pass_seconds = time.monotonic() - started
+        return refreshed
+
+    async def run(self) -> None:
+        while True:
+            try:
+                refreshed = await self.refresh_once()
+                logging.info(f'PriceRefresher pass {self.passes}: refreshed {refreshed} symbols in {self.last_pass_seconds:.1f}s')
+            except Exception as e:
+                logging.error(f'PriceRefresher pass failed: {e}')
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'passes': self.passes,
+            'refreshed': self.refreshed,
+            'api_calls': self.api_calls,
+            'last_pass_seconds': round(self.last_pass_seconds, 2),
+        }
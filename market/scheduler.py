@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Callable
+
+
+class Priority(IntEnum):
+    """Lower value is served first."""
+    INTERACTIVE = 0  # Price checks and buy/sell quotes a user is waiting on
+    PORTFOLIO = 1    # Portfolio valuation rows
+    BACKGROUND = 2   # Refreshes nobody is waiting on
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited longer than the scheduler's `max_wait` for a token."""
+
+
+class RequestScheduler:
+    """
+    Token-bucket rate limiter with priority classes for outbound API calls.
+
+    Tokens are refilled at `rate` per second up to `burst`. Callers take one token per
+    request via `acquire`. When no token is available, callers queue and are served by
+    priority, then in arrival order. A caller that has not been served within `max_wait`
+    seconds gets QueueTimeout instead of waiting forever.
+
+    Metrics are available via `stats()`: current and peak queue depth, and per-priority
+    grant counts, total and peak wait time, and timeouts.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_wait: float = 15, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._clock = clock
+
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._waiters: list[tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.peak_depth = 0
+        self.granted = {priority: 0 for priority in Priority}
+        self.timeouts = {priority: 0 for priority in Priority}
+        self.wait_total = {priority: 0.0 for priority in Priority}
+        self.wait_max = {priority: 0.0 for priority in Priority}
+
+    def reset(self) -> None:
+        """Refills the bucket, drops the queue and clears the metrics."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        for *_, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+        self._tokens = float(self.burst)
+        self._updated = self._clock()
+        self.reset_stats()
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    @property
+    def idle(self) -> bool:
+        """True when nobody is queued and the bucket is full again, so dropping it changes nothing."""
+        self._refill()
+        return not self.depth and self._tokens >= self.burst
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record(self, priority: Priority, waited: float) -> None:
+        self.granted[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+
+        while self._waiters and self._tokens >= 1:
+            priority, _, enqueued, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Timed out or cancelled while queued
+                continue
+            self._tokens -= 1
+            self._record(Priority(priority), self._clock() - enqueued)
+            future.set_result(None)
+
+        # Drop abandoned waiters at the head so they don't keep the timer alive
+        while self._waiters and self._waiters[0][3].done():
+            heapq.heappop(self._waiters)
+
+        if self._waiters:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE, timeout: float | None = None) -> None:
+        """
+        Waits for a token.
+
+        Parameters:
+            priority: Priority
+                Queue class of the request. Lower values are served first.
+            timeout: float | None
+                Maximum time to wait in seconds. Defaults to the scheduler's `max_wait`.
+
+        Raises:
+            QueueTimeout
+                If no token was granted in time.
+        """
+        self._refill()
+        if not self.depth and self._tokens >= 1:
+            self._tokens -= 1
+            self._record(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), self._clock(), future))
+        self.peak_depth = max(self.peak_depth, self.depth)
+        if self._timer is None:
+            self._dispatch()
+
+        try:
+            await asyncio.wait_for(future, self.max_wait if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[priority] += 1
+            raise QueueTimeout(f'No API slot within {self.max_wait if timeout is None else timeout}s') from None
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'peak_depth': self.peak_depth,
+            'tokens': round(self._tokens, 2),
+            'by_priority': {
+                priority.name.lower(): {
+                    'granted': self.granted[priority],
+                    'timeouts': self.timeouts[priority],
+                    'avg_wait': self.wait_total[priority] / self.granted[priority] if self.granted[priority] else 0.0,
+                    'max_wait': self.wait_max[priority],
+                }
+                for priority in Priority
+            },
+        }
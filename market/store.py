@@ -0,0 +1,91 @@
+import datetime
+import logging
+from typing import NamedTuple
+
+import aiosqlite
+
+from database.pool import ReaderPool, read_connection
+from database.trading import transaction
+from market.calendar import quote_expiry
+
+
+class Quote(NamedTuple):
+    """A daily closing price of `symbol` for the trading day `as_of`. `stale` marks a fallback served past its expiry."""
+    symbol: str
+    price: str
+    as_of: datetime.date
+    stale: bool = False
+
+    @property
+    def expires(self) -> datetime.datetime:
+        return quote_expiry(self.as_of)
+
+    def seconds_left(self, now: datetime.datetime | None = None) -> float:
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return (self.expires - now).total_seconds()
+
+
+class PriceStore:
+    """
+    Persistent last-close store backed by the `prices` table of the bot database.
+
+    Writes go through `transaction` on the bot's single writer connection, so they are
+    serialized with trades and never end up inside one; lookups go through the reader pool.
+    Until `open` is called every lookup misses and every write is dropped, which keeps the
+    price path usable without a database (e.g. in tests).
+    """
+
+    def __init__(self):
+        self._db: aiosqlite.Connection | None = None
+        self._readers: ReaderPool | None = None
+
+    async def open(self, db: aiosqlite.Connection, readers: ReaderPool | None = None) -> None:
+        """Attaches the store to the writer connection `db`, reading through `readers` (or `db` when None)."""
+        self._db = db
+        self._readers = readers
+
+    async def close(self) -> None:
+        # The connections belong to the caller
+        self._db = None
+        self._readers = None
+
+    async def get(self, symbol: str, allow_stale: bool = False) -> Quote | None:
+        """Returns the stored quote for `symbol` if it has not been superseded yet, or in any case with `allow_stale`."""
+        if self._db is None:
+            return None
+
+        async with read_connection(self._readers, self._db) as reader, \
+                reader.execute('SELECT symbol, price, as_of FROM prices WHERE symbol = ?', (symbol,)) as query:
+            row = await query.fetchone()
+
+        if not row:
+            return None
+
+        quote = Quote(row[0], row[1], datetime.date.fromisoformat(row[2]))
+        return quote if allow_stale or quote.seconds_left() > 0 else None
+
+    async def put(self, quote: Quote) -> None:
+        if self._db is None:
+            return
+
+        try:
+            async with transaction(self._db):
+                await self._db.execute("""INSERT INTO prices (symbol, price, as_of) VALUES (?, ?, ?)
+                                          ON CONFLICT(symbol)
+                                          DO UPDATE SET price = excluded.price,
+                                                        as_of = excluded.as_of,
+                                                        fetched = datetime('now')""",
+                                       (quote.symbol, quote.price, quote.as_of.isoformat()))
+        except aiosqlite.Error as e:
+            logging.warning(f'PriceStore failed to save {quote.symbol}: {e}')
+
+    async def load(self) -> list[Quote]:
+        """Returns every stored quote that is still current, for warming the in-memory cache."""
+        if self._db is None:
+            return []
+
+        async with read_connection(self._readers, self._db) as reader, reader.execute('SELECT symbol, price, as_of FROM prices') as query:
+            rows = await query.fetchall()
+
+        quotes = [Quote(symbol, price, datetime.date.fromisoformat(as_of)) for symbol, price, as_of in rows]
+        return [quote for quote in quotes if quote.seconds_left() > 0]
@@ -0,0 +1,142 @@
+import asyncio
+import bisect
+import csv
+import io
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+
+class SymbolUniverse:
+    """
+    Local index of listed ticker symbols, used to reject typos without an API call.
+
+    Symbols are kept in one sorted tuple, so membership and prefix queries are a binary
+    search. Symbols the API recently reported as unknown go to a negative cache for
+    `reject_ttl` seconds, which also covers listings the local index still contains.
+
+    Until a listing has been loaded, every symbol not in the negative cache is treated as
+    possibly valid, so the bot keeps working without the listing file.
+    """
+
+    def __init__(self, reject_ttl: float = 3600, clock: Callable[[], float] = time.monotonic):
+        self.reject_ttl = reject_ttl
+        self._clock = clock
+        self._symbols: tuple[str, ...] = ()
+        self._rejected: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+        self.loaded_at: float | None = None
+        self.rejections = 0
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        ticker = symbol.upper()
+        i = bisect.bisect_left(self._symbols, ticker)
+        return i < len(self._symbols) and self._symbols[i] == ticker
+
+    def with_prefix(self, prefix: str, limit: int = 10) -> list[str]:
+        """Returns up to `limit` listed symbols starting with `prefix`, in alphabetical order."""
+        prefix = prefix.upper()
+        i = bisect.bisect_left(self._symbols, prefix)
+        found = []
+        while i < len(self._symbols) and len(found) < limit and self._symbols[i].startswith(prefix):
+            found.append(self._symbols[i])
+            i += 1
+        return found
+
+    def load_csv(self, text: str) -> int:
+        """
+        Replaces the index with the active symbols of an Alpha Vantage LISTING_STATUS CSV.
+
+        Returns:
+            int: Number of symbols loaded.
+        """
+        reader = csv.DictReader(io.StringIO(text))
+        symbols = {
+            row['symbol'].strip().upper()
+            for row in reader
+            if row.get('symbol') and row.get('status', 'Active').strip().lower() == 'active'
+        }
+        if not symbols:
+            raise ValueError('Listing contains no active symbols')
+
+        self._symbols = tuple(sorted(symbols))
+        self.loaded_at = self._clock()
+        return len(self._symbols)
+
+    def load_file(self, path: str) -> int:
+        """Loads the listing saved at `path`. Returns 0 if the file does not exist yet."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as listing:
+            return self.load_csv(listing.read())
+
+    def reject(self, symbol: str) -> None:
+        """Remembers that the API reported `symbol` as unknown."""
+        now = self._clock()
+        if len(self._rejected) >= 10_000:
+            self._rejected = {ticker: expires for ticker, expires in self._rejected.items() if expires > now}
+        self._rejected[symbol.upper()] = now + self.reject_ttl
+        self.rejections += 1
+
+    def could_exist(self, symbol: str) -> bool:
+        """Returns False only if `symbol` is known to be invalid: recently rejected or absent from a loaded listing."""
+        ticker = symbol.upper()
+
+        expires = self._rejected.get(ticker)
+        if expires is not None:
+            if expires > self._clock():
+                return False
+            del self._rejected[ticker]
+
+        if not self._symbols:
+            return True
+        return ticker in self
+
+    async def refresh(self, fetch_csv: Callable[[], Awaitable[str | None]], path: str) -> int:
+        """Downloads a fresh listing with `fetch_csv`, saves it to `path` and loads it. Keeps the old index on failure."""
+        text = await fetch_csv()
+        if not text:
+            return 0
+
+        count = self.load_csv(text)
+        with open(path, 'w', encoding='utf-8') as listing:
+            listing.write(text)
+        return count
+
+    async def run(self, fetch_csv: Callable[[], Awaitable[str | None]], path: str, interval: float) -> None:
+        # A listing saved by a previous run is reused until it is `interval` old
+        if os.path.exists(path):
+            await asyncio.sleep(max(0.0, interval - (time.time() - os.path.getmtime(path))))
+
+        while True:
+            try:
+                count = await self.refresh(fetch_csv, path)
+                logging.info(f'SymbolUniverse refreshed: {count} symbols')
+            except Exception as e:
+                logging.error(f'SymbolUniverse refresh failed: {e}')
+            await asyncio.sleep(interval)
+
+    def start(self, fetch_csv: Callable[[], Awaitable[str | None]], path: str, interval: float) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run(fetch_csv, path, interval))
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def reset(self) -> None:
+        self._symbols = ()
+        self._rejected.clear()
+        self.loaded_at = None
+        self.rejections = 0
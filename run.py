@@ -1,15 +1,54 @@
 import asyncio
 import logging
+import secrets
 import aiohttp
 
-import aiosqlite
-
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config.config import TOKEN
+from config.config import (
+    TOKEN,
+    DB_PATH,
+    DB_READERS,
+    DB_MMAP_SIZE,
+    DB_CACHE_SIZE,
+    HISTORY_KEEP_DAYS,
+    HISTORY_COMPACT_INTERVAL,
+    ALPHA_CALLS_PER_MINUTE,
+    PRICE_REFRESH_INTERVAL,
+    PRICE_REFRESH_SHARE,
+    QUOTE_METRICS_INTERVAL,
+    SYMBOL_LIST_PATH,
+    SYMBOL_LIST_REFRESH,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_CONCURRENCY,
+    WEBHOOK_MAX_CONNECTIONS,
+)
+from helpers import (
+    alpha_keys,
+    fetch_listing_csv,
+    log_quote_metrics,
+    price_store,
+    quote_metrics,
+    quote_cache,
+    refresh_stock_price,
+    symbol_universe,
+    warm_quote_cache,
+)
+from database.pool import ReaderPool, open_writer
+from database.repository import Repository
+from database.compaction import HistoryCompactor
+from database.migrations import migrate
+from market.refresher import PriceRefresher
 from bot.handlers import form_router
 from bot.admin import admin_router
+from bot.broadcast import BroadcastJobs
+from bot.outbound import OutboundScheduler
+from bot.webhook import run_webhook
 
 # Initialize storage
 storage = MemoryStorage()
@@ -17,53 +56,73 @@ storage = MemoryStorage()
 # Define the main function to start the bot
 async def main():
     
-    async with aiohttp.ClientSession() as http_session, \
-                aiosqlite.connect('database/bot_db.db') as db_session:
-
-        await db_session.execute("""
-                                 CREATE TABLE IF NOT EXISTS users(id INTEGER PRIMARY KEY NOT NULL,
-                                                     cash NUMERIC NOT NULL DEFAULT 10000.00,
-                                                     created DATE NOT NULL DEFAULT (date()),
-                                                     username TEXT null on conflict ignore)
-                                 """)
-
-        await db_session.execute("""
-                                 CREATE TABLE IF NOT EXISTS user_savings (user_id INTEGER NOT NULL,
-                                                            stock TEXT NOT NULL,
-                                                            quantity INTEGER NOT NULL,
-                                                            PRIMARY KEY (user_id, stock),
-                                                            FOREIGN KEY (user_id) REFERENCES users(id))
-                                 """)
-
-        await db_session.execute("""CREATE TRIGGER IF NOT EXISTS delete_zero_quantity
-                                 AFTER UPDATE ON user_savings
-                                 FOR EACH ROW
-                                 WHEN NEW.quantity = 0
-                                 BEGIN
-                                     DELETE FROM user_savings WHERE user_id = NEW.user_id AND stock = NEW.stock;
-                                 END
-                                 """)
-
-        await db_session.execute("""
-                                 CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                                       user_id INTEGER NOT NULL,
-                                                       stock TEXT NOT NULL,
-                                                       price NUMERIC NOT NULL,
-                                                       quantity INTEGER NOT NULL,
-                                                       time NUMERIC DEFAULT (datetime('now')),
-                                                       FOREIGN KEY (user_id) REFERENCES users(id))
-                                 """)
-
-        await db_session.commit()
-
-        bot = Bot(token=TOKEN)
-
-        dp = Dispatcher(storage=storage, db=db_session, session=http_session, bot=bot)
-
-        dp.include_router(admin_router)
-        dp.include_router(form_router)
-
-        await dp.start_polling(bot, polling_timeout=5)
+    async with aiohttp.ClientSession() as http_session:
+        # open_writer hands back a started connection; entering it with `async with` would start it twice
+        db_session = await open_writer(DB_PATH, DB_MMAP_SIZE, DB_CACHE_SIZE)
+        try:
+            # Only the schema steps this database has not seen yet are applied
+            logging.info(f'Applied {await migrate(db_session)} schema migrations')
+
+            # Reads go through their own connections, writes stay on db_session
+            readers = ReaderPool(DB_PATH, DB_READERS, DB_MMAP_SIZE, DB_CACHE_SIZE)
+            await readers.open()
+
+            await price_store.open(db_session, readers)
+            logging.info(f'Warmed quote cache with {await warm_quote_cache()} stored prices')
+            logging.info(f'Loaded {symbol_universe.load_file(SYMBOL_LIST_PATH)} listed symbols')
+
+            bot = Bot(token=TOKEN)
+            # Every Bot API call waits for its chat's and the bot's rate limit, replies ahead of broadcasts
+            outbound = OutboundScheduler()
+            bot.session.middleware(outbound)
+
+            # Broadcasts left running by the previous process carry on after their cursor
+            broadcasts = BroadcastJobs(db_session, bot, readers)
+            logging.info(f'Resumed {await broadcasts.resume_all()} broadcasts')
+
+            dp = Dispatcher(storage=storage, db=db_session, repo=Repository(db_session, readers), session=http_session, bot=bot,
+                            broadcasts=broadcasts)
+
+            dp.include_router(admin_router)
+            dp.include_router(form_router)
+
+            # Keep held symbols warm using a share of the API quota, most held first
+            refresher = PriceRefresher(
+                db=db_session,
+                readers=readers,
+                refresh=lambda symbol: refresh_stock_price(symbol, http_session),
+                is_warm=lambda symbol: quote_cache.ttl_left(symbol) > PRICE_REFRESH_INTERVAL,
+                interval=PRICE_REFRESH_INTERVAL,
+                spacing=60 / (ALPHA_CALLS_PER_MINUTE * len(alpha_keys) * PRICE_REFRESH_SHARE),
+            )
+            refresher.start()
+            # Move old trades out of the hot history table, keeping what profits are computed from
+            compactor = HistoryCompactor(db_session, HISTORY_KEEP_DAYS, HISTORY_COMPACT_INTERVAL)
+            compactor.start()
+            symbol_universe.start(lambda: fetch_listing_csv(http_session), SYMBOL_LIST_PATH, SYMBOL_LIST_REFRESH)
+            # Provider health for monitoring: cache, quota, keys, breaker and retries, a warning while degraded
+            metrics_task = asyncio.create_task(log_quote_metrics(QUOTE_METRICS_INTERVAL))
+
+            try:
+                if WEBHOOK_URL:
+                    await run_webhook(dp, bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+                                      WEBHOOK_SECRET or secrets.token_urlsafe(32), WEBHOOK_CONCURRENCY, WEBHOOK_MAX_CONNECTIONS)
+                else:
+                    # getUpdates does not work while a webhook is set, e.g. after switching back from webhook mode
+                    await bot.delete_webhook()
+                    await dp.start_polling(bot, polling_timeout=5)
+            finally:
+                await broadcasts.stop()
+                logging.info(f'Outbound Bot API calls: {outbound.stats()}')
+                metrics_task.cancel()
+                logging.info(f'Price path: {quote_metrics()}')
+                await symbol_universe.stop()
+                await refresher.stop()
+                await compactor.stop()
+                await price_store.close()
+                await readers.close()
+        finally:
+            await db_session.close()
 
 
 # Run the main function, set up logging
@@ -71,4 +130,3 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
 
-#TODO: Found possible bug with transactions .commit and .rollback between multiple users
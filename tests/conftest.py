@@ -5,12 +5,37 @@ import asyncio
 
 @pytest_asyncio.fixture
 async def db():
-    db = await aiosqlite.connect(':memory:')
+    from database.migrations import migrate
 
-    with open('database/schema.sql', 'r') as schema:
-        await db.executescript(schema.read())
+    db = await aiosqlite.connect(':memory:')
+    await migrate(db)
 
-    await db.commit()
     yield db
 
     await db.close()
+
+
+@pytest.fixture
+def repo(db):
+    from database.repository import Repository
+
+    return Repository(db)
+
+
+@pytest.fixture(autouse=True)
+def reset_market_state(tmp_path):
+    from helpers import quote_cache, alpha_scheduler, alpha_keys, symbol_universe, alpha_breaker, alpha_retries, history_store
+
+    def reset():
+        quote_cache.clear()
+        alpha_scheduler.reset()
+        alpha_keys.reset()
+        symbol_universe.reset()
+        alpha_breaker.reset()
+        alpha_retries.reset()
+        history_store.clear()
+
+    history_store.directory = str(tmp_path / 'history')
+    reset()
+    yield
+    reset()
@@ -0,0 +1,320 @@
+import asyncio
+import collections
+import time
+
+import pytest
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import ChatMemberUpdated, Message, User
+
+from bot.admin import broadcast_send
+from bot.handlers import user_blocked_bot, user_unblocked_bot
+from bot.broadcast import Broadcast, BroadcastJobs, FloodGate, format_duration
+from database.broadcasts import CANCELLED, DONE, PAUSED, RUNNING, get_job, record_results
+from database.migrations import migrate
+from database.pool import ReaderPool, open_writer
+from market.scheduler import RequestScheduler
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeBot:
+    """Records sends; `failures` maps a chat id to the exceptions its next sends raise."""
+
+    def __init__(self, delay: float = 0.0, failures: dict | None = None):
+        self.delay = delay
+        self.failures = failures or {}
+        self.sent: list[tuple[int, float]] = []
+        self.edits: list[dict] = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failures.get(chat_id):
+                raise self.failures[chat_id].pop(0)
+            self.sent.append((chat_id, time.monotonic()))
+        finally:
+            self.in_flight -= 1
+
+    async def edit_message_text(self, **kwargs):
+        self.edits.append(kwargs)
+
+
+async def chunks(ids: list[int], size: int = 7):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def jobs(db, bot, rate: float = 1000) -> BroadcastJobs:
+    return BroadcastJobs(db, bot, chunk=10, workers=4, progress_interval=0.02,
+                         scheduler=RequestScheduler(rate=rate, burst=1), gate=FloodGate())
+
+
+def retry_after(chat_id: int, seconds: float) -> TelegramRetryAfter:
+    error = TelegramRetryAfter(SendMessage(chat_id=chat_id, text='hi'), 'Too Many Requests', 1)
+    error.retry_after = seconds
+    return error
+
+
+async def test_broadcast_sends_concurrently_within_rate():
+    bot = FakeBot(delay=0.05)
+    broadcast = Broadcast(bot, 'hi', workers=8, scheduler=RequestScheduler(rate=200, burst=1), gate=FloodGate())
+
+    started = time.monotonic()
+    stats = await broadcast.run(chunks(list(range(60))))
+    elapsed = time.monotonic() - started
+
+    assert sorted(chat_id for chat_id, _ in bot.sent) == list(range(60))
+    assert stats['sent'] == 60 and stats['failed'] == 0 and stats['total'] == 60
+    assert bot.peak_in_flight <= 8
+    # One at a time this takes 3s; the rate allows 60 sends in 0.3s
+    assert 0.25 < elapsed < 1.0
+
+
+async def test_broadcast_flood_wait_pauses_all_workers():
+    bot = FakeBot(delay=0.01, failures={5: [retry_after(5, 0.3)]})
+    gate = FloodGate()
+    broadcast = Broadcast(bot, 'hi', workers=4, scheduler=RequestScheduler(rate=1000, burst=4), gate=gate)
+
+    stats = await broadcast.run(chunks(list(range(20))))
+
+    assert stats['sent'] == 20 and stats['flood_waits'] == 1
+    assert gate.pauses == 1
+    # Sends before and after the flood answer are at least the pause apart, for every worker
+    times = sorted(sent_at for _, sent_at in bot.sent)
+    assert max(later - earlier for earlier, later in zip(times, times[1:])) >= 0.25
+
+
+async def test_broadcast_counts_unreachable_and_gives_up_on_repeated_floods():
+    bot = FakeBot(failures={
+        1: [TelegramForbiddenError(SendMessage(chat_id=1, text='hi'), 'bot was blocked by the user')],
+        2: [retry_after(2, 0.01) for _ in range(3)],
+    })
+    broadcast = Broadcast(bot, 'hi', workers=2, flood_retries=2, scheduler=RequestScheduler(rate=1000, burst=4),
+                          gate=FloodGate())
+
+    stats = await broadcast.run(chunks([0, 1, 2, 3]))
+
+    assert [chat_id for chat_id, _ in sorted(bot.sent)] == [0, 3]
+    assert stats['sent'] == 2 and stats['failed'] == 2 and stats['flood_waits'] == 3
+
+
+async def test_broadcast_reports_progress():
+    reports = []
+
+    async def report(stats):
+        reports.append(stats)
+
+    bot = FakeBot()
+    broadcast = Broadcast(bot, 'hi', total=30, on_progress=report, workers=4, progress_interval=0.05,
+                          scheduler=RequestScheduler(rate=100, burst=1), gate=FloodGate())
+    stats = await broadcast.run(chunks(list(range(30))))
+
+    first = reports[0]
+    assert 0 < first['sent'] < 30 and first['rate'] > 0 and first['eta'] > 0
+    assert stats['sent'] == 30 and stats['eta'] == 0
+
+
+async def test_format_duration():
+    assert format_duration(12.4) == '12s'
+    assert format_duration(200) == '3m 20s'
+    assert format_duration(3900) == '1h 05m'
+
+
+async def test_broadcast_send_starts_background_job(db, mocker):
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(1, 'admin'), (2, 'a'), (3, 'b')])
+    await db.commit()
+
+    message = mocker.Mock(spec=Message)
+    message.from_user = mocker.Mock(spec=User)
+    message.from_user.id = 1
+    message.text = 'Hello'
+    message.answer = mocker.AsyncMock(return_value=mocker.Mock(message_id=10))
+    state = mocker.AsyncMock()
+    bot = FakeBot()
+    broadcasts = jobs(db, bot)
+
+    await broadcast_send(message=message, state=state, broadcasts=broadcasts, ignore_sender=True)
+    state.clear.assert_awaited_once()
+    assert 'sending to 2 users' in message.answer.await_args.kwargs['text']
+
+    await broadcasts.tasks[1]
+
+    # Both users, then the result to the admin
+    assert [chat_id for chat_id, _ in bot.sent] in ([2, 3, 1], [3, 2, 1])
+    job = await get_job(db, 1)
+    assert (job['state'], job['sent'], job['failed'], job['status_message_id']) == (DONE, 2, 0, 10)
+    assert bot.edits[-1]['message_id'] == 10 and 'is done' in bot.edits[-1]['text']
+    async with db.execute('SELECT user_id, sent FROM broadcast_recipients WHERE job_id = 1 ORDER BY user_id') as query:
+        assert await query.fetchall() == [(2, 1), (3, 1)]
+
+
+async def test_broadcast_job_pause_resume_and_restart(db):
+    await db.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 51)])
+    await db.commit()
+    bot = FakeBot(delay=0.005)
+    broadcasts = jobs(db, bot, rate=300)
+
+    job = await broadcasts.create(admin_id=1000, text='hi')
+    broadcasts.start(job)
+    await asyncio.sleep(0.05)
+
+    assert await broadcasts.pause(job['id'])
+    paused = await get_job(db, job['id'])
+    assert paused['state'] == PAUSED and 0 < paused['sent'] < 50
+    async with db.execute('SELECT COUNT(*) FROM broadcast_recipients') as query:
+        assert (await query.fetchone())[0] == paused['sent'] == len(bot.sent)
+    await asyncio.sleep(0.05)
+    assert len(bot.sent) == paused['sent']
+    assert not await broadcasts.pause(job['id'])
+
+    # Resumed, then the bot shuts down halfway; the job stays running in the database
+    assert await broadcasts.resume(job['id'])
+    await asyncio.sleep(0.05)
+    await broadcasts.stop()
+    assert (await get_job(db, job['id']))['state'] == RUNNING
+
+    restarted = jobs(db, bot, rate=300)
+    assert await restarted.resume_all() == 1
+    await restarted.tasks[job['id']]
+
+    received = collections.Counter(chat_id for chat_id, _ in bot.sent)
+    assert received == {**{i: 1 for i in range(1, 51)}, 1000: 1}
+    done = await get_job(db, job['id'])
+    assert (done['state'], done['sent'], done['cursor']) == (DONE, 50, 50)
+
+
+async def test_broadcast_job_double_resume_keeps_running(db):
+    await db.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 51)])
+    await db.commit()
+    bot = FakeBot(delay=0.005)
+    broadcasts = jobs(db, bot, rate=300)
+
+    job = await broadcasts.create(admin_id=1000, text='hi')
+    broadcasts.start(job)
+    await asyncio.sleep(0.05)
+    assert await broadcasts.pause(job['id'])
+
+    # Two admins press resume at once, then one presses it again while the job runs
+    assert sorted(await asyncio.gather(broadcasts.resume(job['id']), broadcasts.resume(job['id']))) == [False, True]
+    await asyncio.sleep(0.02)
+    assert not await broadcasts.resume(job['id'])
+    await broadcasts.tasks[job['id']]
+
+    received = collections.Counter(chat_id for chat_id, _ in bot.sent)
+    assert received == {**{i: 1 for i in range(1, 51)}, 1000: 1}
+    assert (await get_job(db, job['id']))['state'] == DONE
+
+
+async def test_broadcast_job_reads_recipients_from_reader_pool(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    writer = await open_writer(path)
+    await migrate(writer)
+    await writer.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 26)])
+    await writer.commit()
+
+    readers = ReaderPool(path, size=1)
+    await readers.open()
+    try:
+        bot = FakeBot()
+        broadcasts = BroadcastJobs(writer, bot, readers, chunk=10, workers=4, progress_interval=0.02,
+                                   scheduler=RequestScheduler(rate=1000, burst=1), gate=FloodGate())
+        job = await broadcasts.create(admin_id=1000, text='hi')
+        await broadcasts.start(job)
+
+        assert sorted(chat_id for chat_id, _ in bot.sent) == [*range(1, 26), 1000]
+        # Three chunks and the empty read that ends the job
+        assert readers.stats()['acquired'] == 4
+    finally:
+        await readers.close()
+        await writer.close()
+
+
+async def test_broadcast_job_cancel(db):
+    await db.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 51)])
+    await db.commit()
+    bot = FakeBot(delay=0.005)
+    broadcasts = jobs(db, bot, rate=300)
+
+    job = await broadcasts.create(admin_id=1000, text='hi')
+    broadcasts.start(job)
+    await asyncio.sleep(0.05)
+    assert await broadcasts.cancel(job['id'])
+
+    sent = len(bot.sent)
+    await asyncio.sleep(0.05)
+    assert len(bot.sent) == sent < 50
+    assert (await get_job(db, job['id']))['state'] == CANCELLED
+    assert not await broadcasts.resume(job['id'])
+
+
+async def test_broadcast_job_skips_recipients_stored_past_cursor(db):
+    await db.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 11)])
+    await db.commit()
+    bot = FakeBot()
+    broadcasts = jobs(db, bot)
+
+    # A crash after storing some sends of a chunk, before the chunk was complete
+    job = await broadcasts.create(admin_id=1000, text='hi', exclude_id=5)
+    await record_results(db, job['id'], [(3, True), (7, False)])
+    await broadcasts.start(job)
+
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2, 4, 6, 8, 9, 10, 1000]
+    done = await get_job(db, job['id'])
+    assert (done['state'], done['sent'], done['failed'], done['total']) == (DONE, 8, 1, 9)
+
+
+async def test_unreachable_users_are_skipped_until_reprobe(db, mocker):
+    await db.executemany('INSERT INTO users (id) VALUES (?)', [(i,) for i in range(1, 6)])
+    await db.commit()
+    blocked = TelegramForbiddenError(SendMessage(chat_id=2, text='hi'), 'bot was blocked by the user')
+    gone = TelegramBadRequest(SendMessage(chat_id=4, text='hi'), 'Bad Request: chat not found')
+    broken = TelegramBadRequest(SendMessage(chat_id=5, text='hi'), "Bad Request: can't parse entities")
+    bot = FakeBot(failures={2: [blocked], 4: [gone], 5: [broken]})
+
+    broadcasts = jobs(db, bot)
+    job = await broadcasts.create(admin_id=1000, text='hi')
+    await broadcasts.start(job)
+
+    async with db.execute('SELECT id FROM users WHERE unreachable_since IS NOT NULL ORDER BY id') as query:
+        assert await query.fetchall() == [(2,), (4,)]
+
+    # The next broadcast leaves them out
+    bot.sent.clear()
+    job = await broadcasts.create(admin_id=1000, text='again')
+    assert job['total'] == 3
+    await broadcasts.start(job)
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 3, 5, 1000]
+
+    # Until the mark is older than the re-probe age; user 2 unblocked meanwhile, 4 is still gone
+    await db.execute("UPDATE users SET unreachable_since = datetime('now', '-31 days') WHERE id = 2")
+    await db.commit()
+    bot.failures[4] = [gone]
+    bot.sent.clear()
+    job = await jobs(db, bot).create(admin_id=1000, text='third')
+    assert job['total'] == 4
+    await broadcasts.start(job)
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2, 3, 5, 1000]
+    async with db.execute('SELECT id FROM users WHERE unreachable_since IS NOT NULL') as query:
+        assert await query.fetchall() == [(4,)]
+
+
+async def test_my_chat_member_updates_reachability(db, mocker):
+    await db.execute('INSERT INTO users (id) VALUES (1)')
+    await db.commit()
+    event = mocker.Mock(spec=ChatMemberUpdated)
+    event.from_user = mocker.Mock(spec=User)
+    event.from_user.id = 1
+
+    await user_blocked_bot(event, db)
+    async with db.execute('SELECT unreachable_since IS NOT NULL FROM users WHERE id = 1') as query:
+        assert (await query.fetchone())[0] == 1
+
+    await user_unblocked_bot(event, db)
+    async with db.execute('SELECT unreachable_since FROM users WHERE id = 1') as query:
+        assert (await query.fetchone())[0] is None
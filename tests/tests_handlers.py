@@ -3,13 +3,14 @@ import pytest
 import aiosqlite
 import asyncio
 
-from aiogram.types import Message, User, Chat
+from aiogram.types import Message, CallbackQuery, User, Chat
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
 
-from bot.handlers import cmd_start, buy_amount, sell_amount
-from config.strings import DEFAULT_HELLO
+from bot.handlers import cmd_start, buy_symbol, buy_amount, sell_amount, check_savings
+from config.strings import DEFAULT_HELLO, INVALID_SYMBOL
 from bot.keyboards import Keyboards
+from database.repository import Repository
 
 pytestmark = pytest.mark.asyncio
 
@@ -22,7 +23,7 @@ async def test_cmd_start_new_user(db, mocker):
     mock_message.from_user = mock_user
     mock_message.answer = mocker.AsyncMock()
 
-    await cmd_start(message=mock_message, db=db)
+    await cmd_start(message=mock_message, db=db, repo=Repository(db))
 
     async with db.execute('SELECT id, cash, username FROM users WHERE id=1') as query:
         data = await query.fetchone()
@@ -37,7 +38,7 @@ async def test_cmd_start_new_user(db, mocker):
         parse_mode='HTML'
     )
 
-    await cmd_start(message=mock_message, db=db)
+    await cmd_start(message=mock_message, db=db, repo=Repository(db))
 
     async with db.execute('SELECT COUNT(*) FROM users') as query:
         data = await query.fetchone()
@@ -56,7 +57,7 @@ async def test_cmd_start_existing_user(db, mocker):
     await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (mock_message.from_user.id, mock_message.from_user.username,))
     await db.commit()
 
-    await cmd_start(message=mock_message, db=db)
+    await cmd_start(message=mock_message, db=db, repo=Repository(db))
 
     async with db.execute('SELECT id, cash, username FROM users WHERE id=1') as query:
         data = await query.fetchone()
@@ -71,6 +72,27 @@ async def test_cmd_start_existing_user(db, mocker):
         parse_mode='HTML'
     )
 
+async def test_buy_symbol_unknown_symbol(mocker):
+    from helpers import symbol_universe
+
+    symbol_universe.reject('QWER')
+
+    mock_state = mocker.Mock(spec=FSMContext)
+    mock_state.get_data = mocker.AsyncMock(return_value={'bot_message_id': 1})
+
+    mock_message = mocker.Mock(spec=Message)
+    mock_message.text = 'qwer'
+    mock_message.delete = mocker.AsyncMock()
+
+    mock_check_price = mocker.patch('bot.handlers.check_stock_price')
+    mock_edit = mocker.patch('bot.handlers.edit_bot_message')
+
+    await buy_symbol(mock_message, mock_state, session=mocker.AsyncMock(spec=aiohttp.ClientSession), bot=mocker.Mock(spec=Bot))
+
+    mock_check_price.assert_not_called()
+    assert mock_edit.call_args.kwargs['text'].startswith(INVALID_SYMBOL)
+    mock_state.clear.assert_called_once()
+
 async def test_buy_amount(db, mocker):
     mock_state = mocker.Mock(spec=FSMContext)
     mock_state.get_data = mocker.AsyncMock()
@@ -176,7 +198,7 @@ async def test_sell_amount(db, mocker):
                      )
     await db.commit()
 
-    await sell_amount(mock_message, mock_state, db=db, session=mock_conn, bot=mock_bot)
+    await sell_amount(mock_message, mock_state, db=db, repo=Repository(db), session=mock_conn, bot=mock_bot)
 
     mock_check_price.assert_called_once_with('AAPL', mock_conn)
 
@@ -222,7 +244,7 @@ async def test_sell_amount_changed_price(db, mocker):
                      )
     await db.commit()
 
-    await sell_amount(mock_message, mock_state, db=db, session=mock_conn, bot=mock_bot)
+    await sell_amount(mock_message, mock_state, db=db, repo=Repository(db), session=mock_conn, bot=mock_bot)
 
     mock_check_price.assert_called_once_with('AAPL', mock_conn)
 
@@ -238,3 +260,29 @@ async def test_sell_amount_changed_price(db, mocker):
     assert user_cash[0] == 10000.00
     assert user_stocks[0] == 12
     assert selled_stocks is None
+
+async def test_check_savings(db, mocker):
+    mock_user = mocker.Mock(spec=User)
+    mock_user.id = 1
+
+    mock_callback = mocker.Mock(spec=CallbackQuery)
+    mock_callback.from_user = mock_user
+    mock_callback.answer = mocker.AsyncMock()
+
+    mock_conn = mocker.AsyncMock(spec=aiohttp.ClientSession)
+    mock_get_prices = mocker.patch('bot.handlers.get_prices', return_value={'AAPL': '160.00', 'IBM': '300.00'})
+    mock_edit = mocker.patch('bot.handlers.edit_bot_message')
+
+    await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (mock_user.id, 'test'))
+    await db.executemany('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)',
+                         [(mock_user.id, 'AAPL', 2), (mock_user.id, 'IBM', 1)])
+    await db.executemany('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                         [(mock_user.id, 'AAPL', 150.00, 2), (mock_user.id, 'IBM', 310.00, 1)])
+    await db.commit()
+
+    await check_savings(mock_callback, db=db, repo=Repository(db), session=mock_conn)
+
+    mock_get_prices.assert_called_once_with(['AAPL', 'IBM'], mock_conn)
+    text = mock_edit.call_args.kwargs['text']
+    assert '<b>AAPL:</b> 2pcs. (Total: <b>$320.00</b> / Profit: <b>$20.00</b>)' in text
+    assert '<b>IBM:</b> 1pcs. (Total: <b>$300.00</b> / Profit: <b>$-10.00</b>)' in text
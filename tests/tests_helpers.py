@@ -1,3 +1,4 @@
+import json
 from unittest.mock import AsyncMock
 
 import aiosqlite
@@ -8,8 +9,8 @@ import aiohttp
 from aiogram.types import Message, CallbackQuery, User
 from pytest_mock import mocker
 
-from config.config import ALPHA_API
-from helpers import check_stock_price, calc_profit, fetch_stock_data, username_db_check
+from config.config import ALPHA_API, ALPHA_TIMEOUT
+from helpers import check_stock_price, calc_profit, fetch_stock_data, get_prices, username_db_check, quote_cache, history_store
 
 pytestmark = pytest.mark.asyncio
 
@@ -50,7 +51,7 @@ async def test_check_stock_price(mocker):
 
     mock_response = mocker.AsyncMock()
     mock_response.status = 200
-    mock_response.json.return_value = json_response
+    mock_response.read.return_value = json.dumps(json_response).encode()
 
     mock_get_context = mocker.AsyncMock()
     mock_get_context.__aenter__.return_value = mock_response
@@ -63,8 +64,11 @@ async def test_check_stock_price(mocker):
     price = await check_stock_price('IBM', session=mock_session)
 
     assert price == "312.4200"
+    # The whole series lands in the history store, oldest first
+    assert [bar.close for bar in history_store.range('IBM')] == [300.85, 306.77, 312.42]
 
-    mock_session.get.assert_called_once_with(f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol=IBM&apikey={ALPHA_API}')
+    mock_session.get.assert_called_once_with(f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol=IBM&apikey={ALPHA_API}',
+                                             timeout=aiohttp.ClientTimeout(total=ALPHA_TIMEOUT))
 
 async def test_check_stock_price_status(mocker):
     mock_response = mocker.AsyncMock()
@@ -81,7 +85,179 @@ async def test_check_stock_price_status(mocker):
 
     assert price is None
 
-    mock_session.get.assert_called_once_with(f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol=IBM&apikey={ALPHA_API}')
+    mock_session.get.assert_called_once_with(f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol=IBM&apikey={ALPHA_API}',
+                                             timeout=aiohttp.ClientTimeout(total=ALPHA_TIMEOUT))
+
+async def test_check_stock_price_rotates_rate_limited_key(mocker):
+    from market.keys import KeyPool
+
+    pool = KeyPool(['KEY1', 'KEY2'])
+    mocker.patch('helpers.alpha_keys', pool)
+
+    limited_response = mocker.AsyncMock()
+    limited_response.status = 200
+    limited_response.read.return_value = json.dumps({'Note': 'Our standard API call frequency is 5 calls per minute.'}).encode()
+
+    ok_response = mocker.AsyncMock()
+    ok_response.status = 200
+    ok_response.read.return_value = json.dumps({'Time Series (Daily)': {'2025-11-06': {'4. close': '312.4200'}}}).encode()
+
+    contexts = []
+    for response in (limited_response, ok_response):
+        context = mocker.AsyncMock()
+        context.__aenter__.return_value = response
+        context.__aexit__.return_value = None
+        contexts.append(context)
+
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+    mock_session.get.side_effect = contexts
+
+    price = await check_stock_price('IBM', session=mock_session)
+
+    assert price == '312.4200'
+    assert mock_session.get.call_args_list[0].args[0].endswith('apikey=KEY1')
+    assert mock_session.get.call_args_list[1].args[0].endswith('apikey=KEY2')
+    assert pool.stats()['...KEY1']['rate_limited'] == 1
+    assert pool.available == 1
+
+async def test_check_stock_price_serves_stale_when_keys_exhausted(mocker):
+    import datetime
+    from market.keys import KeyPool
+    from market.store import Quote
+
+    pool = KeyPool(['KEY1', 'KEY2'])
+    mocker.patch('helpers.alpha_keys', pool)
+    mocker.patch('helpers.alpha_scheduler.acquire')
+    quote_cache.set('IBM', Quote('IBM', '300.0000', datetime.date(2025, 11, 5)), ttl=0)
+
+    limited_response = mocker.AsyncMock()
+    limited_response.status = 200
+    limited_response.read.return_value = json.dumps({'Note': 'Our standard API call frequency is 5 calls per minute.'}).encode()
+
+    context = mocker.AsyncMock()
+    context.__aenter__.return_value = limited_response
+    context.__aexit__.return_value = None
+
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+    mock_session.get.return_value = context
+
+    # Every key turns out to be over quota
+    assert await check_stock_price('IBM', session=mock_session) == '300.0000'
+    assert mock_session.get.call_count == 2
+    assert pool.available == 0
+
+    # Every key is still benched, so the API is not called at all
+    assert await check_stock_price('IBM', session=mock_session) == '300.0000'
+    assert mock_session.get.call_count == 2
+
+async def test_check_stock_price_rejects_unknown_symbol(mocker):
+    from helpers import symbol_universe
+
+    mock_response = mocker.AsyncMock()
+    mock_response.status = 200
+    mock_response.read.return_value = json.dumps({'Error Message': 'Invalid API call. Please retry or visit the documentation.'}).encode()
+
+    mock_get_context = mocker.AsyncMock()
+    mock_get_context.__aenter__.return_value = mock_response
+    mock_get_context.__aexit__.return_value = None
+
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+    mock_session.get.return_value = mock_get_context
+
+    assert await check_stock_price('QWER', session=mock_session) is None
+    assert not symbol_universe.could_exist('qwer')
+
+async def test_check_stock_price_retries_then_serves_stale(mocker):
+    import datetime
+    from helpers import alpha_breaker, alpha_retries
+    from market.store import Quote
+
+    mocker.patch('helpers.backoff_delay', return_value=0)
+    # Retries take quota tokens too, don't wait for the real rate here
+    mocker.patch('helpers.alpha_scheduler.acquire')
+    quote_cache.set('IBM', Quote('IBM', '300.0000', datetime.date(2025, 11, 5)), ttl=0)
+
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+    mock_session.get.side_effect = asyncio.TimeoutError()
+
+    price = await check_stock_price('IBM', session=mock_session)
+
+    assert price == '300.0000'
+    assert mock_session.get.call_count == 3
+    assert alpha_retries.stats()['retries'] == 2
+    assert alpha_breaker.failures == 3
+
+async def test_check_stock_price_breaker_open(mocker):
+    from helpers import alpha_breaker
+
+    for _ in range(alpha_breaker.failure_threshold):
+        alpha_breaker.record_failure()
+
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+
+    assert await check_stock_price('IBM', session=mock_session) is None
+    mock_session.get.assert_not_called()
+    assert alpha_breaker.stats()['transitions'] == {'closed->open': 1}
+
+async def test_refresh_keeps_serving_cached_price(mocker):
+    import datetime
+    from helpers import refresh_stock_price
+    from market.scheduler import Priority
+    from market.store import Quote
+
+    old = Quote('IBM', '300.0000', datetime.date(2025, 11, 5))
+    new = Quote('IBM', '312.4200', datetime.date(2025, 11, 6))
+    quote_cache.set('IBM', old, ttl=60)
+    release = asyncio.Event()
+
+    async def load(ticker, session, priority):
+        assert priority == Priority.BACKGROUND
+        await release.wait()
+        return new
+
+    mocker.patch('helpers.price_store.get', return_value=None)
+    mocker.patch('helpers._load_quote', side_effect=load)
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+
+    refresh = asyncio.create_task(refresh_stock_price('IBM', mock_session))
+    await asyncio.sleep(0)
+    # The background load is still waiting; users get the cached price without joining it
+    assert await asyncio.wait_for(check_stock_price('IBM', session=mock_session), 0.1) == '300.0000'
+
+    release.set()
+    assert await refresh
+    assert quote_cache.get('IBM') == new
+
+
+async def test_log_quote_metrics_warns_while_degraded(mocker, caplog):
+    import logging
+    from helpers import alpha_breaker, log_quote_metrics
+
+    for _ in range(alpha_breaker.failure_threshold):
+        alpha_breaker.record_failure()
+
+    with caplog.at_level(logging.INFO):
+        task = asyncio.create_task(log_quote_metrics(0.01))
+        await asyncio.sleep(0.03)
+        task.cancel()
+
+    record = caplog.records[-1]
+    assert record.levelno == logging.WARNING
+    assert 'degraded' in record.getMessage() and "'state': 'open'" in record.getMessage()
+
+
+async def test_get_prices(mocker):
+    import datetime
+    from market.store import Quote
+
+    quote_cache.set('AAPL', Quote('AAPL', '270.1400', datetime.date(2025, 11, 6)))
+    mock_check_price = mocker.patch('helpers.check_stock_price', side_effect=lambda symbol, *args, **kwargs: {'IBM': '312.4200'}.get(symbol))
+    mock_session = mocker.AsyncMock(spec=aiohttp.ClientSession)
+
+    prices = await get_prices(['aapl', 'IBM', 'ibm', 'XXXX', 'AAPL'], mock_session)
+
+    assert prices == {'AAPL': '270.1400', 'IBM': '312.4200', 'XXXX': None}
+    assert sorted(call.args[0] for call in mock_check_price.call_args_list) == ['IBM', 'XXXX']
 
 async def test_calc_profit(mocker, db):
     USER_ID = 1
@@ -144,7 +320,7 @@ async def test_fetch_stock_data(mocker, db):
 
     mock_response = mocker.AsyncMock()
     mock_response.status = 200
-    mock_response.json.return_value = json_response
+    mock_response.read.return_value = json.dumps(json_response).encode()
 
     mock_get_context = mocker.AsyncMock()
     mock_get_context.__aenter__.return_value = mock_response
@@ -206,12 +382,3 @@ async def test_username_db_check_callback(mocker, db):
         data = await query.fetchone()
 
     assert data[0] == 1
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,442 @@
+import asyncio
+import datetime
+import json
+
+import aiosqlite
+import pytest
+
+from database.migrations import migrate
+from database.pool import ReaderPool, open_writer
+from database.trading import transaction
+from market.breaker import CircuitBreaker, RetryBudget, backoff_delay
+from market.cache import QuoteCache
+from market.decode import DailySeriesReader, latest_close
+from market.history import Bar, HistoryStore
+from market.refresher import PriceRefresher
+from market.universe import SymbolUniverse
+from market.keys import KeyPool, bench_window, rate_limit_note
+from market.scheduler import Priority, QueueTimeout, RequestScheduler
+from market.calendar import holidays, is_trading_day, next_trading_day, quote_expiry, NEW_YORK
+from market.store import PriceStore, Quote
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def test_quote_cache_ttl():
+    clock = FakeClock()
+    cache = QuoteCache(ttl=60, clock=clock)
+    loader_calls = 0
+
+    async def loader():
+        nonlocal loader_calls
+        loader_calls += 1
+        return '312.4200'
+
+    assert await cache.get_or_fetch('IBM', loader) == '312.4200'
+    clock.now = 59
+    assert await cache.get_or_fetch('IBM', loader) == '312.4200'
+    clock.now = 61
+    assert await cache.get_or_fetch('IBM', loader) == '312.4200'
+
+    assert loader_calls == 2
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2, 'coalesced': 0}
+
+
+async def test_quote_cache_lru_eviction():
+    cache = QuoteCache(ttl=60, maxsize=2)
+
+    cache.set('AAPL', '1')
+    cache.set('IBM', '2')
+    cache.get('AAPL')
+    cache.set('TSLA', '3')
+
+    assert cache.get('IBM') is None
+    assert cache.get('AAPL') == '1'
+    assert cache.get('TSLA') == '3'
+
+
+async def test_quote_cache_single_flight():
+    cache = QuoteCache(ttl=60)
+    release = asyncio.Event()
+    loader_calls = 0
+
+    async def loader():
+        nonlocal loader_calls
+        loader_calls += 1
+        await release.wait()
+        return '100.00'
+
+    tasks = [asyncio.create_task(cache.get_or_fetch('AAPL', loader)) for _ in range(10)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*tasks) == ['100.00'] * 10
+    assert loader_calls == 1
+    assert cache.misses == 1
+    assert cache.coalesced == 9
+
+
+async def test_quote_cache_leader_cancelled():
+    cache = QuoteCache(ttl=60)
+    loader_calls = 0
+
+    async def loader():
+        nonlocal loader_calls
+        loader_calls += 1
+        await asyncio.sleep(0.01)
+        return '100.00'
+
+    leader = asyncio.create_task(cache.get_or_fetch('AAPL', loader))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(cache.get_or_fetch('AAPL', loader)) for _ in range(5)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    # The waiters were not cancelled: one of them loads again for all
+    assert await asyncio.gather(*waiters) == ['100.00'] * 5
+    assert leader.cancelled()
+    assert loader_calls == 2
+
+
+async def test_quote_cache_does_not_store_failures():
+    cache = QuoteCache(ttl=60)
+
+    async def failing_loader():
+        return None
+
+    assert await cache.get_or_fetch('XXXX', failing_loader) is None
+    assert len(cache) == 0
+
+
+async def test_nyse_holidays():
+    assert holidays(2025) == {
+        datetime.date(2025, 1, 1), datetime.date(2025, 1, 20), datetime.date(2025, 2, 17),
+        datetime.date(2025, 4, 18), datetime.date(2025, 5, 26), datetime.date(2025, 6, 19),
+        datetime.date(2025, 7, 4), datetime.date(2025, 9, 1), datetime.date(2025, 11, 27),
+        datetime.date(2025, 12, 25),
+    }
+    # Independence Day on Saturday is observed on Friday
+    assert datetime.date(2026, 7, 3) in holidays(2026)
+    # New Year's Day on Saturday is not observed at all
+    assert datetime.date(2021, 12, 31) not in holidays(2021)
+    assert datetime.date(2022, 1, 1) not in holidays(2022)
+
+
+async def test_quote_expiry():
+    # Friday close stays current over the weekend until Monday's close
+    assert quote_expiry(datetime.date(2025, 11, 7)) == datetime.datetime(2025, 11, 10, 16, 20, tzinfo=NEW_YORK)
+    # Wednesday before Thanksgiving is superseded by the early close on Friday
+    assert quote_expiry(datetime.date(2025, 11, 26)) == datetime.datetime(2025, 11, 28, 13, 20, tzinfo=NEW_YORK)
+    assert not is_trading_day(datetime.date(2025, 11, 27))
+    assert next_trading_day(datetime.date(2025, 12, 24)) == datetime.date(2025, 12, 26)
+
+
+async def test_price_store(tmp_path):
+    path = str(tmp_path / 'bot_db.db')
+    writer = await open_writer(path)
+    await migrate(writer)
+
+    today = datetime.datetime.now(NEW_YORK).date()
+    fresh = Quote('AAPL', '270.1400', today)
+    stale = Quote('IBM', '312.4200', today - datetime.timedelta(days=10))
+
+    readers = ReaderPool(path, size=1)
+    await readers.open()
+    store = PriceStore()
+    try:
+        await store.open(writer, readers)
+        # Writes queue behind a transaction on the writer instead of running into SQLITE_BUSY
+        async with transaction(writer):
+            put = asyncio.create_task(store.put(fresh))
+            await asyncio.sleep(0.01)
+            assert not put.done()
+        await put
+        await store.put(stale)
+
+        assert await store.get('AAPL') == fresh
+        assert await store.get('IBM') is None
+        assert await store.load() == [fresh]
+        assert readers.stats()['acquired'] == 3
+    finally:
+        await store.close()
+        await readers.close()
+        await writer.close()
+
+
+async def test_scheduler_priority_order():
+    scheduler = RequestScheduler(rate=50, burst=1)
+    await scheduler.acquire()
+    served = []
+
+    async def request(name, priority):
+        await scheduler.acquire(priority)
+        served.append(name)
+
+    tasks = [
+        asyncio.create_task(request('background', Priority.BACKGROUND)),
+        asyncio.create_task(request('portfolio', Priority.PORTFOLIO)),
+        asyncio.create_task(request('interactive', Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.stats()['depth'] == 3
+
+    await asyncio.gather(*tasks)
+
+    assert served == ['interactive', 'portfolio', 'background']
+    stats = scheduler.stats()
+    assert stats['peak_depth'] == 3
+    assert stats['by_priority']['interactive']['granted'] == 2
+    assert stats['by_priority']['background']['max_wait'] > 0
+
+
+async def test_scheduler_queue_timeout():
+    scheduler = RequestScheduler(rate=0.01, burst=1, max_wait=0.05)
+    await scheduler.acquire()
+
+    with pytest.raises(QueueTimeout):
+        await scheduler.acquire(Priority.BACKGROUND)
+
+    assert scheduler.stats()['by_priority']['background']['timeouts'] == 1
+    assert scheduler.depth == 0
+
+
+async def test_key_pool_rotation():
+    clock = FakeClock()
+    pool = KeyPool(['KEY1', 'KEY2', 'KEY3'], clock=clock)
+
+    used = []
+    for _ in range(6):
+        clock.now += 1
+        used.append(pool.acquire())
+    assert used == ['KEY1', 'KEY2', 'KEY3', 'KEY1', 'KEY2', 'KEY3']
+
+    pool.bench('KEY1', 60)
+    clock.now += 1
+    assert [pool.acquire(), pool.acquire()] == ['KEY2', 'KEY3']
+    assert pool.available == 2
+
+    clock.now += 60
+    assert pool.acquire() == 'KEY1'
+    assert pool.stats()['...KEY1'] == {'requests': 3, 'rate_limited': 1, 'benched_for': 0.0}
+
+
+async def test_rate_limit_note():
+    minute = {'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute and 500 calls per day.'}
+    day = {'Information': 'We have detected your API key as XXXX and our standard API rate limit is 25 requests per day.'}
+
+    assert rate_limit_note(minute) == minute['Note']
+    assert rate_limit_note(day) == day['Information']
+    assert rate_limit_note({'Error Message': 'Invalid API call.'}) is None
+    assert bench_window(minute['Note']) == 60.0
+    assert 0 < bench_window(day['Information']) <= 24 * 3600
+
+
+async def test_price_refresher(db):
+    await db.executemany('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)', [
+        (1, 'IBM', 1), (1, 'AAPL', 5), (2, 'AAPL', 1), (3, 'AAPL', 2), (2, 'TSLA', 3), (3, 'TSLA', 1),
+    ])
+    await db.commit()
+
+    refreshed = []
+
+    async def refresh(symbol):
+        refreshed.append(symbol)
+        return symbol != 'TSLA'
+
+    refresher = PriceRefresher(db, refresh=refresh, is_warm=lambda symbol: symbol == 'IBM', interval=60, spacing=0)
+
+    assert await refresher.held_symbols() == ['AAPL', 'TSLA', 'IBM']
+    assert await refresher.refresh_once() == 2
+    assert refreshed == ['AAPL', 'TSLA']
+    assert refresher.stats()['api_calls'] == 1
+
+
+
+async def test_price_refresher_reads_through_pool(tmp_path):
+    path = str(tmp_path / 'bot_db.db')
+    writer = await open_writer(path)
+    await migrate(writer)
+    await writer.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(1, 'one'), (2, 'two')])
+    await writer.execute('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)', (1, 'IBM', 1))
+    await writer.commit()
+
+    readers = ReaderPool(path, size=1)
+    await readers.open()
+    try:
+        async def refresh(symbol):
+            return False
+
+        refresher = PriceRefresher(writer, refresh=refresh, is_warm=lambda symbol: False, interval=60, spacing=0,
+                                   readers=readers)
+        # A pass sees committed holdings only, not a trade still open on the writer
+        async with transaction(writer):
+            await writer.execute('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)', (2, 'AAPL', 1))
+            assert await refresher.held_symbols() == ['IBM']
+        assert readers.stats()['acquired'] == 1
+    finally:
+        await readers.close()
+        await writer.close()
+
+LISTING_CSV = """symbol,name,exchange,assetType,ipoDate,delistingDate,status
+A,Agilent Technologies Inc,NYSE,Stock,1999-11-18,null,Active
+AAPL,Apple Inc,NASDAQ,Stock,1980-12-12,null,Active
+AAL,American Airlines Group Inc,NASDAQ,Stock,2005-09-27,null,Active
+IBM,International Business Machines Corp,NYSE,Stock,1962-01-02,null,Active
+OLDCO,Old Company,NYSE,Stock,1990-01-02,2020-01-02,Delisted
+"""
+
+
+async def test_symbol_universe_index():
+    universe = SymbolUniverse()
+    assert universe.could_exist('ZZZZ')
+
+    assert universe.load_csv(LISTING_CSV) == 4
+    assert 'aapl' in universe
+    assert 'OLDCO' not in universe
+    assert universe.with_prefix('aa') == ['AAL', 'AAPL']
+    assert universe.with_prefix('A', limit=2) == ['A', 'AAL']
+    assert universe.could_exist('IBM')
+    assert not universe.could_exist('ZZZZ')
+
+
+async def test_symbol_universe_negative_cache():
+    clock = FakeClock()
+    universe = SymbolUniverse(reject_ttl=60, clock=clock)
+
+    universe.reject('qwer')
+    assert not universe.could_exist('QWER')
+
+    clock.now = 61
+    assert universe.could_exist('QWER')
+
+
+async def test_symbol_universe_refresh(tmp_path):
+    path = str(tmp_path / 'listing_status.csv')
+    universe = SymbolUniverse()
+
+    async def fetch_csv():
+        return LISTING_CSV
+
+    async def fetch_failed():
+        return None
+
+    assert await universe.refresh(fetch_csv, path) == 4
+    assert await universe.refresh(fetch_failed, path) == 0
+    assert len(universe) == 4
+
+    reloaded = SymbolUniverse()
+    assert reloaded.load_file(path) == 4
+    assert reloaded.load_file(str(tmp_path / 'missing.csv')) == 0
+
+
+async def test_circuit_breaker_transitions():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    clock.now = 31
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.now = 62
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.stats()['transitions'] == {'closed->open': 1, 'open->half_open': 2, 'half_open->open': 1, 'half_open->closed': 1}
+
+
+async def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.stats() == {'balance': 0.0, 'retries': 3, 'denied': 1}
+
+    assert all(0 <= backoff_delay(attempt, base=0.5, cap=5) <= min(5, 0.5 * 2 ** (attempt - 1)) for attempt in range(1, 8))
+
+
+def daily_payload(dates, last_refreshed=None):
+    return json.dumps({
+        'Meta Data': {'2. Symbol': 'IBM', '3. Last Refreshed': last_refreshed or dates[0]},
+        'Time Series (Daily)': {
+            date: {'1. open': '1.0', '4. close': f'{100 + i}.0000', '5. volume': '10'}
+            for i, date in enumerate(dates)
+        },
+    }, indent=4).encode()
+
+
+async def test_latest_close_reads_only_newest_entry():
+    raw = daily_payload(['2025-11-06', '2025-11-05', '2025-11-04'])
+    reader = DailySeriesReader(raw)
+
+    first = next(iter(reader))
+    assert first == ('2025-11-06', {'1. open': '1.0', '4. close': '100.0000', '5. volume': '10'})
+    assert reader.meta['3. Last Refreshed'] == '2025-11-06'
+    assert reader.position < len(raw) / 2
+
+    assert latest_close(raw) == ('2025-11-06', '100.0000')
+    assert [date for date, _ in DailySeriesReader(raw)] == ['2025-11-06', '2025-11-05', '2025-11-04']
+
+
+async def test_latest_close_falls_back_to_full_parse():
+    # First entry is not the last refreshed day, so the order can't be trusted
+    raw = daily_payload(['2025-11-04', '2025-11-06', '2025-11-05'], last_refreshed='2025-11-06')
+    assert latest_close(raw) == ('2025-11-06', '101.0000')
+
+    assert latest_close(b'{"Information": "demo"}') is None
+
+
+def bar(day, close):
+    return Bar(datetime.date(2025, 11, day), close - 1, close + 1, close - 2, close, 1000 * day)
+
+
+async def test_history_store_appends_and_persists(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    assert store.last_date('IBM') is None
+
+    assert store.append('IBM', [bar(4, 100.0), bar(3, 99.0)]) == 2
+    # Already stored days are skipped, only newer ones are appended
+    assert store.append('ibm', [bar(5, 101.0), bar(4, 100.0)]) == 1
+    assert store.last_date('IBM') == datetime.date(2025, 11, 5)
+
+    reopened = HistoryStore(str(tmp_path))
+    assert reopened.range('IBM') == [bar(3, 99.0), bar(4, 100.0), bar(5, 101.0)]
+
+
+async def test_history_store_queries(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append('IBM', [bar(day, 100.0 + day) for day in range(3, 11)])
+
+    assert [b.date.day for b in store.range('IBM', datetime.date(2025, 11, 5), datetime.date(2025, 11, 7))] == [5, 6, 7]
+    assert [b.date.day for b in store.range('IBM', start=datetime.date(2025, 11, 9))] == [9, 10]
+    assert store.closes('IBM', 3) == [108.0, 109.0, 110.0]
+    assert store.moving_average('IBM', 4) == 108.5
+    assert store.moving_average('IBM', 20) is None
+    assert store.percent_change('IBM') == pytest.approx((110 / 109 - 1) * 100)
+    assert store.percent_change('MSFT') is None
+
+
+async def test_history_store_ignores_corrupt_file(tmp_path):
+    (tmp_path / 'IBM.bars').write_bytes(b'garbage')
+    store = HistoryStore(str(tmp_path))
+    assert store.range('IBM') == []
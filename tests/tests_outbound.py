@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from aiogram.methods import AnswerCallbackQuery, DeleteMessage, EditMessageText, GetUpdates, SendMessage
+
+from bot.outbound import OutboundScheduler, outbound_priority
+from market.scheduler import Priority, QueueTimeout
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeSession:
+    """Stands in for the HTTP call at the end of the middleware chain and records what got through."""
+
+    def __init__(self):
+        self.calls: list[tuple[object, float]] = []
+
+    async def __call__(self, bot, method):
+        self.calls.append((method, time.monotonic()))
+        return True
+
+
+async def call(outbound: OutboundScheduler, session: FakeSession, method, priority: Priority = Priority.INTERACTIVE):
+    with outbound_priority(priority):
+        return await outbound(session, None, method)
+
+
+async def test_outbound_interactive_goes_ahead_of_bulk():
+    outbound = OutboundScheduler(rate=50, burst=1, chat_burst=1)
+    session = FakeSession()
+
+    bulk = [asyncio.create_task(call(outbound, session, SendMessage(chat_id=100 + i, text='news'), Priority.BACKGROUND))
+            for i in range(10)]
+    await asyncio.sleep(0)
+    reply = asyncio.create_task(call(outbound, session, SendMessage(chat_id=1, text='reply')))
+    await asyncio.gather(reply, *bulk)
+
+    order = [method.chat_id for method, _ in session.calls]
+    # The first bulk call took the only token; the reply was next although it came last
+    assert order.index(1) <= 1
+    stats = outbound.stats()['by_priority']
+    assert stats['interactive']['calls'] == 1 and stats['background']['calls'] == 10
+    assert stats['background']['max_wait'] > stats['interactive']['max_wait']
+
+
+async def test_outbound_per_chat_limit():
+    outbound = OutboundScheduler(rate=1000, burst=100, chat_rate=20, chat_burst=2)
+    session = FakeSession()
+
+    started = time.monotonic()
+    await asyncio.gather(*(call(outbound, session, SendMessage(chat_id=1, text=str(i))) for i in range(6)))
+    one_chat = time.monotonic() - started
+
+    started = time.monotonic()
+    await asyncio.gather(*(call(outbound, session, SendMessage(chat_id=10 + i, text=str(i))) for i in range(6)))
+    many_chats = time.monotonic() - started
+
+    # Two at once, then 20 per second: four more take 0.2s; different chats do not wait on each other
+    assert 0.15 < one_chat < 0.5
+    assert many_chats < 0.05
+
+
+async def test_outbound_edits_and_deletes_skip_chat_limit():
+    outbound = OutboundScheduler(rate=1000, burst=100, chat_rate=1, chat_burst=1, timeout=0.1)
+    session = FakeSession()
+
+    await call(outbound, session, SendMessage(chat_id=1, text='menu'))
+    # The chat's only send token is spent; menu edits and cleanup deletions still go through
+    await call(outbound, session, EditMessageText(chat_id=1, message_id=1, text='menu 2'))
+    await call(outbound, session, DeleteMessage(chat_id=1, message_id=1))
+    with pytest.raises(QueueTimeout):
+        await call(outbound, session, SendMessage(chat_id=1, text='again'))
+    assert len(session.calls) == 3
+
+
+async def test_outbound_groups_and_calls_without_chat():
+    outbound = OutboundScheduler(rate=1000, burst=100, group_rate=1, timeout=0.1)
+    session = FakeSession()
+
+    await call(outbound, session, SendMessage(chat_id=-100, text='first'))
+    with pytest.raises(QueueTimeout):
+        await call(outbound, session, SendMessage(chat_id=-100, text='second'))
+    assert outbound.stats()['by_priority']['interactive']['timeouts'] == 1
+
+    # No chat: only the global bucket applies. Polling is never held back
+    await call(outbound, session, AnswerCallbackQuery(callback_query_id='1'))
+    outbound.scheduler = type(outbound.scheduler)(rate=0.001, burst=1, max_wait=0.05)
+    await call(outbound, session, GetUpdates())
+    assert len(session.calls) == 3
+
+
+async def test_outbound_drops_idle_chat_buckets():
+    outbound = OutboundScheduler(rate=1000, burst=100, chat_rate=1000, max_chats=10)
+    session = FakeSession()
+
+    for chat_id in range(1, 30):
+        await call(outbound, session, SendMessage(chat_id=chat_id, text='hi'))
+        await asyncio.sleep(0.002)
+
+    assert outbound.stats()['chats'] <= 10
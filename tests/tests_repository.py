@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from database.pool import ReaderPool, open_writer
+from database.migrations import migrate
+from database.repository import Repository
+from helpers import calc_profit
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_portfolio(db, repo):
+    rng = random.Random(5)
+    await db.execute('INSERT INTO users (id, username, cash) VALUES (?, ?, ?)', (1, 'test', 1234.5))
+    held = {'AAPL': 0, 'IBM': 0, 'MSFT': 0}
+    for _ in range(200):
+        stock = rng.choice(list(held))
+        quantity = rng.randint(1, 20) if rng.random() < 0.6 or not held[stock] else -rng.randint(1, held[stock])
+        held[stock] += quantity
+        await db.execute('INSERT INTO history (user_id, stock, price, quantity) VALUES (?, ?, ?, ?)',
+                         (1, stock, round(rng.uniform(10, 500), 2), quantity))
+    await db.executemany('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)',
+                         [(1, stock, quantity) for stock, quantity in held.items() if quantity])
+    # A stored cost basis is used as is
+    await db.execute("UPDATE user_savings SET cost_basis = 42 WHERE stock = 'MSFT'")
+    await db.commit()
+
+    cash, holdings = await repo.portfolio(1)
+
+    assert cash == 1234.5
+    assert [stock for stock, _, _ in holdings] == sorted(stock for stock, quantity in held.items() if quantity)
+    for stock, quantity, cost_basis in holdings:
+        assert quantity == held[stock]
+        assert cost_basis == pytest.approx(await calc_profit(1, quantity, stock, db))
+
+    await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (2, 'empty'))
+    assert await repo.portfolio(2) == (10000, [])
+    assert await repo.portfolio(3) is None
+
+
+async def test_users_page(db, repo):
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(user_id, f'user{user_id}') for user_id in range(1, 8)])
+    await db.commit()
+
+    first, has_prev, has_next = await repo.users_page(limit=3)
+    assert [row[0] for row in first] == [1, 2, 3] and (has_prev, has_next) == (False, True)
+
+    last, has_prev, has_next = await repo.users_page(after=6, limit=3)
+    assert [row[0] for row in last] == [7] and (has_prev, has_next) == (True, False)
+
+    # Going back from the last page lands on the page right before it
+    previous, has_prev, has_next = await repo.users_page(before=7, limit=3)
+    assert [row[0] for row in previous] == [4, 5, 6] and (has_prev, has_next) == (True, True)
+
+    start, has_prev, _ = await repo.users_page(before=3, limit=3)
+    assert [row[0] for row in start] == [1, 2] and not has_prev
+    assert await repo.count_users() == 7
+
+
+async def test_user_report_latest_history(db, repo):
+    await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (1, 'test'))
+    await db.execute('INSERT INTO user_savings (user_id, stock, quantity) VALUES (?, ?, ?)', (1, 'AAPL', 36))
+    await db.executemany('INSERT INTO history (user_id, stock, price, quantity, time) VALUES (?, ?, ?, ?, ?)',
+                         [(1, 'AAPL', 100, quantity, f'2024-01-0{quantity} 10:00:00') for quantity in range(1, 9)])
+    await db.commit()
+
+    report = await repo.user_report(username='test', history_limit=3)
+    assert report['user_info']['cash'] == '10,000.00'
+    assert report['savings'] == [('AAPL', 36)]
+    assert [row[3] for row in report['history']] == [6, 7, 8]
+
+    assert await repo.user_report(user_id=1) == await repo.user_report(username='test')
+    assert await repo.user_report(user_id=2) is None
+    assert await repo.user_report() is None
+
+
+async def test_user_report_history_includes_archive(db, repo):
+    await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (1, 'test'))
+    # An open buy kept in history, the closed trades around it moved to the archive by compaction
+    await db.execute("INSERT INTO history (id, user_id, stock, price, quantity, time) VALUES (2, 1, 'AAPL', 100, 5, '2024-01-02')")
+    await db.executemany('INSERT INTO history_archive (id, user_id, stock, price, quantity, time) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(1, 1, 'TSLA', 200, 3, '2024-01-01'), (3, 1, 'TSLA', 210, -3, '2024-01-03'),
+                          (4, 2, 'TSLA', 210, 1, '2024-01-04')])
+    await db.commit()
+
+    report = await repo.user_report(user_id=1, history_limit=2)
+    assert [(row[0], row[3]) for row in report['history']] == [(2, 5), (3, -3)]
+    report = await repo.user_report(user_id=1, history_limit=5)
+    assert [row[0] for row in report['history']] == [1, 2, 3]
+
+
+async def test_reads_go_to_reader_pool(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    writer = await open_writer(path)
+    await migrate(writer)
+    await writer.execute('INSERT INTO users (id, username) VALUES (?, ?)', (1, 'test'))
+    await writer.commit()
+
+    readers = ReaderPool(path, size=1)
+    await readers.open()
+    try:
+        repo = Repository(writer, readers)
+        assert await repo.cash(1) == 10000
+        assert await repo.user_report(user_id=1)
+        assert readers.stats()['acquired'] == 2
+    finally:
+        await readers.close()
+        await writer.close()
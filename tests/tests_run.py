@@ -0,0 +1,51 @@
+import aiosqlite
+import pytest
+
+from aiogram import Bot, Dispatcher
+
+import run
+from bot.admin import admin_router
+from bot.handlers import form_router
+from database.migrations import MIGRATIONS
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def startup(mocker, tmp_path):
+    """Runs `run.main` against a fresh database file, with the network calls of startup stubbed."""
+    path = str(tmp_path / 'bot.db')
+    mocker.patch.object(run, 'DB_PATH', path)
+    mocker.patch.object(run, 'SYMBOL_LIST_PATH', str(tmp_path / 'listing.csv'))
+    mocker.patch.object(run, 'TOKEN', '42:TEST')
+    mocker.patch.object(run, 'fetch_listing_csv', mocker.AsyncMock(return_value=None))
+    yield path
+    # The routers are module level and may only be attached to one dispatcher
+    for router in (admin_router, form_router):
+        router._parent_router = None
+
+
+async def test_main_starts_polling_and_shuts_down(startup, mocker):
+    delete_webhook = mocker.patch.object(Bot, 'delete_webhook', mocker.AsyncMock())
+    start_polling = mocker.patch.object(Dispatcher, 'start_polling', mocker.AsyncMock())
+
+    await run.main()
+
+    delete_webhook.assert_awaited_once()
+    start_polling.assert_awaited_once()
+    async with aiosqlite.connect(startup) as db, db.execute('PRAGMA user_version') as query:
+        assert (await query.fetchone())[0] == len(MIGRATIONS)
+
+
+async def test_main_serves_webhook_when_configured(startup, mocker):
+    mocker.patch.object(run, 'WEBHOOK_URL', 'https://bot.example.com')
+    run_webhook = mocker.patch.object(run, 'run_webhook', mocker.AsyncMock())
+    start_polling = mocker.patch.object(Dispatcher, 'start_polling', mocker.AsyncMock())
+
+    await run.main()
+
+    start_polling.assert_not_awaited()
+    args = run_webhook.await_args.args
+    assert args[2:6] == ('https://bot.example.com', run.WEBHOOK_PATH, run.WEBHOOK_HOST, run.WEBHOOK_PORT)
+    # A random secret when none is configured
+    assert len(args[6]) >= 32
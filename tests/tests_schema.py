@@ -0,0 +1,107 @@
+import aiosqlite
+import pytest
+
+from database import broadcasts, compaction, repository
+from database.migrations import MIGRATIONS, migrate, schema_version
+
+pytestmark = pytest.mark.asyncio
+
+# Queries run per request, with the parameters they are called with. Each of them has to be
+# answered from an index: a SCAN or a temporary sort grows with the total number of trades
+HOT_QUERIES = {
+    'calc_profit': ("""SELECT quantity, price FROM history
+                       WHERE user_id = ? AND stock = ? AND quantity > 0
+                       ORDER BY id DESC""", (1, 'AAPL')),
+    'cost_basis': ('SELECT quantity, cost_basis FROM user_savings WHERE user_id = ? AND stock = ?', (1, 'AAPL')),
+    'sell_lots': ('SELECT id, quantity, price FROM lots WHERE user_id = ? AND stock = ? ORDER BY id', (1, 'AAPL')),
+    'sell_check': ('SELECT quantity FROM user_savings WHERE user_id = ? AND stock = ?', (1, 'AAPL')),
+    'delete_history': ('DELETE FROM history WHERE user_id = ?', (1,)),
+    'price_store': ('SELECT symbol, price, as_of FROM prices WHERE symbol = ?', ('AAPL',)),
+    'broadcast_pending': (broadcasts._PENDING, (0, None, 1, 200)),
+    'reprobe_unreachable': ('UPDATE users SET unreachable_since = NULL WHERE unreachable_since < ?', ('2026-01-01 00:00:00',)),
+    'broadcast_resume': ('SELECT id FROM broadcast_jobs WHERE state = ? ORDER BY id', ('running',)),
+    'compaction_last_old': (compaction._LAST_OLD, ('2026-01-01 00:00:00',)),
+    'compaction_movable': (compaction._MOVABLE, (0, 1000, '2026-01-01 00:00:00', 500)),
+    'delete_broadcast_recipients': ('DELETE FROM broadcast_recipients WHERE user_id = ?', (1,)),
+}
+
+
+# Read side statements of the repository, with the parameters they are called with
+REPOSITORY_QUERIES = {
+    'user': (repository.USER, {'user_id': 1}),
+    'user_by_username': (repository.USER_BY_USERNAME, {'username': 'test'}),
+    'cash': (repository.CASH, {'user_id': 1}),
+    'holdings': (repository.HOLDINGS, {'user_id': 1}),
+    'holding': (repository.HOLDING, {'user_id': 1, 'stock': 'AAPL'}),
+    'users_after': (repository.USERS_AFTER, {'after': 0, 'limit': 21}),
+    'users_before': (repository.USERS_BEFORE, {'before': 100, 'limit': 21}),
+    'recent_history': (repository.RECENT_HISTORY, {'user_id': 1, 'limit': 5}),
+}
+for name, (statement, values) in REPOSITORY_QUERIES.items():
+    sql, names, defaults = repository.compiled(statement)
+    HOT_QUERIES[f'repository_{name}'] = (sql, [values.get(key, defaults.get(key)) for key in names])
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+async def test_hot_query_uses_index(db, name):
+    sql, params = HOT_QUERIES[name]
+
+    async with db.execute(f'EXPLAIN QUERY PLAN {sql}', params) as query:
+        plan = [row[3] for row in await query.fetchall()]
+
+    assert plan
+    assert not [step for step in plan if step.startswith('SCAN') or 'TEMP B-TREE' in step], plan
+
+
+async def test_portfolio_query_searches_base_tables(db):
+    # The portfolio is one query over per-user CTEs; scanning those is fine, scanning a table is not
+    sql, names, defaults = repository.compiled(repository.PORTFOLIO)
+    params = [1 if key == 'user_id' else defaults[key] for key in names]
+
+    async with db.execute(f'EXPLAIN QUERY PLAN {sql}', params) as query:
+        plan = [row[3] for row in await query.fetchall()]
+
+    tables = {'users', 'user_savings', 'history', 'lots', 'prices'}
+    assert not [step for step in plan if step.startswith('SCAN') and step.split()[1] in tables], plan
+
+
+async def test_migrate_applies_only_pending_steps(db):
+    assert await schema_version(db) == len(MIGRATIONS)
+    assert await migrate(db) == 0
+
+    async def broken(conn):
+        await conn.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('broken step')
+
+    # A failing step is rolled back together with its version bump
+    with pytest.raises(RuntimeError):
+        await migrate(db, MIGRATIONS + [('broken', broken)])
+    assert await schema_version(db) == len(MIGRATIONS)
+    async with db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'half_done'") as query:
+        assert (await query.fetchone())[0] == 0
+
+    with pytest.raises(RuntimeError):
+        await migrate(db, MIGRATIONS[:1])
+
+
+async def test_migrate_adopts_unversioned_database():
+    # A database created by the old startup code: no version, no indexes, no cost basis
+    async with aiosqlite.connect(':memory:') as db:
+        await db.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY NOT NULL, cash NUMERIC NOT NULL DEFAULT 10000.00,
+                                created DATE NOT NULL DEFAULT (date()), username TEXT null on conflict ignore);
+            CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, stock TEXT NOT NULL,
+                                  price NUMERIC NOT NULL, quantity INTEGER NOT NULL, time NUMERIC DEFAULT (datetime('now')));
+            CREATE TABLE user_savings (user_id INTEGER NOT NULL, stock TEXT NOT NULL, quantity INTEGER NOT NULL,
+                                       PRIMARY KEY (user_id, stock));
+            INSERT INTO users (id, username) VALUES (1, 'test');
+            INSERT INTO history (user_id, stock, price, quantity) VALUES (1, 'AAPL', 100, 4), (1, 'AAPL', 110, -2), (1, 'AAPL', 120, 3);
+            INSERT INTO user_savings (user_id, stock, quantity) VALUES (1, 'AAPL', 5);
+        """)
+
+        assert await migrate(db) == len(MIGRATIONS)
+
+        async with db.execute('SELECT quantity, cost_basis FROM user_savings') as query:
+            assert await query.fetchone() == (5, 3 * 120 + 2 * 100)
+        async with db.execute('SELECT quantity, price FROM lots ORDER BY id') as query:
+            assert await query.fetchall() == [(2, 100), (3, 120)]
@@ -0,0 +1,278 @@
+import asyncio
+import datetime
+import random
+
+import pytest
+
+from database.compaction import HistoryCompactor, compact_history
+from database.migrations import migrate
+from database.pool import ReaderPool, open_writer, read_connection
+from database.trading import NotEnoughCash, NotEnoughShares, backfill_cost_basis, buy_stock, delete_user, sell_stock, trade_writer, transaction
+from database.repository import Repository
+from helpers import calc_profit
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_transaction_isolates_concurrent_units(db):
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(1, 'one'), (2, 'two')])
+    await db.commit()
+
+    async def slow_buy():
+        async with transaction(db):
+            await db.execute('UPDATE users SET cash = cash - 100 WHERE id = 1')
+            await asyncio.sleep(0.01)
+            await db.execute('UPDATE users SET cash = cash - 100 WHERE id = 1')
+
+    async def failing_trade():
+        await asyncio.sleep(0.001)
+        async with transaction(db):
+            await db.execute('UPDATE users SET cash = cash - 500 WHERE id = 2')
+            raise RuntimeError('boom')
+
+    results = await asyncio.gather(slow_buy(), failing_trade(), return_exceptions=True)
+
+    # The rollback of user 2 must neither undo nor commit half of user 1's trade
+    assert results[0] is None and isinstance(results[1], RuntimeError)
+    async with db.execute('SELECT id, cash FROM users ORDER BY id') as query:
+        assert await query.fetchall() == [(1, 9800), (2, 10000)]
+
+
+async def test_buy_and_sell_checks_inside_transaction(db):
+    await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (1, 'test'))
+    await db.commit()
+
+    with pytest.raises(NotEnoughCash) as error:
+        await buy_stock(db, 1, 'AAPL', '2000.00', 6)
+    assert error.value.balance == 10000
+
+    assert await buy_stock(db, 1, 'AAPL', '100.00', 5) == 500
+    # Two sells of the same shares at once: only one of them can go through
+    results = await asyncio.gather(sell_stock(db, 1, 'AAPL', '100.00', 4), sell_stock(db, 1, 'AAPL', '100.00', 4),
+                                   return_exceptions=True)
+    assert sorted(type(result).__name__ for result in results) == ['NotEnoughShares', 'float']
+
+    async with db.execute('SELECT quantity FROM user_savings WHERE user_id = 1') as query:
+        assert (await query.fetchone())[0] == 1
+
+    await delete_user(db, 1)
+    async with db.execute('SELECT COUNT(*) FROM history') as query:
+        assert (await query.fetchone())[0] == 0
+
+
+async def test_concurrent_trades_keep_balances_consistent(db):
+    users, trades, price = 20, 400, 50
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(user_id, f'user{user_id}') for user_id in range(users)])
+    await db.commit()
+    trade_writer(db).reset()
+
+    rng = random.Random(7)
+
+    async def trade(user_id: int, amount: int, selling: bool):
+        await asyncio.sleep(rng.random() / 1000)
+        try:
+            if selling:
+                await sell_stock(db, user_id, 'AAPL', price, amount)
+            else:
+                await buy_stock(db, user_id, 'AAPL', price, amount)
+        except (NotEnoughCash, NotEnoughShares):
+            pass
+
+    await asyncio.gather(*(trade(rng.randrange(users), rng.randint(1, 60), rng.random() < 0.4) for _ in range(trades)))
+
+    async with db.execute("""SELECT u.id, u.cash, COALESCE(s.quantity, 0),
+                                    (SELECT COALESCE(SUM(quantity), 0) FROM history h WHERE h.user_id = u.id)
+                             FROM users u LEFT JOIN user_savings s ON s.user_id = u.id""") as query:
+        rows = await query.fetchall()
+
+    for user_id, cash, quantity, traded in rows:
+        # Every share is accounted for in the history and every dollar in the shares
+        assert quantity == traded >= 0
+        assert cash + quantity * price == 10000
+        assert cash >= 0
+
+    # Every trade got its own outcome, while concurrent trades shared commits
+    stats = trade_writer(db).stats()
+    assert stats['trades'] == trades
+    assert stats['batches'] < trades
+    assert stats['max_batch'] > 1
+
+
+async def test_reader_pool_reads_while_writer_is_in_transaction(tmp_path):
+    path = str(tmp_path / 'bot.db')
+    writer = await open_writer(path)
+    await migrate(writer)
+    await writer.execute('INSERT INTO users (id, username) VALUES (?, ?)', (1, 'test'))
+    await writer.commit()
+
+    readers = ReaderPool(path, size=2)
+    await readers.open()
+    try:
+        async with transaction(writer):
+            await writer.execute('UPDATE users SET cash = 0 WHERE id = 1')
+            # Readers are not blocked by the open write and only see committed data
+            async with read_connection(readers, writer) as reader, reader.execute('SELECT cash FROM users') as query:
+                assert (await query.fetchone())[0] == 10000
+
+        async with readers.connection() as reader:
+            async with reader.execute('SELECT cash FROM users') as query:
+                assert (await query.fetchone())[0] == 0
+            with pytest.raises(Exception):
+                await reader.execute('DELETE FROM users')
+
+        assert readers.stats()['acquired'] == 2
+        assert readers.stats()['idle'] == 2
+    finally:
+        await readers.close()
+        await writer.close()
+
+
+async def test_cost_basis_matches_history_walk(db):
+    await db.executemany('INSERT INTO users (id, username, cash) VALUES (?, ?, ?)', [(1, 'one', 10 ** 9), (2, 'two', 10 ** 9)])
+    await db.commit()
+
+    rng = random.Random(3)
+    for _ in range(300):
+        user_id, stock = rng.choice([1, 2]), rng.choice(['AAPL', 'IBM'])
+        price = f'{rng.uniform(10, 500):.2f}'
+        try:
+            if rng.random() < 0.45:
+                await sell_stock(db, user_id, stock, price, rng.randint(1, 30))
+            else:
+                await buy_stock(db, user_id, stock, price, rng.randint(1, 30))
+        except NotEnoughShares:
+            pass
+
+    async with db.execute('SELECT user_id, stock, quantity, cost_basis FROM user_savings') as query:
+        holdings = await query.fetchall()
+    assert holdings
+
+    # calc_profit serves the stored value; with the column cleared it walks the history as before
+    stored = {(user_id, stock): await calc_profit(user_id, quantity, stock, db) for user_id, stock, quantity, _ in holdings}
+    assert stored == {(user_id, stock): cost_basis for user_id, stock, _, cost_basis in holdings}
+
+    await db.execute('UPDATE user_savings SET cost_basis = NULL')
+    await db.execute('DELETE FROM lots')
+    await db.commit()
+    walked = {(user_id, stock): await calc_profit(user_id, quantity, stock, db) for user_id, stock, quantity, _ in holdings}
+    assert walked == pytest.approx(stored)
+
+    # The backfill rebuilds the same cost basis and lots, and trading continues from there
+    assert await backfill_cost_basis(db) == len(holdings)
+    assert await backfill_cost_basis(db) == 0
+    async with db.execute("""SELECT s.user_id, s.stock, s.cost_basis, SUM(l.quantity * l.price), SUM(l.quantity) - s.quantity
+                             FROM user_savings s JOIN lots l ON l.user_id = s.user_id AND l.stock = s.stock
+                             GROUP BY s.user_id, s.stock""") as query:
+        for user_id, stock, cost_basis, lots_cost, missing in await query.fetchall():
+            assert cost_basis == pytest.approx(stored[(user_id, stock)])
+            assert lots_cost == pytest.approx(cost_basis)
+            assert missing == 0
+
+
+async def test_group_commit_isolates_failing_trade(db):
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(1, 'one'), (2, 'two'), (3, 'three')])
+    await db.commit()
+    writer = trade_writer(db)
+    writer.reset()
+
+    async def broken(conn):
+        await conn.execute('UPDATE users SET cash = 0 WHERE id = 2')
+        raise ValueError('broken trade')
+
+    results = await asyncio.gather(buy_stock(db, 1, 'AAPL', '10.00', 5), writer.submit(broken), buy_stock(db, 3, 'IBM', '20.00', 1),
+                                   return_exceptions=True)
+
+    assert results[0] == 50 and results[2] == 20
+    assert isinstance(results[1], ValueError)
+    async with db.execute('SELECT id, cash FROM users ORDER BY id') as query:
+        assert await query.fetchall() == [(1, 9950), (2, 10000), (3, 9980)]
+    assert writer.stats()['batch_sizes'] == {3: 1}
+    assert writer.stats()['failed'] == 1
+
+
+async def test_group_commit_skips_cancelled_trade_in_stats(db):
+    await db.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(1, 'one'), (2, 'two')])
+    await db.commit()
+    writer = trade_writer(db)
+    writer.reset()
+
+    first = asyncio.create_task(buy_stock(db, 1, 'AAPL', '10.00', 5))
+    cancelled = asyncio.create_task(buy_stock(db, 2, 'IBM', '20.00', 1))
+    await asyncio.sleep(0)
+    # Gives up while the batch is still gathering, before its savepoint runs
+    cancelled.cancel()
+
+    assert await first == 50
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    async with db.execute('SELECT id, cash FROM users ORDER BY id') as query:
+        assert await query.fetchall() == [(1, 9950), (2, 10000)]
+    assert writer.stats()['trades'] == 1
+    assert writer.stats()['batch_sizes'] == {1: 1}
+
+
+async def test_compaction_keeps_portfolio_and_moves_closed_trades(db):
+    await db.executemany('INSERT INTO users (id, username, cash) VALUES (?, ?, ?)', [(1, 'one', 10 ** 9), (2, 'two', 10 ** 9)])
+    await db.commit()
+
+    rng = random.Random(5)
+    for _ in range(300):
+        user_id, stock = rng.choice([1, 2]), rng.choice(['AAPL', 'IBM', 'MSFT'])
+        try:
+            if rng.random() < 0.45:
+                await sell_stock(db, user_id, stock, f'{rng.uniform(10, 500):.2f}', rng.randint(1, 30))
+            else:
+                await buy_stock(db, user_id, stock, f'{rng.uniform(10, 500):.2f}', rng.randint(1, 30))
+        except NotEnoughShares:
+            pass
+    # Everything so far is old, the next trade is recent; one holding still needs its history walked
+    await db.execute("UPDATE history SET time = '2020-01-01 00:00:00'")
+    await db.execute('UPDATE user_savings SET cost_basis = NULL WHERE rowid = (SELECT MIN(rowid) FROM user_savings)')
+    await db.commit()
+    await buy_stock(db, 1, 'AAPL', '100.00', 1)
+
+    async with db.execute('SELECT user_id, stock, SUM(MAX(quantity, 0)), SUM(MAX(-quantity, 0) * price), COUNT(*) FROM history '
+                          'WHERE time < ? GROUP BY user_id, stock', ('2021-01-01',)) as query:
+        old = {(user_id, stock): rest for user_id, stock, *rest in await query.fetchall()}
+    async with db.execute('SELECT COUNT(*) FROM history') as query:
+        total = (await query.fetchone())[0]
+    repo = Repository(db)
+    before = {user_id: await repo.portfolio(user_id) for user_id in (1, 2)}
+
+    moved = await compact_history(db, datetime.datetime(2021, 1, 1), batch=50)
+    assert moved > 0
+    assert await compact_history(db, datetime.datetime(2021, 1, 1)) == 0
+
+    # Portfolio and profits come out the same from the smaller table
+    after = {user_id: await repo.portfolio(user_id) for user_id in (1, 2)}
+    assert after == before
+    for cash, holdings in after.values():
+        for stock, quantity, cost in holdings:
+            assert cost > 0
+
+    # What stayed is the recent trade and the purchases behind held shares
+    async with db.execute("""SELECT COUNT(*) FROM history h
+                             WHERE h.time >= '2021-01-01' OR EXISTS (SELECT 1 FROM lots l WHERE l.id = h.id)""") as query:
+        assert (await query.fetchone())[0] == total - moved
+    async with db.execute('SELECT (SELECT COUNT(*) FROM history_archive), (SELECT SUM(trades) FROM history_summary)') as query:
+        assert await query.fetchone() == (moved, moved)
+
+    # Summaries fold only the moved rows, so with what stayed they add up to the old totals
+    async with db.execute("""SELECT s.user_id, s.stock, s.bought_quantity + COALESCE(SUM(MAX(h.quantity, 0)), 0),
+                                    s.sold_value + COALESCE(SUM(MAX(-h.quantity, 0) * h.price), 0), s.trades + COUNT(h.id)
+                             FROM history_summary s
+                             LEFT JOIN history h ON h.user_id = s.user_id AND h.stock = s.stock AND h.time < '2021-01-01'
+                             GROUP BY s.user_id, s.stock""") as query:
+        for user_id, stock, bought, sold_value, trades in await query.fetchall():
+            assert [bought, trades] == [old[(user_id, stock)][0], old[(user_id, stock)][2]]
+            assert sold_value == pytest.approx(old[(user_id, stock)][1])
+
+    # Trading carries on, and deleting the user removes the archive too
+    await sell_stock(db, 1, 'AAPL', '100.00', 1)
+    compactor = HistoryCompactor(db, keep_days=0, interval=3600)
+    await compactor.compact_once()
+    assert compactor.stats()['runs'] == 1
+    await delete_user(db, 1)
+    async with db.execute('SELECT (SELECT COUNT(*) FROM history_archive WHERE user_id = 1), '
+                          '(SELECT COUNT(*) FROM history_summary WHERE user_id = 1)') as query:
+        assert await query.fetchone() == (0, 0)
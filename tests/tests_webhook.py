@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.webhook import build_app
+
+pytestmark = pytest.mark.asyncio
+
+SECRET = 'secret'
+
+
+def update(update_id: int) -> dict:
+    user = {'id': update_id, 'is_bot': False, 'first_name': 'user'}
+    return {'update_id': update_id, 'message': {'message_id': 1, 'date': int(time.time()), 'text': 'hi',
+                                                'chat': {'id': update_id, 'type': 'private'}, 'from': user}}
+
+
+async def serve(handle, concurrency: int = 2):
+    router = Router()
+    router.message()(handle)
+    dp = Dispatcher()
+    dp.include_router(router)
+
+    app, handler = build_app(dp, Bot('42:TEST'), '/webhook', SECRET, concurrency)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client, handler
+
+
+async def post(client: TestClient, update_id: int, secret: str = SECRET) -> int:
+    async with client.post('/webhook', json=update(update_id), headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+        return response.status
+
+
+async def test_webhook_rejects_wrong_secret():
+    handled = []
+
+    async def handle(message: Message):
+        handled.append(message.chat.id)
+
+    client, handler = await serve(handle)
+    try:
+        assert await post(client, 1, secret='guess') == 401
+        assert await post(client, 2) == 200
+        await asyncio.sleep(0.01)
+    finally:
+        await client.close()
+
+    assert handled == [2]
+    assert handler.stats()['handled'] == 1
+
+
+async def test_webhook_limits_concurrent_updates():
+    running = 0
+    peak = 0
+
+    async def handle(message: Message):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    client, handler = await serve(handle, concurrency=2)
+    try:
+        started = time.monotonic()
+        statuses = await asyncio.gather(*(post(client, i) for i in range(1, 7)))
+        answered = time.monotonic() - started
+        while handler.stats()['handled'] < 6:
+            await asyncio.sleep(0.01)
+    finally:
+        await client.close()
+
+    assert statuses == [200] * 6 and peak == 2
+    # Requests wait for a free slot: the last two are answered after two rounds of handling
+    assert answered >= 0.09
+    assert handler.stats() == {'handled': 6, 'in_flight': 0, 'peak_in_flight': 2}